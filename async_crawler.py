@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+import asyncio
+import time
+import aiohttp
+from page_rank import get_site, add_page_links, is_retryable, NOT_MODIFIED
+from link_extractor import CHUNK_SIZE, LinkScanner, extract_links
+from crawl_checkpoint import CrawlCheckpoint
+
+
+class TokenBucket(object):
+    '''
+        politeness limit for one host:
+        rate - tokens (requests) per second
+        capacity - maximal burst of requests
+    '''
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_update = time.monotonic()
+
+    def __refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.last_update) * self.rate)
+        self.last_update = now
+
+    async def acquire(self):
+        while True:
+            self.__refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+async def async_load_links(session, url, bucket, attempts=5, timeout=20,
+                           cache=None, executor=None):
+    # load page from url through shared keep-alive session
+    # executor - process pool to extract links, else page is scanned
+    # by chunks as they arrive
+    entry = None
+    headers = dict()
+    if cache is not None:
+        entry = cache.get(url)
+        if entry is not None:
+            if cache.is_fresh(entry):
+                return entry.links
+            headers = entry.conditional_headers()
+
+    for i in range(attempts):
+        await bucket.acquire()
+        try:
+            async with session.get(
+                    url, headers=headers,
+                    timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                response.raise_for_status()
+                if response.status == NOT_MODIFIED and entry is not None:
+                    cache.revalidated(url)
+                    return entry.links
+                encoding = response.charset
+                if executor is None:
+                    scanner = LinkScanner(url, encoding=encoding)
+                    links = []
+                    async for chunk in response.content.iter_chunked(
+                            CHUNK_SIZE):
+                        links.extend(scanner.feed(chunk))
+                    links.extend(scanner.close())
+                else:
+                    page = await response.read()
+
+            if executor is not None:
+                links = await asyncio.get_running_loop().run_in_executor(
+                    executor, extract_links, page, url, None, encoding)
+            if cache is not None:
+                cache.put(url, links, response.headers.get('ETag'),
+                          response.headers.get('Last-Modified'))
+            return links
+
+        except Exception as e:
+            print(e)
+            if i == attempts - 1:
+                raise e
+
+
+async def async_build_links(url, N, concurrency=10, rate=10, burst=1,
+                            attempts=5, timeout=20, checkpoint_path=None,
+                            checkpoint_every=100, cache=None, executor=None):
+    '''
+        same (links, urls) as page_rank.build_links: pages are fetched
+        concurrently, but their links are added to web-graph in order of
+        url index, so vertex numbering does not depend on timings
+        executor - concurrent.futures.ProcessPoolExecutor for link
+            extraction, so parsing is not bound to one core
+    '''
+    urls = [url]
+    urls_index = dict()
+    links = []
+    site = get_site(url)
+    buckets = dict()
+    tasks = dict()
+    start = 0
+    checkpoint = None
+    if checkpoint_path is not None:
+        checkpoint = CrawlCheckpoint(checkpoint_path, url, checkpoint_every)
+        start, links, urls, urls_index = checkpoint.load()
+    scheduled = start
+
+    def bucket_for(page_url):
+        host = get_site(page_url)
+        if host not in buckets:
+            buckets[host] = TokenBucket(rate, burst)
+        return buckets[host]
+
+    async def fetch(page_url, semaphore):
+        async with semaphore:
+            return await async_load_links(
+                session, page_url, bucket_for(page_url), attempts, timeout,
+                cache, executor)
+
+    async def crawl_page(i, task, retry=False):
+        links_count = len(links)
+        new_urls = []
+        failed = False
+        try:
+            links_from_url = await task
+            new_urls = add_page_links(
+                i, links_from_url, site, urls, urls_index, links)
+        except Exception as e:
+            print('page {} is not crawled: {}'.format(urls[i], e))
+            failed = is_retryable(e)
+
+        if checkpoint is not None:
+            checkpoint.add_page(
+                i, new_urls, links[links_count:], failed, retry)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        retries = dict()
+        try:
+            if checkpoint is not None:
+                for i in checkpoint.failed:
+                    retries[i] = asyncio.ensure_future(
+                        fetch(urls[i], semaphore))
+                for i in list(retries):
+                    await crawl_page(i, retries.pop(i), retry=True)
+
+            for i in range(start, N):
+                # schedule every known url which is still not requested
+                while scheduled < min(len(urls), N):
+                    tasks[scheduled] = asyncio.ensure_future(
+                        fetch(urls[scheduled], semaphore))
+                    scheduled += 1
+
+                if i not in tasks:
+                    break  # nothing more to crawl
+                await crawl_page(i, tasks.pop(i))
+
+        finally:
+            for task in [*tasks.values(), *retries.values()]:
+                task.cancel()
+            if checkpoint is not None:
+                checkpoint.flush()
+
+    return links, urls
+
+
+def build_links(url, N, concurrency=10, rate=10, burst=1,
+                checkpoint_path=None, cache=None, executor=None):
+    return asyncio.run(async_build_links(
+        url, N, concurrency, rate, burst, checkpoint_path=checkpoint_path,
+        cache=cache, executor=executor))
+
+
+def get_links(url, N, concurrency=10, rate=10, burst=1, checkpoint_path=None,
+              cache=None):
+    links, urls = build_links(
+        url, N, concurrency, rate, burst, checkpoint_path, cache)
+    return list(set(filter(lambda x: x[0] < N and x[1] < N, links))), urls[:N]
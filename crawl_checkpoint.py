@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+import json
+import os
+
+
+class CrawlCheckpoint(object):
+    '''
+    append-only on-disk store of a crawl:
+    first line - {"start": url}
+    next lines - one record per processed page i:
+        {"page": i, "urls": [new urls found on page i],
+         "links": [[i, j], ...]}
+    page which could not be loaded has "failed": true, and its later
+    reload has "retry": true instead of being next page
+    urls list (frontier and url -> id index) and edge list are restored by
+    replaying the records; a torn last record is dropped
+    failed - pages still to be loaded again, filled by load
+    '''
+
+    def __init__(self, path, url, checkpoint_every=100):
+        self.path = path
+        self.url = url
+        self.checkpoint_every = checkpoint_every
+        self.buffer = []
+        self.failed = []
+
+    def load(self):
+        # returns (number of processed pages, links, urls, urls_index)
+        urls = [self.url]
+        urls_index = dict()
+        links = []
+        pages = 0
+        self.failed = []
+
+        if not os.path.exists(self.path):
+            self.__append([{'start': self.url}])
+            return pages, links, urls, urls_index
+
+        valid_size = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError('torn record')
+                    record = json.loads(line)
+                except ValueError:
+                    break
+
+                if valid_size == 0:
+                    if record.get('start') != self.url:
+                        raise ValueError(
+                            'checkpoint {} belongs to crawl of {}'.format(
+                                self.path, record.get('start')))
+                else:
+                    page = record['page']
+                    if record.get('retry'):
+                        if page not in self.failed:
+                            raise ValueError('broken checkpoint {}'.format(
+                                self.path))
+                        self.failed.remove(page)
+                    elif page == pages:
+                        pages += 1
+                    else:
+                        raise ValueError('broken checkpoint {}'.format(
+                            self.path))
+                    if record.get('failed'):
+                        self.failed.append(page)
+                    for new_url in record['urls']:
+                        urls_index[new_url] = len(urls)
+                        urls.append(new_url)
+                    links.extend(tuple(link) for link in record['links'])
+                valid_size += len(line)
+
+        if valid_size == 0:
+            raise ValueError('broken checkpoint {}'.format(self.path))
+
+        if valid_size < os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid_size)
+
+        return pages, links, urls, urls_index
+
+    def add_page(self, page, new_urls, page_links, failed=False,
+                 retry=False):
+        record = {
+            'page': page,
+            'urls': new_urls,
+            'links': page_links
+        }
+        if failed:
+            record['failed'] = True
+        if retry:
+            record['retry'] = True
+        self.buffer.append(record)
+        if len(self.buffer) >= self.checkpoint_every:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.__append(self.buffer)
+            self.buffer = []
+
+    def __append(self, records):
+        with open(self.path, 'a') as f:
+            f.write(''.join(json.dumps(record) + '\n' for record in records))
+            f.flush()
+            os.fsync(f.fileno())
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+import os
+import numpy as np
+
+MAGIC = 0x5047524b45444745  # 'PGRKEDGE'
+VERSION = 1
+HEADER_SIZE = 5  # int64: magic, version, dtype size, N, E
+BLOCK_EDGES = 2 ** 22
+
+
+class EdgeFile(object):
+    '''
+    memory-mapped binary web-graph, edges are sorted by source:
+    header - int64 magic, version, size of vertex id (4 or 8), N, E
+    dst - E vertex ids (int32 or int64), links of vertex i are
+        dst[offsets[i]:offsets[i + 1]]
+    offsets - N + 1 int64
+    '''
+
+    def __init__(self, path):
+        header = np.fromfile(path, dtype=np.int64, count=HEADER_SIZE)
+        if len(header) < HEADER_SIZE or header[0] != MAGIC:
+            raise ValueError('{} is not an edge file'.format(path))
+        if header[1] != VERSION:
+            raise ValueError('unsupported edge file version {}'.format(
+                header[1]))
+        self.path = path
+        self.dtype = _vertex_dtype(int(header[2]))
+        self.N = int(header[3])
+        self.E = int(header[4])
+
+        dst_offset = HEADER_SIZE * 8
+        offsets_offset = _offsets_position(self.E, self.dtype)
+        self.dst = np.memmap(path, dtype=self.dtype, mode='r',
+                             offset=dst_offset, shape=(self.E,))
+        self.offsets = np.memmap(path, dtype=np.int64, mode='r',
+                                 offset=offsets_offset, shape=(self.N + 1,))
+
+    def out_degree(self, start=0, stop=None):
+        if stop is None:
+            stop = self.N
+        return np.diff(self.offsets[start:stop + 1])
+
+    def blocks(self, block_edges=BLOCK_EDGES):
+        # yields (first vertex, last vertex + 1, their links) by parts of
+        # about block_edges edges
+        for start, stop in _row_blocks(self.offsets, block_edges):
+            yield start, stop, np.asarray(
+                self.dst[self.offsets[start]:self.offsets[stop]])
+
+    def links(self):
+        # all edges as (E, 2) array, only for small graphs
+        sources = np.repeat(np.arange(self.N), self.out_degree())
+        return np.column_stack([sources, np.asarray(self.dst)])
+
+
+class EdgeFileWriter(object):
+    '''
+    builds EdgeFile from edges given by chunks without holding them
+    in memory:
+    path - result file
+    N - number of vertices
+    dtype - type of vertex ids, int32 if N allows
+    deduplicate - remove repeated edges (as get_links does)
+    '''
+
+    def __init__(self, path, N, dtype=None, deduplicate=True,
+                 block_edges=BLOCK_EDGES):
+        self.path = path
+        self.N = N
+        if dtype is None:
+            dtype = np.int32 if N < 2 ** 31 else np.int64
+        self.dtype = np.dtype(dtype)
+        self.deduplicate = deduplicate
+        self.block_edges = block_edges
+        self.out_degree = np.zeros(N, dtype=np.int64)
+        self.raw_path = path + '.raw'
+        self.raw = open(self.raw_path, 'wb')
+        self.E = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+        else:
+            self.raw.close()
+            os.remove(self.raw_path)
+
+    def add(self, links):
+        links = np.asarray(links, dtype=np.int64).reshape(-1, 2)
+        if len(links) and (links.min() < 0 or links.max() >= self.N):
+            raise ValueError('vertex id out of range [0, {})'.format(self.N))
+        # O(chunk) per chunk, not O(N)
+        sources, counts = np.unique(links[:, 0], return_counts=True)
+        self.out_degree[sources] += counts
+        self.raw.write(links.tobytes())
+        self.E += len(links)
+
+    def close(self):
+        self.raw.close()
+        csr_path = self.path + '.csr'
+        try:
+            offsets = np.zeros(self.N + 1, dtype=np.int64)
+            np.cumsum(self.out_degree, out=offsets[1:])
+            self.__scatter(offsets, csr_path)
+            self.__write(offsets, csr_path)
+        finally:
+            os.remove(self.raw_path)
+            if os.path.exists(csr_path):
+                os.remove(csr_path)
+
+    def __scatter(self, offsets, csr_path):
+        # place dst of every edge to its row of source
+        csr = np.lib.format.open_memmap(
+            csr_path, mode='w+', dtype=self.dtype, shape=(max(self.E, 1),))
+        fill = offsets[:-1].copy()
+        raw = np.memmap(self.raw_path, dtype=np.int64, mode='r',
+                        shape=(self.E, 2)) if self.E else np.zeros((0, 2))
+        for start in range(0, self.E, self.block_edges):
+            block = np.asarray(raw[start:start + self.block_edges])
+            order = np.argsort(block[:, 0], kind='stable')
+            src = block[order, 0]
+            rank = np.arange(len(src)) - np.searchsorted(src, src)
+            csr[fill[src] + rank] = block[order, 1]
+            sources, counts = np.unique(src, return_counts=True)
+            fill[sources] += counts
+        csr.flush()
+        del csr, raw
+
+    def __write(self, offsets, csr_path):
+        csr = np.load(csr_path, mmap_mode='r')
+        out_degree = self.out_degree
+        with open(self.path, 'wb') as f:
+            f.write(np.zeros(HEADER_SIZE, dtype=np.int64).tobytes())
+            E = 0
+            for start, stop in _row_blocks(offsets, self.block_edges):
+                dst = np.asarray(csr[offsets[start]:offsets[stop]])
+                if self.deduplicate:
+                    sources = np.repeat(np.arange(start, stop, dtype=np.int64),
+                                        self.out_degree[start:stop])
+                    keys = np.unique(sources * self.N + dst)
+                    dst = keys % self.N
+                    out_degree[start:stop] = np.bincount(
+                        keys // self.N - start, minlength=stop - start)
+                f.write(dst.astype(self.dtype).tobytes())
+                E += len(dst)
+
+            f.write(b'\0' * (_offsets_position(E, self.dtype) - f.tell()))
+            offsets[0] = 0
+            np.cumsum(out_degree, out=offsets[1:])
+            f.write(offsets.tobytes())
+            f.seek(0)
+            f.write(np.array([MAGIC, VERSION, self.dtype.itemsize, self.N, E],
+                             dtype=np.int64).tobytes())
+        self.E = E
+
+
+def write_edge_file(path, links, N, dtype=None, deduplicate=True):
+    with EdgeFileWriter(path, N, dtype, deduplicate) as writer:
+        writer.add(links)
+
+
+def edge_file_page_rank(path, damping_factor=0.15, tolerance=10 ** (-7),
+                        block_edges=BLOCK_EDGES, start_distribution=None):
+    '''
+        page_rank over EdgeFile: edges are streamed from disk by blocks
+        every iteration, memory is O(N + block_edges)
+    '''
+    edges = EdgeFile(path)
+    N = edges.N
+    # bincount of each block costs O(N), so blocks are not smaller than N
+    block_edges = max(block_edges, N)
+
+    if start_distribution is None:
+        cur_distr = np.ones(N) / N
+    else:
+        cur_distr = np.asarray(start_distribution, dtype=float).ravel()
+
+    while True:
+        prev_distr = cur_distr
+        cur_distr = np.zeros(N)
+        linking_mass = 0
+        for start, stop, dst in edges.blocks(block_edges):
+            out_degree = edges.out_degree(start, stop)
+            has_links = out_degree > 0
+            weights = np.zeros(stop - start)
+            weights[has_links] = prev_distr[start:stop][has_links] /\
+                out_degree[has_links]
+            linking_mass += prev_distr[start:stop][has_links].sum()
+            cur_distr += np.bincount(
+                dst, weights=np.repeat(weights, out_degree), minlength=N)
+
+        jump_mass = damping_factor * linking_mass +\
+            prev_distr.sum() - linking_mass
+        cur_distr = (1 - damping_factor) * cur_distr + jump_mass / N
+
+        if np.max(np.abs(prev_distr - cur_distr)) <= tolerance:
+            return cur_distr
+
+
+def _vertex_dtype(size):
+    if size == 4:
+        return np.dtype(np.int32)
+    if size == 8:
+        return np.dtype(np.int64)
+    raise ValueError('unsupported vertex id size {}'.format(size))
+
+
+def _offsets_position(E, dtype):
+    position = HEADER_SIZE * 8 + E * dtype.itemsize
+    return position + (-position) % 8
+
+
+def _row_blocks(offsets, block_edges):
+    # split rows to ranges of about block_edges edges
+    N = len(offsets) - 1
+    start = 0
+    while start < N:
+        stop = int(np.searchsorted(
+            offsets, offsets[start] + block_edges, side='right')) - 1
+        stop = min(max(stop, start + 1), N)
+        yield start, stop
+        start = stop
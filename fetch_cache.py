@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+import json
+import sqlite3
+import time
+from urllib.parse import urlparse, urlunparse
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_url(url):
+    # lowercase scheme and host, drop default port and fragment
+    parsed = urlparse(url)
+    scheme = parsed.scheme.lower()
+    netloc = parsed.netloc.lower()
+    default_port = ':{}'.format(DEFAULT_PORTS.get(scheme))
+    if netloc.endswith(default_port):
+        netloc = netloc[:-len(default_port)]
+    return urlunparse((scheme, netloc, parsed.path or '/', parsed.params,
+                       parsed.query, ''))
+
+
+class FetchCache(object):
+    '''
+    persistent cache of extracted page links:
+    path - sqlite file
+    max_size - bound of stored entries size (bytes), least recently
+        used entries are evicted
+    max_age - seconds during which entry is used without any request,
+        after it entry is revalidated with ETag / Last-Modified
+    '''
+
+    class Entry(object):
+        def __init__(self, links, etag, last_modified, fetched):
+            self.links = links
+            self.etag = etag
+            self.last_modified = last_modified
+            self.fetched = fetched
+
+        def conditional_headers(self):
+            headers = dict()
+            if self.etag is not None:
+                headers['If-None-Match'] = self.etag
+            if self.last_modified is not None:
+                headers['If-Modified-Since'] = self.last_modified
+            return headers
+
+    def __init__(self, path, max_size=64 * 2 ** 20, max_age=0):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS pages ('
+            'url TEXT PRIMARY KEY, links TEXT, etag TEXT, last_modified TEXT, '
+            'size INTEGER, fetched REAL, used INTEGER)')
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS pages_used ON pages (used)')
+        self.connection.commit()
+        # logical clock of uses for LRU order
+        self.clock = self.connection.execute(
+            'SELECT COALESCE(MAX(used), 0) FROM pages').fetchone()[0]
+
+    def __tick(self):
+        self.clock += 1
+        return self.clock
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get(self, url):
+        url = normalize_url(url)
+        row = self.connection.execute(
+            'SELECT links, etag, last_modified, fetched FROM pages '
+            'WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return None
+        self.connection.execute(
+            'UPDATE pages SET used = ? WHERE url = ?', (self.__tick(), url))
+        self.connection.commit()
+        return FetchCache.Entry(json.loads(row[0]), row[1], row[2], row[3])
+
+    def is_fresh(self, entry):
+        return time.time() - entry.fetched < self.max_age
+
+    def revalidated(self, url):
+        # page is not modified (304)
+        self.connection.execute(
+            'UPDATE pages SET fetched = ? WHERE url = ?',
+            (time.time(), normalize_url(url)))
+        self.connection.commit()
+
+    def put(self, url, links, etag=None, last_modified=None):
+        url = normalize_url(url)
+        data = json.dumps(links)
+        size = len(url) + len(data) + len(etag or '') +\
+            len(last_modified or '')
+        self.connection.execute(
+            'INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (url, data, etag, last_modified, size, time.time(),
+             self.__tick()))
+        self.__evict()
+        self.connection.commit()
+
+    def size(self):
+        return self.connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM pages').fetchone()[0]
+
+    def __len__(self):
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM pages').fetchone()[0]
+
+    def __evict(self):
+        excess = self.size() - self.max_size
+        if excess <= 0:
+            return
+        evicted = []
+        for url, size in self.connection.execute(
+                'SELECT url, size FROM pages ORDER BY used'):
+            if excess <= 0:
+                break
+            evicted.append((url,))
+            excess -= size
+        self.connection.executemany('DELETE FROM pages WHERE url = ?', evicted)
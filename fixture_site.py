@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FixtureSite(object):
+    '''
+        local stand-in web site: page k links to a few other pages,
+        to an outer site and (for k = 0) to a missing page
+        pages - number of pages
+        links_per_page - number of links to other pages of site
+        padding - bytes of text on every page
+        delay - seconds before every answer, as network round trip
+        failing - paths answered by server error
+    '''
+
+    def __init__(self, pages=40, links_per_page=2, padding=0, delay=0):
+        self.pages = pages
+        self.links_per_page = links_per_page
+        self.padding = padding
+        self.delay = delay
+        self.requests = []
+        self.not_modified = 0
+        self.failing = set()
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive
+
+            def do_GET(self):
+                site.requests.append(self.path)
+                if site.delay:
+                    time.sleep(site.delay)
+                if self.path in site.failing:
+                    self.send_error(503)
+                    return
+                body = site.page(self.path)
+                if body is None:
+                    self.send_error(404)
+                    return
+                etag = '"{}"'.format(hash(body))
+                if self.headers.get('If-None-Match') == etag:
+                    site.not_modified += 1
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+                body = body.encode()
+                self.send_response(200)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Type', 'text/html')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}/page/0'.format(
+            self.server.server_address[1])
+
+    def page(self, path):
+        try:
+            k = int(path.rsplit('/', 1)[1])
+        except ValueError:
+            return None
+        if not 0 <= k < self.pages:
+            return None
+        targets = [(k * 7 + 1) % self.pages, (k + 3) % self.pages] +\
+            [(k * (j + 11) + j) % self.pages
+             for j in range(self.links_per_page - 2)]
+        hrefs = ['/page/{}'.format(target)
+                 for target in targets[:self.links_per_page]]
+        hrefs.append('http://outer.example/page/{}'.format(k))
+        if k == 0:
+            hrefs.append('/page/missing')
+        return '<html><body><p>{}</p>{}</body></html>'.format(
+            'x' * self.padding,
+            ''.join('<p><a href="{}">link</a></p>'.format(href)
+                    for href in hrefs))
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
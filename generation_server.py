@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+'''
+long-running text generation service for text_generator models:
+model is loaded once, requests are json lines
+    {"id": 1, "depth": 2, "size": 10, "seed": 5}
+answered with
+    {"id": 1, "text": "..."} or {"id": 1, "error": "..."}
+and request {"stats": true} is answered with counters;
+requests come from local tcp socket or from stdin (answers to stdout),
+answers may come in other order than requests; batches are sampled
+in thread of executor, so loop keeps reading requests meanwhile
+'''
+import asyncio
+import json
+import random
+import sys
+from collections import deque
+from time import perf_counter
+
+MAX_BATCH = 256
+BATCH_DELAY = 0.002  # seconds to wait for more requests of batch
+MAX_SIZE = 10 ** 5  # tokens of one request
+
+
+def _is_integer(value):
+    # json true and false are bool, which is int too
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def generate_batch(model, jobs):
+    '''
+        jobs - list of (depth, size, rnd); returns token lists, same as
+        text_generator._generate_random_text_with(model, depth, size, rnd)
+        for every job; all jobs make their steps together by
+        model.sample_many
+    '''
+    histories = [deque() for job in jobs]
+    texts = [[] for job in jobs]
+    if model.find(()) is None:  # model without tokens
+        return texts
+    for step in range(max([size for depth, size, rnd in jobs], default=0)):
+        active = [j for j, job in enumerate(jobs) if step < job[1]]
+        tokens = model.sample_many([histories[j] for j in active],
+                                   [jobs[j][2] for j in active])
+        # unknown history: start again from empty one
+        restarted = [i for i, token in enumerate(tokens) if token is None]
+        for i, token in zip(restarted, model.sample_many(
+                [()] * len(restarted), [jobs[active[i]][2]
+                                        for i in restarted])):
+            histories[active[i]] = deque()
+            tokens[i] = token
+        for j, token in zip(active, tokens):
+            histories[j].append(token)
+            if len(histories[j]) > jobs[j][0]:
+                histories[j].popleft()
+            texts[j].append(model.vocabulary[token])
+    return texts
+
+
+class GenerationServer(object):
+    '''
+    answers generation requests by batches: requests which come while
+    batch_delay passes after first one are sampled together (at most
+    max_batch of them)
+
+    format_text - function of generated tokens making text of answer
+    max_size - largest size of one request
+    '''
+
+    def __init__(self, model, format_text=' '.join, max_batch=MAX_BATCH,
+                 batch_delay=BATCH_DELAY, max_size=MAX_SIZE):
+        self.model = model
+        self.format_text = format_text
+        self.max_batch = max_batch
+        self.batch_delay = batch_delay
+        self.max_size = max_size
+        self.queue = None
+        self.batcher = None
+
+        self.started = perf_counter()
+        self.requests = 0
+        self.errors = 0
+        self.answered = 0
+        self.tokens = 0
+        self.batches = 0
+        self.batched = 0
+        self.latency_sum = 0
+        self.latency_max = 0
+
+    def stats(self):
+        seconds = perf_counter() - self.started
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'answered': self.answered,
+            'tokens': self.tokens,
+            'batches': self.batches,
+            'mean_batch_size': self.batched / max(self.batches, 1),
+            'mean_latency': self.latency_sum / max(self.answered, 1),
+            'max_latency': self.latency_max,
+            'tokens_per_second': self.tokens / max(seconds, 1e-9)
+        }
+
+    async def generate(self, depth=None, size=1, seed=None):
+        # generated text, ValueError for wrong parameters
+        if depth is None:
+            depth = self.model.depth
+        if not _is_integer(depth) or not 0 <= depth <= self.model.depth:
+            raise ValueError('depth must be in [0, {}]'.format(
+                self.model.depth))
+        if not _is_integer(size) or not 0 <= size <= self.max_size:
+            raise ValueError('size must be integer in [0, {}]'.format(
+                self.max_size))
+        if isinstance(seed, bool) or\
+                not isinstance(seed, (type(None), int, float, str)):
+            raise ValueError('seed must be number, string or null')
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+            self.batcher = asyncio.ensure_future(self.__run_batches())
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put(((depth, size, random.Random(seed)), future))
+        return await future
+
+    async def __run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            await asyncio.sleep(self.batch_delay)
+            while len(batch) < self.max_batch and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                texts = await loop.run_in_executor(
+                    None, generate_batch, self.model,
+                    [job for job, _ in batch])
+            except Exception as e:
+                for job, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.batched += len(batch)
+            for (job, future), tokens in zip(batch, texts):
+                self.tokens += len(tokens)
+                if not future.done():
+                    future.set_result(self.format_text(tokens))
+
+    async def answer(self, line):
+        # answer dict for request line
+        start = perf_counter()
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('request must be json object')
+            request_id = request.get('id')
+            if request.get('stats'):
+                return {'id': request_id, 'stats': self.stats()}
+            self.requests += 1
+            text = await self.generate(request.get('depth'),
+                                       request.get('size', 1),
+                                       request.get('seed'))
+        except Exception as e:  # bad request must not end connection
+            self.errors += 1
+            return {'id': request_id, 'error': str(e)}
+        latency = perf_counter() - start
+        self.answered += 1
+        self.latency_sum += latency
+        self.latency_max = max(self.latency_max, latency)
+        return {'id': request_id, 'text': text}
+
+    async def handle_connection(self, reader, writer):
+        # json lines connection, every request is answered when ready
+        async def respond(line):
+            writer.write(json.dumps(await self.answer(line)).encode() +
+                         b'\n')
+            await writer.drain()
+
+        tasks = set()  # answers being made, finished ones drop out
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    task = asyncio.ensure_future(respond(line))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        finally:
+            writer.close()
+
+    async def serve_tcp(self, host='127.0.0.1', port=0, ready=None):
+        '''
+            serves until cancelled; ready - callback of bound port
+        '''
+        server = await asyncio.start_server(
+            self.handle_connection, host, port)
+        if ready is not None:
+            ready(server.sockets[0].getsockname()[1])
+        async with server:
+            await server.serve_forever()
+
+    async def serve_lines(self, input_file=sys.stdin, output_file=sys.stdout):
+        # line protocol on text files, until end of input_file
+        loop = asyncio.get_running_loop()
+
+        async def respond(line):
+            print(json.dumps(await self.answer(line)), file=output_file,
+                  flush=True)
+
+        tasks = set()
+        while True:
+            line = await loop.run_in_executor(None, input_file.readline)
+            if not line:
+                break
+            if line.strip():
+                task = asyncio.ensure_future(respond(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
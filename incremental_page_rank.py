@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+import numpy as np
+from page_rank import sparse_page_rank
+
+KEY_SHIFT = 32  # edge key = src << KEY_SHIFT | dst
+PUSH_SHARE = 0.1  # residuals above this share of largest one are pushed
+
+
+def _row_ranges(indptr, rows):
+    # indices of all entries of given CSR rows, and sizes of rows
+    starts = indptr[rows]
+    counts = indptr[rows + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return offsets + np.arange(counts.sum()), counts
+
+
+class IncrementalPageRank(object):
+    '''
+    web-graph with its page rank, kept up to date after graph changes
+
+    rank x is kept together with its residual
+        R = d / N + (1 - d) * S^T x - x
+    (S is transition matrix with uniform rows for vertices without
+    links) as vector r plus uniform part, which comes from vertices
+    without links and is kept as a scalar; a graph change only adds
+    residual at links of changed vertices, rank() pushes residual from
+    vertices where it is large to their links (largest first) and stops
+    when |R|_1 <= d * tolerance, which bounds L1 error of rank by
+    tolerance, so push work grows with rank mass of changed vertices
+    over tolerance, not with size of graph; uniform residual is removed
+    by scaling of x, which is done lazily
+
+    edges are kept sorted by source (CSR), so adding and removing edges
+    costs a memory move of edge arrays, but no sparse products;
+    remove_nodes renumbers vertices and computes residual again
+
+    links - initial directed graph of links
+    N - initial number of vertices
+    tolerance - bound of L1 error of rank (default is about L1 error
+        of sparse_page_rank with its default tolerance)
+    '''
+
+    def __init__(self, links=(), N=0, damping_factor=0.15,
+                 tolerance=10 ** (-5)):
+        links = np.asarray(links, dtype=np.int64).reshape(-1, 2)
+        self.N = N
+        self.damping_factor = damping_factor
+        self.tolerance = tolerance
+        self.__check_vertices(links)
+        order = np.argsort(links[:, 0], kind='stable')
+        self.src = links[order, 0]
+        self.dst = links[order, 1]
+        self.indptr = np.zeros(N + 1, dtype=np.int64)
+        self.indptr[1:] = np.cumsum(np.bincount(self.src, minlength=N))
+
+        # max change of power iteration below d * tolerance / N gives
+        # residual of about d * tolerance in L1
+        self.distribution = sparse_page_rank(
+            links, np.ones((1, N)) / N, damping_factor,
+            damping_factor * tolerance / max(N, 1)) if N else np.zeros(0)
+        self.__compute_residual()
+        self.pushed_edges = 0  # work of last update, in edge traversals
+        self.rank()
+
+    def __check_vertices(self, vertices):
+        vertices = np.asarray(vertices)
+        if vertices.size and (vertices.min() < 0 or vertices.max() >= self.N):
+            raise ValueError('vertex id out of range [0, {})'.format(self.N))
+
+    def __compute_residual(self):
+        # exact residual of distribution, every vertex is pending
+        N = self.N
+        d = self.damping_factor
+        x = self.distribution
+        degrees = np.diff(self.indptr)
+        dangling = degrees == 0
+        self.residual = (d + (1 - d) * x[dangling].sum()) / N +\
+            (1 - d) * np.bincount(
+                self.dst, weights=x[self.src] / degrees[self.src],
+                minlength=N) - x if N else np.zeros(0)
+        self.uniform = 0.0
+        self.residual_norm = np.abs(self.residual).sum()
+        self.pending = np.arange(N)
+
+    def __spread(self, sources, sign):
+        '''
+            adds sign * (1 - d) * S^T x of given vertices to residual:
+            with sign -1 before change of their links and +1 after it
+        '''
+        sources = np.unique(sources)
+        x = self.distribution
+        rows, counts = _row_ranges(self.indptr, sources)
+        weights = sign * (1 - self.damping_factor) * x[sources]
+        self.uniform += weights[counts == 0].sum() / self.N
+        self.pending = np.union1d(self.pending, self.__add_residual(
+            self.dst[rows], np.repeat(weights / np.maximum(counts, 1),
+                                      counts)))
+
+    def __add_residual(self, vertices, values):
+        # residual[vertices] += values (repeated vertices are summed),
+        # returns changed vertices
+        vertices, inverse = np.unique(vertices, return_inverse=True)
+        values = np.bincount(inverse, weights=values,
+                             minlength=len(vertices))
+        before = np.abs(self.residual[vertices]).sum()
+        self.residual[vertices] += values
+        self.residual_norm += np.abs(self.residual[vertices]).sum() - before
+        return vertices
+
+    def links(self):
+        return list(zip(self.src.tolist(), self.dst.tolist()))
+
+    def add_nodes(self, count=1):
+        # returns ids of new vertices
+        N, new_N = self.N, self.N + count
+        d = self.damping_factor
+        x = self.distribution
+        # teleport and links of dangling vertices are spread over new
+        # number of vertices: uniform change of residual
+        jump_mass = d + (1 - d) * x[np.diff(self.indptr) == 0].sum()
+        self.uniform += jump_mass / new_N - (jump_mass / N if N else 0)
+        new_residual = np.full(count, jump_mass / new_N - self.uniform)
+        self.residual = np.concatenate([self.residual, new_residual])
+        self.residual_norm += np.abs(new_residual).sum()
+        self.distribution = np.concatenate([x, np.zeros(count)])
+        self.indptr = np.concatenate([
+            self.indptr, np.full(count, self.indptr[-1])])
+        new_nodes = np.arange(N, new_N)
+        self.N = new_N
+        self.pending = np.union1d(self.pending, new_nodes)
+        return new_nodes
+
+    def remove_nodes(self, nodes):
+        # removes vertices with their links, other vertices are renumbered
+        # keeping order; returns array old id -> new id (-1 for removed)
+        self.__check_vertices(nodes)
+        kept = np.ones(self.N, dtype=bool)
+        kept[np.asarray(nodes, dtype=np.int64)] = False
+        new_ids = np.full(self.N, -1, dtype=np.int64)
+        new_ids[kept] = np.arange(kept.sum())
+
+        kept_edges = kept[self.src] & kept[self.dst]
+        self.src = new_ids[self.src[kept_edges]]
+        self.dst = new_ids[self.dst[kept_edges]]
+        self.N = int(kept.sum())
+        self.indptr = np.zeros(self.N + 1, dtype=np.int64)
+        self.indptr[1:] = np.cumsum(np.bincount(self.src, minlength=self.N))
+        self.distribution = self.distribution[kept]
+        self.__compute_residual()
+        return new_ids
+
+    def add_edges(self, links):
+        links = np.asarray(links, dtype=np.int64).reshape(-1, 2)
+        self.__check_vertices(links)
+        links = links[np.argsort(links[:, 0], kind='stable')]
+        self.__spread(links[:, 0], -1)
+        positions = self.indptr[links[:, 0] + 1]
+        self.src = np.insert(self.src, positions, links[:, 0])
+        self.dst = np.insert(self.dst, positions, links[:, 1])
+        self.indptr[1:] += np.cumsum(np.bincount(links[:, 0],
+                                                 minlength=self.N))
+        self.__spread(links[:, 0], 1)
+
+    def remove_edges(self, links):
+        # removes all copies of given links
+        links = np.asarray(links, dtype=np.int64).reshape(-1, 2)
+        links = links[(links >= 0).all(axis=1) & (links < self.N).all(axis=1)]
+        sources = np.unique(links[:, 0])
+        rows, counts = _row_ranges(self.indptr, sources)
+        removed = rows[np.isin(
+            (self.src[rows] << KEY_SHIFT) | self.dst[rows],
+            (links[:, 0] << KEY_SHIFT) | links[:, 1])]
+        self.__spread(sources, -1)
+        self.indptr[1:] -= np.cumsum(np.bincount(self.src[removed],
+                                                 minlength=self.N))
+        self.src = np.delete(self.src, removed)
+        self.dst = np.delete(self.dst, removed)
+        self.__spread(sources, 1)
+
+    def rank(self):
+        if len(self.pending):
+            self.__update()
+        return self.distribution
+
+    def __update(self):
+        '''
+            pushes residual of pending vertices, x_v += r_v and r_v is
+            spread to links of v, while |R|_1 > d * tolerance; vertex is
+            pushed when |r_v| is above its share of that bound (by number
+            of its links), only vertices which got residual are checked
+            again; uniform part u of residual is removed by scaling
+                x, r *= 1 + k, k = u * N / (d - u * N)
+            (R is affine in x, and (1 + k) * R(x) - k * d / N is R of
+            (1 + k) * x), done lazily by scale
+        '''
+        N = self.N
+        d = self.damping_factor
+        self.pushed_edges = 0
+        if N == 0:
+            self.pending = np.zeros(0, dtype=np.int64)
+            return
+
+        bound = d * self.tolerance
+        share = bound / 2 / (len(self.dst) + N)  # of one link
+
+        def weights_of(vertices):
+            # vertex is pushed when |r_v| > share * weight
+            return np.maximum(self.indptr[vertices + 1] -
+                              self.indptr[vertices], 1)
+
+        x = self.distribution
+        residual = self.residual
+        scale = 1.0  # true x and r are scale * x and scale * r
+
+        active = self.pending[np.abs(residual[self.pending]) >
+                              share * weights_of(self.pending)]
+        while True:
+            if N * abs(self.uniform) > bound / 2:
+                if self.uniform * N < d:
+                    k = self.uniform * N / (d - self.uniform * N)
+                    scale *= 1 + k
+                else:  # too large to scale, spread it
+                    residual += self.uniform / scale
+                    self.residual_norm = np.abs(residual).sum()
+                    active = np.flatnonzero(scale * np.abs(residual) >
+                                            share * weights_of(np.arange(N)))
+                self.uniform = 0.0
+            if not len(active) or\
+                    scale * self.residual_norm + N * abs(self.uniform) <=\
+                    bound:
+                break
+
+            # largest residuals per link first
+            ratios = np.abs(residual[active]) / weights_of(active)
+            selected = ratios >= PUSH_SHARE * ratios.max()
+            waiting = active[~selected]
+            active = active[selected]
+            pushed = residual[active]
+            x[active] += pushed
+            residual[active] = 0
+            self.residual_norm -= np.abs(pushed).sum()
+
+            rows, counts = _row_ranges(self.indptr, active)
+            weights = (1 - d) * pushed
+            self.uniform += scale * weights[counts == 0].sum() / N
+            touched = self.__add_residual(self.dst[rows], np.repeat(
+                weights / np.maximum(counts, 1), counts))
+            self.pushed_edges += len(rows)
+            active = np.union1d(waiting, touched[
+                scale * np.abs(residual[touched]) >
+                share * weights_of(touched)])
+
+        if scale != 1:
+            x *= scale
+            residual *= scale
+            self.residual_norm *= scale
+        self.pending = active
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+'''
+ensemble of LifeModel runs for parameter sweeps:
+
+    python3 life_ensemble.py --output sweep --steps 200 --seeds 10 \\
+        --param probability_victim_move=0.1,0.25,0.5 \\
+        --param time_to_death=3,5 --set row_number=100 column_number=100
+
+every combination of --param values is run with every seed; runs are
+made by pool of processes, each run has its own random stream spawned
+from --base-seed by run number; life counters of every step are
+appended to columnar output directory, and sweep interrupted at any
+moment is resumed by running same command again
+'''
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import numpy as np
+from life_model import LifeModel, ENGINES, str_to_numb
+
+COLUMNS = ('run', 'step', 'victims', 'predators')
+COLUMN_DTYPE = np.dtype('<i4')
+MANIFEST = 'runs.jsonl'
+
+
+def sweep_runs(grid, seeds):
+    '''
+        grid - {parameter: [values]}; returns list of (run number,
+        parameters) for all combinations of values (parameters in sorted
+        order) times seeds
+    '''
+    names = sorted(grid)
+    runs = []
+    for values in itertools.product(*[grid[name] for name in names]):
+        for seed in range(seeds):
+            runs.append((len(runs), dict(zip(names, values))))
+    return runs
+
+
+def run_model(task):
+    '''
+        task - (run, parameters, steps, engine, base_seed);
+        returns (run, (steps, 2) array of victims and predators)
+    '''
+    run, parameters, steps, engine, base_seed = task
+    seed_sequence = np.random.SeedSequence(base_seed, spawn_key=(run,))
+    if engine == 'objects':  # seeds global random
+        random_state = int(seed_sequence.generate_state(1)[0])
+    else:
+        random_state = seed_sequence
+    model = ENGINES[engine](random_state=random_state, **parameters)
+    counts = np.zeros((steps, 2), dtype=COLUMN_DTYPE)
+    for step in range(steps):
+        model.generate_next_turn()
+        counts[step] = (model.life_counter[LifeModel.CellType.VICTIM],
+                        model.life_counter[LifeModel.CellType.PREDATOR])
+    return run, counts
+
+
+class EnsembleOutput(object):
+    '''
+    columnar output directory of ensemble:
+    COLUMNS - one file of little-endian int32 values per column,
+        one row per step of run, rows of run are contiguous
+    runs.jsonl - first line is sweep settings, next lines - one record
+        per finished run: {"run", "parameters", "rows": [start, stop]}
+    run is finished when its record is written after its rows; rows
+    after last record and torn last record are dropped on load
+    '''
+
+    def __init__(self, path, settings):
+        self.path = path
+        self.settings = settings
+        self.runs = dict()  # run -> record
+        self.rows = 0
+        os.makedirs(path, exist_ok=True)
+
+    def __file(self, name):
+        return os.path.join(self.path, name)
+
+    def load(self):
+        # returns records of finished runs by run number
+        manifest = self.__file(MANIFEST)
+        if not os.path.exists(manifest):
+            self.__append(self.settings)
+        else:
+            valid_size = 0
+            with open(manifest, 'rb') as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b'\n'):
+                            raise ValueError('torn record')
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    if valid_size == 0:
+                        if record != self.settings:
+                            raise ValueError(
+                                'output {} belongs to other sweep: {}'.format(
+                                    self.path, record))
+                    else:
+                        self.runs[record['run']] = record
+                        self.rows = max(self.rows, record['rows'][1])
+                    valid_size += len(line)
+            if valid_size == 0:
+                raise ValueError('broken output {}'.format(self.path))
+            if valid_size < os.path.getsize(manifest):
+                with open(manifest, 'r+b') as f:
+                    f.truncate(valid_size)
+
+        for column in COLUMNS:
+            with open(self.__file(column), 'ab') as f:
+                f.truncate(self.rows * COLUMN_DTYPE.itemsize)
+        return self.runs
+
+    def add_run(self, run, parameters, counts):
+        steps = len(counts)
+        values = {
+            'run': np.full(steps, run),
+            'step': np.arange(1, steps + 1),
+            'victims': counts[:, 0],
+            'predators': counts[:, 1]
+        }
+        for column in COLUMNS:
+            with open(self.__file(column), 'ab') as f:
+                f.write(values[column].astype(COLUMN_DTYPE).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        record = {'run': run, 'parameters': parameters,
+                  'rows': [self.rows, self.rows + steps]}
+        self.__append(record)
+        self.runs[run] = record
+        self.rows += steps
+
+    def __append(self, record):
+        with open(self.__file(MANIFEST), 'a') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def read_ensemble(path):
+    '''
+        returns (settings, records of finished runs sorted by run,
+        {column: memory-mapped array}) of output directory
+    '''
+    with open(os.path.join(path, MANIFEST)) as f:
+        lines = f.read().split('\n')[:-1]  # last line may be torn
+    settings = json.loads(lines[0])
+    records = sorted((json.loads(line) for line in lines[1:]),
+                     key=lambda record: record['run'])
+    rows = max([record['rows'][1] for record in records], default=0)
+    columns = {column: np.memmap(os.path.join(path, column),
+                                 dtype=COLUMN_DTYPE, mode='r', shape=(rows,))
+               if rows else np.zeros(0, dtype=COLUMN_DTYPE)
+               for column in COLUMNS}
+    return settings, records, columns
+
+
+def run_ensemble(path, grid, seeds, steps, fixed=None, engine='active',
+                 processes=None, base_seed=0):
+    '''
+        runs sweep (see sweep_runs) with fixed parameters of all runs,
+        skips runs finished in output path before;
+        returns number of runs made now
+    '''
+    fixed = dict(fixed or {})
+    settings = {'columns': list(COLUMNS), 'grid': grid, 'seeds': seeds,
+                'steps': steps, 'fixed': fixed, 'engine': engine,
+                'base_seed': base_seed}
+    output = EnsembleOutput(path, json.loads(json.dumps(settings)))
+    finished = output.load()
+
+    runs = dict((run, parameters) for run, parameters
+                in sweep_runs(grid, seeds) if run not in finished)
+    tasks = [(run, dict(fixed, **parameters), steps, engine, base_seed)
+             for run, parameters in runs.items()]
+    if not tasks:
+        return 0
+    with multiprocessing.Pool(processes) as pool:
+        for run, counts in pool.imap_unordered(run_model, tasks):
+            output.add_run(run, runs[run], counts)
+    return len(tasks)
+
+
+def _parse_values(text):
+    # 'name=v1,v2' -> (name, [values])
+    name, values = text.split('=', 1)
+    return name, [str_to_numb(value) for value in values.split(',')]
+
+
+def main(arg_list):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', required=True, help='output directory')
+    parser.add_argument('--steps', type=int, default=100)
+    parser.add_argument('--seeds', type=int, default=1,
+                        help='runs of every combination of parameters')
+    parser.add_argument('--param', action='append', default=[],
+                        type=_parse_values, help='name=value1,value2,...')
+    parser.add_argument('--set', nargs='+', default=[], type=_parse_values,
+                        help='name=value of all runs')
+    parser.add_argument('--engine', choices=sorted(ENGINES),
+                        default='active')
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--base-seed', type=int, default=0)
+    args = parser.parse_args(arg_list)
+
+    made = run_ensemble(
+        args.output, dict(args.param), args.seeds, args.steps,
+        {name: values[0] for name, values in args.set}, args.engine,
+        args.processes, args.base_seed)
+    settings, records, columns = read_ensemble(args.output)
+    print('{} runs made, {} of {} runs finished'.format(
+        made, len(records), len(sweep_runs(settings['grid'],
+                                           settings['seeds']))))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
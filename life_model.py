@@ -4,6 +4,7 @@ import time
 from copy import copy
 from enum import IntEnum
 import random
+import numpy as np
 
 DEFAULT_GENERATION_TIME = 100
 
@@ -198,6 +199,278 @@ class LifeModel(object):
         self.step += 1
 
 
+# neighbour masks (bit i - direction i is available) -> number of
+# available directions, r-th available direction
+NEIGHBOUR_COUNTS = np.array([bin(mask).count('1') for mask in range(16)])
+NEIGHBOUR_CHOICES = np.array([
+    ([d for d in range(4) if mask >> d & 1] + [0] * 4)[:4]
+    for mask in range(16)])
+
+
+class ArrayLifeModel(object):
+    '''
+    LifeModel with field kept in numpy arrays: cell types (uint8),
+    predator times to death and times to reproduction (int16); arrays
+    have border of walls, so neighbours of any inner cell are at fixed
+    offsets of flat index
+
+    rules are rules of LifeModel, but all cells make every phase of turn
+    at once: reproduction of cells with zero time to reproduction, then
+    eating of victims by predators, then random moves; cells which chose
+    same target cell are resolved by random order of claims (loser stays
+    where it is), cells born in turn make their first move next turn;
+    time to death stays in cell when it becomes free space, as in
+    LifeModel.Cell
+    '''
+
+    OFFSETS_ORDER = LifeModel.DIRECTIONS
+
+    def __init__(
+            self, row_number=10, column_number=10, probability_victim_cell=0.25,
+            probability_predator_cell=0.25, probability_wall_cell=0.25,
+            probability_victim_move=0.25, probability_predator_move=0.5, time_to_death=3,
+            time_to_reproduction_victims=5, time_to_reproduction_predators=5,
+            visualize=0, visualisation_pause=0, random_state=None):
+        self.row_number = row_number
+        self.column_number = column_number
+        self.probability_victim_move = probability_victim_move
+        self.probability_predator_move = probability_predator_move
+        self.time_to_death = time_to_death
+        self.time_to_reproduction_victims = time_to_reproduction_victims
+        self.time_to_reproduction_predators = time_to_reproduction_predators
+        self.visualize = visualize
+        self.visualisation_pause = visualisation_pause
+        self.step = 0
+        self.random = np.random.default_rng(random_state)
+
+        if probability_victim_cell + probability_predator_cell +\
+                probability_wall_cell > 1:
+            raise Exception('Incorrect probabilities: p1 + p2 + p3 > 1\n')
+
+        # by cell type: FREE_SPACE, VICTIM, PREDATOR, WALL
+        self.reproduction_times = np.array(
+            [time_to_reproduction_predators, time_to_reproduction_victims,
+             time_to_reproduction_predators, time_to_reproduction_predators],
+            dtype=np.int16)
+        self.move_probabilities = np.array(
+            [0, probability_victim_move, probability_predator_move, 0])
+
+        width = column_number + 2
+        self.offsets = np.array([row * width + column
+                                 for row, column in self.OFFSETS_ORDER])
+        thresholds = np.cumsum([probability_victim_cell,
+                                probability_predator_cell,
+                                probability_wall_cell])
+        self.cell_types = np.full((row_number + 2, width),
+                                  LifeModel.CellType.WALL, dtype=np.uint8)
+        self.cell_types[1:-1, 1:-1] = np.where(
+            self.random.random((row_number, column_number))[..., None] <
+            thresholds, np.arange(1, 4, dtype=np.uint8), 4).min(axis=-1) % 4
+        self.times_to_death = np.full(self.cell_types.shape, time_to_death,
+                                      dtype=np.int16)
+        self.times_to_reproduction = self.reproduction_times[self.cell_types]
+        self.claims = np.zeros(self.cell_types.shape, dtype=np.int64)
+        self.life_counter = self._count_life()
+
+    def field(self):
+        # (row_number, column_number) array of cell types
+        return self.cell_types[1:-1, 1:-1]
+
+    def set_field(self, field, times_to_death=None,
+                  times_to_reproduction=None):
+        '''
+            replaces cell types and times of cells (arrays of field shape),
+            times are reset as for new cells if not given
+        '''
+        self.field()[...] = field
+        self.times_to_death[1:-1, 1:-1] = self.time_to_death\
+            if times_to_death is None else times_to_death
+        self.times_to_reproduction[...] = self.reproduction_times[
+            self.cell_types]
+        if times_to_reproduction is not None:
+            self.times_to_reproduction[1:-1, 1:-1] = times_to_reproduction
+        self.life_counter = self._count_life()
+
+    def _living_cells(self):
+        # sorted flat indices of victims and predators
+        types = self.cell_types.ravel()
+        return np.flatnonzero((types == LifeModel.CellType.VICTIM) |
+                              (types == LifeModel.CellType.PREDATOR))
+
+    def _count_life(self):
+        counts = np.bincount(self.cell_types.ravel(), minlength=4)
+        return {LifeModel.CellType.VICTIM: int(counts[1]),
+                LifeModel.CellType.PREDATOR: int(counts[2])}
+
+    def _random_values(self, cells, stream):
+        # uniform random value for every cell, stream - name of phase
+        return self.random.random(len(cells))
+
+    def _choose_neighbours(self, cells, cell_type, stream):
+        '''
+            random neighbour of given type for every cell;
+            returns (cells which have such neighbours, chosen neighbours)
+        '''
+        types = self.cell_types.ravel()
+        masks = np.zeros(len(cells), dtype=np.uint8)
+        for bit, offset in enumerate(self.offsets):
+            masks |= (types[cells + offset] == cell_type).astype(np.uint8)\
+                << bit
+        counts = NEIGHBOUR_COUNTS[masks]
+        choices = (self._random_values(cells, stream) * counts).astype(
+            np.int64)
+        found = counts > 0
+        cells, masks, choices = cells[found], masks[found], choices[found]
+        return cells, cells + self.offsets[NEIGHBOUR_CHOICES[masks, choices]]
+
+    def _resolve_conflicts(self, cells, targets, stream):
+        '''
+            one cell for every target, winner is random: cells claim
+            targets in random order, last claim stays
+        '''
+        order = self.random.permutation(len(cells))
+        claims = self.claims.ravel()
+        claims[targets[order]] = order
+        won = claims[targets] == np.arange(len(cells))
+        return cells[won], targets[won]
+
+    def _move(self, sources, targets):
+        types = self.cell_types.ravel()
+        times_to_death = self.times_to_death.ravel()
+        times_to_reproduction = self.times_to_reproduction.ravel()
+        types[targets] = types[sources]
+        times_to_death[targets] = times_to_death[sources]
+        times_to_reproduction[targets] = times_to_reproduction[sources]
+        types[sources] = LifeModel.CellType.FREE_SPACE
+        times_to_reproduction[sources] = self.time_to_reproduction_predators
+
+    def _reproduce(self, living):
+        types = self.cell_types.ravel()
+        times_to_reproduction = self.times_to_reproduction.ravel()
+        parents, children = self._resolve_conflicts(*self._choose_neighbours(
+            living[times_to_reproduction[living] == 0],
+            LifeModel.CellType.FREE_SPACE, 'reproduction'), 'reproduction')
+        types[children] = types[parents]
+        times_to_reproduction[children] =\
+            self.reproduction_times[types[parents]]
+        times_to_reproduction[parents] = times_to_reproduction[children]
+        return children
+
+    def _eat(self, living):
+        types = self.cell_types.ravel()
+        predators, victims = self._resolve_conflicts(*self._choose_neighbours(
+            living[types[living] == LifeModel.CellType.PREDATOR],
+            LifeModel.CellType.VICTIM, 'eating'), 'eating')
+        self.times_to_death.ravel()[predators] = self.time_to_death
+        self._move(predators, victims)
+        return predators, victims
+
+    def _move_randomly(self, living, living_types):
+        # living_types - types of living cells at start of turn
+        types = self.cell_types.ravel()
+        movers = living[(types[living] == living_types) &
+                        (self._random_values(living, 'move_decision') <
+                         self.move_probabilities[living_types])]
+        sources, targets = self._resolve_conflicts(*self._choose_neighbours(
+            movers, LifeModel.CellType.FREE_SPACE, 'move'), 'move')
+        self._move(sources, targets)
+        return sources, targets
+
+    def _update_cells(self, living):
+        # LifeModel.Cell.update_cell_state of living cells, returns dead
+        types = self.cell_types.ravel()
+        times_to_death = self.times_to_death.ravel()
+        times_to_reproduction = self.times_to_reproduction.ravel()
+        times_to_reproduction[living] -= times_to_reproduction[living] > 0
+        predators = living[types[living] == LifeModel.CellType.PREDATOR]
+        dead = predators[times_to_death[predators] == 0]
+        predators = predators[times_to_death[predators] > 0]
+        times_to_death[predators] -= 1
+        types[dead] = LifeModel.CellType.FREE_SPACE
+        times_to_reproduction[dead] = self.time_to_reproduction_predators
+        return dead
+
+    def _make_turn(self):
+        living = self._living_cells()
+        living_types = self.cell_types.ravel()[living]
+        self._reproduce(living)
+        self._eat(living)
+        self._move_randomly(living, living_types)
+        self._update_cells(self._living_cells())
+        self.life_counter = self._count_life()
+
+    def generate_next_turn(self):
+        self._make_turn()
+        self.__visualize(self.step)
+        self.step += 1
+
+    def __visualize(self, step):
+        if self.visualize:
+            os.system('cls' if os.name == 'nt' else 'clear')
+            print('step: ' + str(step + 1))
+            print('victims: ' + str(self.life_counter[LifeModel.CellType.VICTIM]))
+            print('predators: ' + str(self.life_counter[LifeModel.CellType.PREDATOR]))
+            symbols = [' '] + [
+                LifeModel.CHANGE_COLOR + LifeModel.COLORS[cell_type] +
+                LifeModel.CELL_VISUALIZATION_SYMBOL[cell_type] +
+                LifeModel.NORMAL_COLOR for cell_type in range(1, 4)]
+            for row in self.field():
+                print(''.join([symbols[cell_type] for cell_type in row]))
+            time.sleep(self.visualisation_pause)
+
+
+class ActiveLifeModel(ArrayLifeModel):
+    '''
+    ArrayLifeModel which keeps sorted index of living cells and
+    life_counter up to date after every phase of turn, so turn visits
+    only living cells and their neighbours; results are the same as
+    results of ArrayLifeModel with same random_state
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.living = super()._living_cells()
+
+    def set_field(self, *args, **kwargs):
+        super().set_field(*args, **kwargs)
+        self.living = super()._living_cells()
+
+    def _living_cells(self):
+        return self.living
+
+    def _make_turn(self):
+        VICTIM = LifeModel.CellType.VICTIM
+        PREDATOR = LifeModel.CellType.PREDATOR
+        types = self.cell_types.ravel()
+        living = self.living
+        living_types = types[living]
+
+        children = self._reproduce(living)
+        born = np.bincount(types[children], minlength=3)
+        eaters, eaten = self._eat(living)
+        sources, targets = self._move_randomly(living, living_types)
+        # eaten victims are predators now, their cells stay living
+        living = np.union1d(np.setdiff1d(
+            np.setdiff1d(np.union1d(living, children), eaters,
+                         assume_unique=True),
+            sources, assume_unique=True), targets)
+        dead = self._update_cells(living)
+        self.living = np.setdiff1d(living, dead, assume_unique=True)
+
+        self.life_counter = {
+            VICTIM: self.life_counter[VICTIM] + int(born[VICTIM]) -
+            len(eaten),
+            PREDATOR: self.life_counter[PREDATOR] + int(born[PREDATOR]) -
+            len(dead)}
+
+
+ENGINES = {
+    'objects': LifeModel,
+    'array': ArrayLifeModel,
+    'active': ActiveLifeModel
+}
+
+
 # TOOLS
 def gen_special_random_cell_generator(p1, p2, p3):
     if p1 + p2 + p3 > 1:
@@ -230,7 +503,13 @@ def convert_args(kwargs):
 
 def main(kwargs):
     t = int(kwargs.pop('t', DEFAULT_GENERATION_TIME))
-    life_model = LifeModel(**convert_args(kwargs))
+    engine = kwargs.pop('engine', 'objects')
+    if engine == 'parallel':
+        from parallel_life_model import ParallelLifeModel
+        engine = ParallelLifeModel
+    else:
+        engine = ENGINES[engine]
+    life_model = engine(**convert_args(kwargs))
     for step in range(t):
         life_model.generate_next_turn()
 
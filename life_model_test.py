@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+import json
+import os
+import tempfile
+import unittest
+import numpy as np
+import life_ensemble
+import life_snapshot
+from life_model import LifeModel, ArrayLifeModel, ActiveLifeModel
+from parallel_life_model import ParallelLifeModel, CHUNK_STEPS
+
+FREE, VICTIM, PREDATOR, WALL = range(4)
+SYMBOLS = {' ': FREE, '@': VICTIM, '#': PREDATOR, '_': WALL}
+
+
+def array_model(rows, engine=ArrayLifeModel, **kwargs):
+    # model with given field, written with LifeModel symbols
+    kwargs.setdefault('probability_victim_move', 0)
+    kwargs.setdefault('probability_predator_move', 0)
+    model = engine(len(rows), len(rows[0]), 0, 0, 0, random_state=0,
+                   **kwargs)
+    model.set_field([[SYMBOLS[symbol] for symbol in row] for row in rows])
+    return model
+
+
+def field_string(model):
+    symbols = {value: key for key, value in SYMBOLS.items()}
+    return [''.join(symbols[cell_type] for cell_type in row)
+            for row in model.field().tolist()]
+
+
+class TestArrayLifeModel(unittest.TestCase):
+    def test_init(self):
+        model = ArrayLifeModel(30, 40, random_state=1)
+        self.assertEqual(model.field().shape, (30, 40))
+        self.assertTrue((model.cell_types[[0, -1]] == WALL).all())
+        self.assertTrue((model.cell_types[:, [0, -1]] == WALL).all())
+        counts = np.bincount(model.field().ravel(), minlength=4)
+        self.assertTrue((counts > 200).all())
+        self.assertEqual(model.life_counter, {
+            LifeModel.CellType.VICTIM: counts[VICTIM],
+            LifeModel.CellType.PREDATOR: counts[PREDATOR]})
+        with self.assertRaises(Exception):
+            ArrayLifeModel(probability_victim_cell=0.5,
+                           probability_predator_cell=0.6)
+
+    def test_eating(self):
+        model = array_model(['#@ ', '___'], time_to_death=3)
+        model.generate_next_turn()
+        self.assertEqual(field_string(model), [' # ', '___'])
+        self.assertEqual(model.times_to_death[1, 2], 2)
+        self.assertEqual(model.life_counter[LifeModel.CellType.VICTIM], 0)
+
+        # one of two predators eats the only victim
+        model = array_model(['#@#'])
+        model.generate_next_turn()
+        self.assertIn(field_string(model), [[' ##'], ['## ']])
+
+    def test_death(self):
+        model = array_model([' # '], time_to_death=2)
+        for step in range(2):
+            model.generate_next_turn()
+            self.assertEqual(field_string(model), [' # '])
+        model.generate_next_turn()
+        self.assertEqual(field_string(model), ['   '])
+        self.assertEqual(model.life_counter[LifeModel.CellType.PREDATOR], 0)
+
+    def test_reproduction(self):
+        model = array_model(['@ _', '___'], time_to_reproduction_victims=2)
+        model.generate_next_turn()
+        model.generate_next_turn()
+        self.assertEqual(field_string(model), ['@ _', '___'])
+        model.generate_next_turn()
+        self.assertEqual(field_string(model), ['@@_', '___'])
+        self.assertEqual(model.life_counter[LifeModel.CellType.VICTIM], 2)
+        # parent and child wait time to reproduction again
+        self.assertEqual(model.times_to_reproduction[1, 1:3].tolist(),
+                         [1, 1])
+
+    def test_moves(self):
+        model = array_model(['   ', ' @ ', '   '],
+                            probability_victim_move=1)
+        model.generate_next_turn()
+        self.assertEqual(model.field()[1, 1], FREE)
+        self.assertEqual(
+            [model.field()[1, 0], model.field()[0, 1], model.field()[1, 2],
+             model.field()[2, 1]].count(VICTIM), 1)
+
+    def test_random_run(self):
+        runs = []
+        for run in range(2):
+            model = ArrayLifeModel(40, 50, probability_victim_move=0.5,
+                                   random_state=3)
+            walls = model.field() == WALL
+            for step in range(30):
+                model.generate_next_turn()
+                counts = np.bincount(model.field().ravel(), minlength=4)
+                self.assertEqual(
+                    [model.life_counter[LifeModel.CellType.VICTIM],
+                     model.life_counter[LifeModel.CellType.PREDATOR]],
+                    counts[[VICTIM, PREDATOR]].tolist())
+                self.assertTrue(((model.field() == WALL) == walls).all())
+                self.assertTrue((model.times_to_death >= 0).all())
+                self.assertTrue((model.times_to_reproduction >= 0).all())
+            runs.append(model.cell_types.copy())
+        self.assertTrue((runs[0] == runs[1]).all())
+
+
+class TestActiveLifeModel(unittest.TestCase):
+    def test_same_as_array_model(self):
+        for kwargs in [dict(), dict(probability_victim_move=0.7,
+                                    time_to_death=5)]:
+            model = ArrayLifeModel(30, 40, random_state=5, **kwargs)
+            active_model = ActiveLifeModel(30, 40, random_state=5, **kwargs)
+            for step in range(40):
+                model.generate_next_turn()
+                active_model.generate_next_turn()
+                self.assertTrue(
+                    (model.cell_types == active_model.cell_types).all())
+                self.assertTrue((model.times_to_death ==
+                                 active_model.times_to_death).all())
+                self.assertEqual(model.life_counter,
+                                 active_model.life_counter)
+                self.assertEqual(active_model.living.tolist(),
+                                 model._living_cells().tolist())
+
+    def test_set_field(self):
+        model = array_model(['#@ ', '___'], engine=ActiveLifeModel)
+        self.assertEqual(len(model.living), 2)
+        model.generate_next_turn()
+        self.assertEqual(field_string(model), [' # ', '___'])
+        self.assertEqual(model.living.tolist(), [7])
+
+
+class TestParallelLifeModel(unittest.TestCase):
+    def test_same_for_any_workers(self):
+        results = []
+        for workers in (1, 2, 3):
+            model = ParallelLifeModel(30, 20, probability_victim_move=0.6,
+                                      random_state=4, workers=workers)
+            counters = model.run(25)
+            self.assertEqual(model.step, 25)
+            self.assertEqual(model.life_counter, counters[-1])
+            counts = np.bincount(model.field().ravel(), minlength=4)
+            self.assertEqual(
+                [counters[-1][LifeModel.CellType.VICTIM],
+                 counters[-1][LifeModel.CellType.PREDATOR]],
+                counts[[VICTIM, PREDATOR]].tolist())
+            results.append((counters, model.cell_types.copy(),
+                            model.times_to_death.copy()))
+        for counters, cell_types, times_to_death in results[1:]:
+            self.assertEqual(counters, results[0][0])
+            self.assertTrue((cell_types == results[0][1]).all())
+            self.assertTrue((times_to_death == results[0][2]).all())
+
+    def test_rules(self):
+        # predators of two bands compete for victim on border
+        model = array_model(['#', '@', '#'], engine=ParallelLifeModel,
+                            workers=3)
+        model.generate_next_turn()
+        self.assertIn(field_string(model), [[' ', '#', '#'],
+                                            ['#', '#', ' ']])
+        self.assertEqual(model.life_counter[LifeModel.CellType.PREDATOR], 2)
+
+        model = array_model(['@ ', '__'], engine=ParallelLifeModel,
+                            time_to_reproduction_victims=0, workers=2)
+        model.generate_next_turn()
+        self.assertEqual(field_string(model), ['@@', '__'])
+
+    def test_resident_workers(self):
+        whole = ParallelLifeModel(20, 15, random_state=2, workers=3)
+        counters = whole.run(CHUNK_STEPS + 5)
+        model = ParallelLifeModel(20, 15, random_state=2, workers=3)
+        model.generate_next_turn()
+        processes = list(model.processes)
+        self.assertEqual(len(processes), 3)
+        counters_of_pieces = model.run(CHUNK_STEPS + 3)
+        model.generate_next_turn()
+        self.assertEqual(model.processes, processes)
+        self.assertEqual(counters_of_pieces, counters[1:-1])
+        self.assertEqual(model.life_counter, counters[-1])
+        self.assertTrue((model.cell_types == whole.cell_types).all())
+
+        whole.close()
+        model.close()
+        self.assertFalse(any(process.is_alive() for process in processes))
+        with self.assertRaises(ValueError):
+            model.run(1)
+
+
+class TestLifeEnsemble(unittest.TestCase):
+    GRID = {'probability_victim_move': [0.2, 0.6], 'time_to_death': [3]}
+    FIXED = {'row_number': 20, 'column_number': 25}
+
+    def run_sweep(self, path, processes=2):
+        return life_ensemble.run_ensemble(path, self.GRID, 2, 15, self.FIXED,
+                                          processes=processes, base_seed=7)
+
+    def read_runs(self, path):
+        # {run: (parameters, steps, victims, predators)}
+        settings, records, columns = life_ensemble.read_ensemble(path)
+        return {r['run']: (r['parameters'],) + tuple(
+            columns[column][slice(*r['rows'])].tolist()
+            for column in ('step', 'victims', 'predators'))
+            for r in records}
+
+    def test_sweep(self):
+        self.assertEqual(life_ensemble.sweep_runs(self.GRID, 2), [
+            (0, {'probability_victim_move': 0.2, 'time_to_death': 3}),
+            (1, {'probability_victim_move': 0.2, 'time_to_death': 3}),
+            (2, {'probability_victim_move': 0.6, 'time_to_death': 3}),
+            (3, {'probability_victim_move': 0.6, 'time_to_death': 3})])
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertEqual(self.run_sweep(directory), 4)
+            runs = self.read_runs(directory)
+            self.assertEqual(sorted(runs), [0, 1, 2, 3])
+            for run, (parameters, steps, victims, predators) in runs.items():
+                self.assertEqual(steps, list(range(1, 16)))
+                counts = life_ensemble.run_model(
+                    (run, dict(self.FIXED, **parameters), 15, 'active', 7))[1]
+                self.assertEqual(victims, counts[:, 0].tolist())
+                self.assertEqual(predators, counts[:, 1].tolist())
+            # independent streams of seeds
+            self.assertNotEqual(runs[0][2], runs[1][2])
+
+            self.assertEqual(self.run_sweep(directory), 0)
+            with self.assertRaises(ValueError):
+                life_ensemble.run_ensemble(directory, self.GRID, 3, 15)
+
+    def test_resume(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.run_sweep(directory, processes=1)
+            expected = self.read_runs(directory)
+
+            # interrupted while run 2 was written
+            manifest = os.path.join(directory, life_ensemble.MANIFEST)
+            with open(manifest) as f:
+                lines = f.readlines()
+            records = [json.loads(line) for line in lines[1:]]
+            with open(manifest, 'w') as f:
+                f.writelines(lines[:3])
+                f.write(lines[3][:10])
+            for column in life_ensemble.COLUMNS:
+                with open(os.path.join(directory, column), 'r+b') as f:
+                    f.truncate(4 * (records[1]['rows'][1] + 5))
+
+            self.assertEqual(len(self.read_runs(directory)), 2)
+            self.assertEqual(self.run_sweep(directory, processes=3), 2)
+            self.assertEqual(self.read_runs(directory), expected)
+            self.assertEqual(os.path.getsize(os.path.join(
+                directory, 'run')), 4 * 4 * 15)
+
+
+class TestLifeSnapshot(unittest.TestCase):
+    def test_resume_from_snapshot(self):
+        for engine in (LifeModel, ArrayLifeModel, ActiveLifeModel):
+            model = engine(20, 30, probability_victim_move=0.5,
+                           random_state=6)
+            for step in range(5):
+                model.generate_next_turn()
+            data = life_snapshot.dumps_snapshot(model)
+            for step in range(10):
+                model.generate_next_turn()
+
+            resumed = life_snapshot.loads_snapshot(data)
+            self.assertIs(type(resumed), engine)
+            self.assertEqual(resumed.step, 5)
+            for step in range(10):
+                resumed.generate_next_turn()
+            self.assertEqual(resumed.life_counter, model.life_counter)
+            for array, resumed_array in zip(
+                    life_snapshot.model_state(model),
+                    life_snapshot.model_state(resumed)):
+                self.assertTrue((array == resumed_array).all())
+
+        with self.assertRaises(ValueError):
+            life_snapshot.loads_snapshot(b'LIFETRAJ' + data[8:])
+
+    def test_pack_types(self):
+        types = np.array([3, 0, 1, 2, 2, 1, 3], dtype=np.uint8)
+        packed = life_snapshot._pack_types(types)
+        self.assertEqual(len(packed), 2)
+        self.assertEqual(life_snapshot._unpack_types(
+            packed.tobytes(), 7).tolist(), types.tolist())
+
+    def test_checkpoints_and_replay(self):
+        def new_model():
+            return ActiveLifeModel(20, 30, probability_victim_move=0.5,
+                                   random_state=8)
+
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, 'run.snap')
+            trajectory = os.path.join(directory, 'run.traj')
+            model = new_model()
+            fields = [model.field().copy()]
+            recorder = life_snapshot.TrajectoryRecorder(
+                trajectory, model, keyframe_every=4)
+            for step in range(10):
+                model.generate_next_turn()
+                fields.append(model.field().copy())
+                recorder.record(model)
+            recorder.close()
+
+            frames = list(life_snapshot.replay(trajectory))
+            self.assertEqual([step for step, _, _ in frames],
+                             list(range(11)))
+            for (step, life_counter, field), expected in zip(frames, fields):
+                self.assertTrue((field == expected).all())
+            self.assertEqual(frames[-1][1], model.life_counter)
+
+            # run stopped after step 7, last checkpoint is step 6
+            resumed_trajectory = os.path.join(directory, 'resumed.traj')
+            life_snapshot.run(new_model(), 6, checkpoint, 3,
+                              resumed_trajectory, 4)
+            stopped = life_snapshot.load_snapshot(checkpoint)
+            recorder = life_snapshot.TrajectoryRecorder(
+                resumed_trajectory, stopped, keyframe_every=4)
+            stopped.generate_next_turn()
+            recorder.record(stopped)
+            recorder.close()
+
+            resumed = life_snapshot.load_snapshot(checkpoint)
+            self.assertEqual(resumed.step, 6)
+            life_snapshot.run(resumed, 10, checkpoint, 3,
+                              resumed_trajectory, 4)
+            self.assertTrue((resumed.cell_types == model.cell_types).all())
+            self.assertEqual(life_snapshot.load_snapshot(checkpoint).step, 10)
+            with open(trajectory, 'rb') as f, \
+                    open(resumed_trajectory, 'rb') as resumed_f:
+                self.assertEqual(resumed_f.read(), f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
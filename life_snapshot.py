@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+'''
+snapshots, checkpoints and trajectories of LifeModel runs:
+
+    python3 life_snapshot.py run --checkpoint run.snap --every 100 \\
+        --trajectory run.traj t=1000 engine=active row_number=500
+    python3 life_snapshot.py replay run.traj
+
+run starts from --checkpoint when it exists, so killed run is resumed
+by same command exactly as if it had not stopped; replay prints life
+counters of recorded steps without making turns
+'''
+import json
+import os
+import random
+import struct
+import sys
+import zlib
+import numpy as np
+from life_model import LifeModel, ENGINES, DEFAULT_GENERATION_TIME,\
+    convert_args
+
+SNAPSHOT_MAGIC = b'LIFESNAP'
+TRAJECTORY_MAGIC = b'LIFETRAJ'
+VERSION = 1
+PREFIX = struct.Struct('<8sII')  # magic, version, header size
+FRAME = struct.Struct('<cI')  # kind, payload size
+DELTA = struct.Struct('<qIII')  # step, victims, predators, changed cells
+KEYFRAME, DELTA_FRAME = b'K', b'D'
+PARAMETERS = (
+    'row_number', 'column_number', 'probability_victim_move',
+    'probability_predator_move', 'time_to_death',
+    'time_to_reproduction_victims', 'time_to_reproduction_predators')
+STATE = ('cell_types', 'times_to_death', 'times_to_reproduction')
+
+
+def _engine_name(model):
+    for name, engine in ENGINES.items():
+        if type(model) is engine:
+            return name
+    if type(model).__name__ == 'ParallelLifeModel':
+        return 'parallel'
+    raise ValueError('unknown engine {}'.format(type(model).__name__))
+
+
+def _engine(name):
+    if name == 'parallel':
+        from parallel_life_model import ParallelLifeModel
+        return ParallelLifeModel
+    return ENGINES[name]
+
+
+def _pack_types(types):
+    # 2 bits per cell type, 4 cells per byte
+    types = np.append(types.ravel(), np.zeros(-types.size % 4, np.uint8))
+    types = types.reshape(-1, 4).astype(np.uint8)
+    return types[:, 0] | types[:, 1] << 2 | types[:, 2] << 4 |\
+        types[:, 3] << 6
+
+
+def _unpack_types(packed, size):
+    packed = np.frombuffer(packed, dtype=np.uint8)
+    return ((packed[:, None] >> np.array([0, 2, 4, 6], dtype=np.uint8)) &
+            3).ravel()[:size]
+
+
+def _narrow(values):
+    # values in smallest integer dtype which holds all of them
+    if not values.size:
+        return values.astype(np.uint8)
+    return values.astype(np.result_type(np.min_scalar_type(values.min()),
+                                        np.min_scalar_type(values.max())))
+
+
+def model_state(model):
+    '''
+        (row_number, column_number) arrays of cell types, times to death
+        and times to reproduction of model of any engine
+    '''
+    if isinstance(model, LifeModel):
+        cells = [cell for row in model.field for cell in row]
+        shape = (model.row_number, model.column_number)
+        return [np.array([getattr(cell, attribute) for cell in cells],
+                         dtype=np.int64).reshape(shape)
+                for attribute in ('cell_type', 'time_to_death',
+                                  'time_to_reproduction')]
+    return [getattr(model, key)[1:-1, 1:-1] for key in STATE]
+
+
+def _set_model_state(model, cell_types, times_to_death,
+                     times_to_reproduction):
+    if isinstance(model, LifeModel):
+        for row, types in enumerate(cell_types.tolist()):
+            for column, cell_type in enumerate(types):
+                cell = model.field[row][column]
+                cell.cell_type = LifeModel.CellType(cell_type)
+                cell.time_to_death = int(times_to_death[row, column])
+                cell.time_to_reproduction = int(
+                    times_to_reproduction[row, column])
+    else:
+        model.set_field(cell_types, times_to_death, times_to_reproduction)
+
+
+def dumps_snapshot(model):
+    '''
+        binary snapshot of model:
+        magic, version, size of json header (uint32 little-endian),
+        json header (engine, parameters, step, life counter, random
+        state, arrays), zlib-compressed arrays: cell types packed by 4
+        to byte, times in smallest integer type holding them
+    '''
+    cell_types, times_to_death, times_to_reproduction = model_state(model)
+    arrays = [('cell_types', _pack_types(cell_types)),
+              ('times_to_death', _narrow(times_to_death)),
+              ('times_to_reproduction', _narrow(times_to_reproduction))]
+    if isinstance(model, LifeModel):  # objects engine uses global random
+        random_state = random.getstate()
+    else:
+        random_state = model.random.bit_generator.state
+    header = {
+        'engine': _engine_name(model),
+        'parameters': {key: getattr(model, key) for key in PARAMETERS},
+        'step': model.step,
+        'life_counter': [int(model.life_counter[cell_type]) for cell_type
+                         in LifeModel.LIVING_CELLS_TYPES],
+        'random_state': random_state,
+        'seed': getattr(model, 'seed', None),  # of ParallelLifeModel
+        'arrays': [[name, values.dtype.str, values.size]
+                   for name, values in arrays]
+    }
+    header = json.dumps(header).encode('utf-8')
+    return PREFIX.pack(SNAPSHOT_MAGIC, VERSION, len(header)) + header +\
+        zlib.compress(b''.join(values.tobytes() for _, values in arrays))
+
+
+def _parse_snapshot(data):
+    # (header, {name: array of field shape}) of snapshot
+    if len(data) < PREFIX.size or\
+            PREFIX.unpack_from(data)[0] != SNAPSHOT_MAGIC:
+        raise ValueError('not a life model snapshot')
+    magic, version, size = PREFIX.unpack_from(data)
+    if version != VERSION:
+        raise ValueError('unsupported snapshot version {}'.format(version))
+    header = json.loads(data[PREFIX.size:PREFIX.size + size])
+    payload = zlib.decompress(data[PREFIX.size + size:])
+
+    shape = (header['parameters']['row_number'],
+             header['parameters']['column_number'])
+    arrays = dict()
+    offset = 0
+    for name, dtype, count in header['arrays']:
+        dtype = np.dtype(dtype)
+        arrays[name] = np.frombuffer(payload, dtype=dtype, count=count,
+                                     offset=offset)
+        offset += dtype.itemsize * count
+    arrays['cell_types'] = _unpack_types(arrays['cell_types'],
+                                         shape[0] * shape[1])
+    return header, {key: arrays[key].reshape(shape) for key in STATE}
+
+
+def loads_snapshot(data, **kwargs):
+    '''
+        model of snapshot made by dumps_snapshot, next turns of it are
+        same as turns of saved model; kwargs - other arguments of engine,
+        like visualize or workers
+    '''
+    header, arrays = _parse_snapshot(data)
+    model = _engine(header['engine'])(random_state=0,
+                                      **dict(header['parameters'], **kwargs))
+    _set_model_state(model, *[arrays[key] for key in STATE])
+    if isinstance(model, LifeModel):
+        version, state, gauss = header['random_state']
+        random.setstate((version, tuple(state), gauss))
+    else:
+        model.random.bit_generator.state = header['random_state']
+    if header['seed'] is not None:
+        model.seed = header['seed']
+    model.step = header['step']
+    model.life_counter = dict(zip(
+        (LifeModel.CellType.VICTIM, LifeModel.CellType.PREDATOR),
+        header['life_counter']))
+    return model
+
+
+def save_snapshot(model, path):
+    # written to temporary file first, old snapshot stays if interrupted
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as f:
+        f.write(dumps_snapshot(model))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_path, path)
+
+
+def load_snapshot(path, **kwargs):
+    with open(path, 'rb') as f:
+        return loads_snapshot(f.read(), **kwargs)
+
+
+def _read_frames(f):
+    '''
+        yields (end offset, kind, payload) of frames of trajectory file
+        after its prefix, torn last frame is skipped
+    '''
+    offset = f.tell()
+    while True:
+        prefix = f.read(FRAME.size)
+        if len(prefix) < FRAME.size:
+            return
+        kind, size = FRAME.unpack(prefix)
+        payload = f.read(size)
+        if len(payload) < size or kind not in (KEYFRAME, DELTA_FRAME):
+            return
+        offset += FRAME.size + size
+        yield offset, kind, payload
+
+
+def _replay_frames(f):
+    # yields (end offset, step, life counter, cell types, keyframe or None)
+    cell_types = None
+    for offset, kind, payload in _read_frames(f):
+        if kind == KEYFRAME:
+            header, arrays = _parse_snapshot(payload)
+            cell_types = arrays['cell_types'].ravel().copy()
+            yield offset, header['step'], dict(zip(
+                (LifeModel.CellType.VICTIM, LifeModel.CellType.PREDATOR),
+                header['life_counter'])), cell_types, payload
+            continue
+        if cell_types is None:
+            raise ValueError('trajectory does not start with keyframe')
+        step, victims, predators, count = DELTA.unpack_from(payload)
+        changes = zlib.decompress(payload[DELTA.size:])
+        cells = np.cumsum(np.frombuffer(changes, dtype='<u4', count=count))
+        cell_types[cells] = np.frombuffer(changes, dtype=np.uint8,
+                                          offset=4 * count)
+        yield offset, step, {LifeModel.CellType.VICTIM: victims,
+                             LifeModel.CellType.PREDATOR: predators},\
+            cell_types, None
+
+
+def replay(path):
+    '''
+        yields (step, life counter, field of cell types) for every
+        recorded step of trajectory, no turns are made
+    '''
+    with open(path, 'rb') as f:
+        header = _read_trajectory_header(f, path)
+        shape = (header['row_number'], header['column_number'])
+        for offset, step, life_counter, cell_types, keyframe in\
+                _replay_frames(f):
+            yield step, life_counter, cell_types.reshape(shape).copy()
+
+
+def _read_trajectory_header(f, path):
+    prefix = f.read(PREFIX.size)
+    if len(prefix) < PREFIX.size or PREFIX.unpack(prefix)[0] != \
+            TRAJECTORY_MAGIC:
+        raise ValueError('{} is not a trajectory file'.format(path))
+    magic, version, size = PREFIX.unpack(prefix)
+    if version != VERSION:
+        raise ValueError('unsupported trajectory version {}'.format(version))
+    return json.loads(f.read(size))
+
+
+class TrajectoryRecorder(object):
+    '''
+    appends steps of model run to trajectory file:
+    magic, version, size of json header (parameters of model), then
+    frames - kind (b'K' or b'D'), payload size (uint32), payload;
+    keyframe payload is snapshot of model (first frame and every
+    keyframe_every steps), delta payload is step, life counter, number
+    of changed cells and zlib-compressed flat indices of changed cells
+    (as differences, uint32) with their new cell types
+
+    existing trajectory is continued from frame of model step (steps
+    after it are dropped), so it is resumed together with checkpoint
+    '''
+
+    def __init__(self, path, model, keyframe_every=100):
+        self.path = path
+        self.keyframe_every = keyframe_every
+        self.cell_types = None
+        parameters = {key: getattr(model, key) for key in PARAMETERS}
+        if os.path.exists(path):
+            self.file = open(path, 'r+b')
+            header = _read_trajectory_header(self.file, path)
+            if header != parameters:
+                raise ValueError(
+                    'trajectory {} belongs to other model: {}'.format(
+                        path, header))
+            end = None
+            for offset, step, life_counter, cell_types, keyframe in\
+                    _replay_frames(self.file):
+                if step == model.step:
+                    end = offset
+                    self.cell_types = cell_types.copy()
+                    break
+            if end is None:
+                raise ValueError('trajectory {} has no step {}'.format(
+                    path, model.step))
+            self.file.truncate(end)
+            self.file.seek(end)
+        else:
+            self.file = open(path, 'wb')
+            header = json.dumps(parameters).encode('utf-8')
+            self.file.write(PREFIX.pack(TRAJECTORY_MAGIC, VERSION,
+                                        len(header)) + header)
+            self.record(model)
+
+    def record(self, model):
+        # adds frame of current step of model
+        cell_types = model_state(model)[0].astype(np.uint8).ravel()
+        if self.cell_types is None or model.step % self.keyframe_every == 0:
+            self.__write(KEYFRAME, dumps_snapshot(model))
+        else:
+            cells = np.flatnonzero(cell_types != self.cell_types)
+            changes = np.diff(cells, prepend=0).astype('<u4').tobytes() +\
+                cell_types[cells].tobytes()
+            self.__write(DELTA_FRAME, DELTA.pack(
+                model.step, model.life_counter[LifeModel.CellType.VICTIM],
+                model.life_counter[LifeModel.CellType.PREDATOR],
+                len(cells)) + zlib.compress(changes))
+        self.cell_types = cell_types
+
+    def __write(self, kind, payload):
+        self.file.write(FRAME.pack(kind, len(payload)) + payload)
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+def run(model, steps, checkpoint=None, every=100, trajectory=None,
+        keyframe_every=100):
+    '''
+        makes turns until model.step is steps; snapshot of model is saved
+        to checkpoint every `every` steps and at end, steps are recorded
+        to trajectory; returns model
+    '''
+    recorder = None if trajectory is None else\
+        TrajectoryRecorder(trajectory, model, keyframe_every)
+    try:
+        while model.step < steps:
+            model.generate_next_turn()
+            if recorder is not None:
+                recorder.record(model)
+            if checkpoint is not None and (model.step % every == 0 or
+                                           model.step == steps):
+                if recorder is not None:  # frames of checkpoint step
+                    recorder.flush()
+                save_snapshot(model, checkpoint)
+    finally:
+        if recorder is not None:
+            recorder.close()
+    return model
+
+
+def main(arg_list):
+    if arg_list[:1] == ['replay']:
+        for step, life_counter, field in replay(arg_list[1]):
+            print('step: {} victims: {} predators: {}'.format(
+                step, life_counter[LifeModel.CellType.VICTIM],
+                life_counter[LifeModel.CellType.PREDATOR]))
+        return
+    if arg_list[:1] != ['run']:
+        raise ValueError('usage: run [--checkpoint path] [--every n] '
+                         '[--trajectory path] name=value... | replay path')
+    options = {'--checkpoint': None, '--every': '100', '--trajectory': None}
+    kwargs = dict()
+    arguments = iter(arg_list[1:])
+    for argument in arguments:
+        if argument in options:
+            options[argument] = next(arguments)
+        else:
+            key, value = argument.split('=', 1)
+            kwargs[key] = value
+
+    t = int(kwargs.pop('t', DEFAULT_GENERATION_TIME))
+    engine = _engine(kwargs.pop('engine', 'objects'))
+    kwargs = convert_args(kwargs)
+    checkpoint = options['--checkpoint']
+    if checkpoint is not None and os.path.exists(checkpoint):
+        model = load_snapshot(checkpoint, **{
+            key: value for key, value in kwargs.items()
+            if key in ('visualize', 'visualisation_pause', 'workers')})
+    else:
+        model = engine(**kwargs)
+    run(model, t, checkpoint, int(options['--every']),
+        options['--trajectory'])
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+from urllib.parse import urlparse, urlunparse
+from lxml import etree
+
+CHUNK_SIZE = 2 ** 16
+
+
+def absolutize_link(href, parsed_url):
+    # convert local link to global
+    link = list(urlparse(href))
+
+    if link[0] == '':
+        link[0] = parsed_url.scheme
+
+    if link[1] == '':
+        link[1] = parsed_url.netloc
+
+    return urlunparse(link)
+
+
+class _HrefTarget(object):
+    # lxml parser target: collects href of <a> tags, no tree is built
+    def __init__(self):
+        self.hrefs = []
+
+    def start(self, tag, attrib):
+        if tag == 'a':
+            href = attrib.get('href')
+            if href is not None:
+                self.hrefs.append(href)
+
+    def close(self):
+        pass
+
+
+def read_chunks(stream, chunk_size=CHUNK_SIZE):
+    # generator of chunks of file-like object
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+class LinkScanner(object):
+    '''
+        incremental extractor of page links:
+        url - address of page to convert local links to global
+        site - if given, only links to this netloc are returned
+        encoding - page encoding from http headers (if known)
+    '''
+
+    def __init__(self, url, site=None, encoding=None):
+        self.parsed_url = urlparse(url)
+        self.site = site
+        self.target = _HrefTarget()
+        self.parser = etree.HTMLParser(target=self.target, encoding=encoding)
+
+    def __flush(self):
+        links = []
+        for href in self.target.hrefs:
+            link = absolutize_link(href, self.parsed_url)
+            if self.site is None or urlparse(link).netloc == self.site:
+                links.append(link)
+        self.target.hrefs = []
+        return links
+
+    def feed(self, chunk):
+        # returns links completed by this chunk
+        self.parser.feed(chunk)
+        return self.__flush()
+
+    def close(self):
+        try:
+            self.parser.close()
+        except etree.XMLSyntaxError:
+            pass  # empty document
+        return self.__flush()
+
+
+def iter_links(chunks, url, site=None, encoding=None):
+    # generator of links of page given by iterable of parts (bytes or str)
+    scanner = LinkScanner(url, site, encoding)
+    for chunk in chunks:
+        yield from scanner.feed(chunk)
+    yield from scanner.close()
+
+
+def extract_links(page, url, site=None, encoding=None):
+    # list of links of whole page, suitable for process pool workers
+    return list(iter_links(
+        (page[i:i + CHUNK_SIZE] for i in range(0, len(page), CHUNK_SIZE)),
+        url, site, encoding))
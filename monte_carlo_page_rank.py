@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+from time import time
+import numpy as np
+
+
+class MonteCarloPageRank(object):
+    '''
+    approximate page rank by random walks with restart:
+    every walk starts in random vertex, on each step it stops with
+    probability damping_factor, else goes by random link (or to random
+    vertex if there are no links); rank of vertex is estimated as its
+    share of all visits
+
+    walks run in batches of walks_per_batch walkers moved together with
+    numpy; error bounds come from spread of estimates between batches,
+    so more batches give more precise ranks (anytime refinement)
+    '''
+
+    def __init__(self, links, N, damping_factor=0.15, walks_per_batch=10 ** 5,
+                 random_state=None):
+        links = np.asarray(links, dtype=np.int64).reshape(-1, 2)
+        self.N = N
+        self.damping_factor = damping_factor
+        self.walks_per_batch = walks_per_batch
+        self.random = np.random.default_rng(random_state)
+
+        # links of vertex i are dst[offsets[i]:offsets[i + 1]], repeated
+        # links make their target more probable as in page_rank
+        order = np.argsort(links[:, 0], kind='stable')
+        self.dst = links[order, 1]
+        self.out_degree = np.bincount(links[:, 0], minlength=N)
+        self.offsets = np.concatenate([[0], np.cumsum(self.out_degree)])
+
+        self.batches = 0
+        self.rank_sum = np.zeros(N)  # sums of batch estimates
+        self.rank_square_sum = np.zeros(N)
+
+    def run_batch(self):
+        # visited positions of all steps, counted once at the end, so
+        # steps cost O(walkers) and not O(N)
+        visited = []
+        positions = self.random.integers(0, self.N, self.walks_per_batch)
+        while len(positions):
+            visited.append(positions)
+            positions = positions[
+                self.random.random(len(positions)) >= self.damping_factor]
+
+            out_degree = self.out_degree[positions]
+            dangling = out_degree == 0
+            link_numbers = (self.random.random(len(positions)) *
+                            out_degree).astype(np.int64)
+            next_positions = self.dst[np.minimum(
+                self.offsets[positions] + link_numbers, len(self.dst) - 1)]\
+                if len(self.dst) else positions
+            next_positions[dangling] = self.random.integers(
+                0, self.N, dangling.sum())
+            positions = next_positions
+
+        visits = np.bincount(np.concatenate(visited), minlength=self.N)
+        estimate = visits / visits.sum()
+        self.batches += 1
+        self.rank_sum += estimate
+        self.rank_square_sum += estimate ** 2
+
+    def run(self, batches=1, time_limit=None):
+        # runs batches, stops earlier if time_limit (seconds) is exceeded
+        start_time = time()
+        for batch in range(batches):
+            self.run_batch()
+            if time_limit is not None and time() - start_time > time_limit:
+                break
+        return self
+
+    def ranks(self):
+        return self.rank_sum / max(self.batches, 1)
+
+    def errors(self, z=2):
+        # z standard errors of ranks (infinite until there are 2 batches)
+        if self.batches < 2:
+            return np.full(self.N, np.inf)
+        mean = self.ranks()
+        variance = np.maximum(
+            self.rank_square_sum / self.batches - mean ** 2, 0) *\
+            self.batches / (self.batches - 1)
+        return z * np.sqrt(variance / self.batches)
+
+    def top_k(self, k, z=2):
+        # returns vertices with k largest ranks, their ranks and errors
+        ranks = self.ranks()
+        k = min(k, self.N)
+        top = np.argpartition(-ranks, k - 1)[:k] if k else np.arange(0)
+        top = top[np.argsort(-ranks[top], kind='stable')]
+        return top, ranks[top], self.errors(z)[top]
+
+    def refine(self, k, time_limit=None, max_batches=None, z=2):
+        # anytime top_k: yields refined answer after every batch
+        start_time = time()
+        batch = 0
+        while (max_batches is None or batch < max_batches) and\
+                (time_limit is None or time() - start_time < time_limit):
+            self.run_batch()
+            batch += 1
+            yield self.top_k(k, z)
@@ -0,0 +1,545 @@
+#!/usr/bin/env python3
+import json
+import os
+import random
+import struct
+from array import array
+from bisect import bisect_left
+import numpy as np
+
+# ids are stored big-endian, so bytewise order of id rows is their order
+ID_DTYPE = np.dtype('>u4')
+CHUNK_TOKENS = 2 ** 20
+
+MODEL_MAGIC = b'TGNGRAM\0'
+MODEL_VERSION = 1
+MODEL_PREFIX = struct.Struct('<8sII')  # magic, version, header size
+MODEL_ALIGNMENT = 64
+
+
+def choose_turn(moves, cumulative_counts, rnd=random):
+    # move with probability proportional to its count, counts are
+    # running sums
+    rnd_var = rnd.randint(1, cumulative_counts[-1])
+    return moves[bisect_left(cumulative_counts, rnd_var)]
+
+
+def _row_keys(rows):
+    # (n, width) id rows -> (n, ) keys comparable as id tuples
+    rows = np.ascontiguousarray(rows, dtype=ID_DTYPE)
+    return rows.view(
+        np.dtype((np.void, ID_DTYPE.itemsize * rows.shape[1]))).ravel()
+
+
+def _merge_counts(tables, width):
+    # list of (rows, counts) -> sorted unique rows with summed counts
+    tables = [table for table in tables if len(table[1])]
+    if not tables:
+        return np.zeros((0, width), dtype=ID_DTYPE), np.zeros(0, np.int64)
+    keys, inverse = np.unique(
+        np.concatenate([_row_keys(table[0]) for table in tables]),
+        return_inverse=True)
+    counts = np.bincount(
+        inverse.ravel(), minlength=len(keys),
+        weights=np.concatenate([table[1] for table in tables]))
+    return keys.view(ID_DTYPE).reshape(-1, width), counts.astype(np.int64)
+
+
+class NGramCounter(object):
+    '''
+    counts turns (history, token) of token lines as
+    text_generator._build_frequencies does, but tokens are interned to
+    integer ids and counts are kept as sorted numpy tables:
+    tables[k] - rows (history of k ids, token id) and their counts
+
+    lines are counted by chunks of about chunk_tokens tokens, partial
+    tables are merged when they become as large as merged one
+    '''
+
+    def __init__(self, depth, chunk_tokens=CHUNK_TOKENS):
+        self.depth = depth
+        self.chunk_tokens = chunk_tokens
+        self.token_ids = dict()
+        self.vocabulary = []
+        self.ids = array('I')  # ids of tokens of current chunk
+        self.positions = array('I')  # their positions in lines
+        self.tables = [[] for k in range(depth + 1)]
+
+    def __intern(self, token):
+        token_id = self.token_ids.get(token)
+        if token_id is None:
+            token_id = len(self.vocabulary)
+            self.token_ids[token] = token_id
+            self.vocabulary.append(token)
+        return token_id
+
+    def add_line(self, tokens):
+        position = 0
+        for token in tokens:
+            if token.isalpha():
+                self.ids.append(self.__intern(token))
+                self.positions.append(position)
+                position += 1
+        if len(self.ids) >= self.chunk_tokens:
+            self.__count_chunk()
+        return self
+
+    def add_lines(self, token_lines):
+        for tokens in token_lines:
+            self.add_line(tokens)
+        return self
+
+    def add_tables(self, vocabulary, tables):
+        '''
+            adds counts of other counter or model, given as (vocabulary,
+            tables) in its own token ids (see merged_tables); counters of
+            separate parts of text sum up to counter of whole text
+        '''
+        if len(tables) != self.depth + 1:
+            raise ValueError('tables of depth {} for counter of depth {}'
+                             .format(len(tables) - 1, self.depth))
+        new_ids = np.array([self.__intern(token) for token in vocabulary],
+                           dtype=np.int64)
+        for k, (rows, counts) in enumerate(tables):
+            if len(counts):
+                self.__add_table(k, _merge_counts(
+                    [(new_ids[np.asarray(rows).astype(np.int64)], counts)],
+                    k + 1))
+        return self
+
+    def __count_chunk(self):
+        ids = np.frombuffer(self.ids, dtype=np.uint32)
+        positions = np.frombuffer(self.positions, dtype=np.uint32)
+        for k in range(self.depth + 1):
+            ends = np.flatnonzero(positions >= k)
+            rows = np.stack([ids[ends - k + j] for j in range(k + 1)], axis=1)
+            self.__add_table(k, _merge_counts(
+                [(rows, np.ones(len(rows), dtype=np.int64))], k + 1))
+        del ids, positions
+        self.ids = array('I')
+        self.positions = array('I')
+
+    def __add_table(self, k, table):
+        tables = self.tables[k]
+        tables.append(table)
+        if len(tables) > 1 and\
+                sum(len(t[1]) for t in tables[1:]) >= len(tables[0][1]):
+            self.tables[k] = [_merge_counts(tables, k + 1)]
+
+    def merged_tables(self):
+        # (vocabulary, [(rows, counts) for k = 0..depth]) in counter ids
+        if len(self.ids):
+            self.__count_chunk()
+        self.tables = [[_merge_counts(tables, k + 1)]
+                       if len(tables) != 1 else tables
+                       for k, tables in enumerate(self.tables)]
+        return self.vocabulary, [tables[0] for tables in self.tables]
+
+    def model(self):
+        vocabulary, tables = self.merged_tables()
+        return NGramModel.from_tables(vocabulary, tables)
+
+
+def sorted_tables(vocabulary, tables):
+    # renumbers tokens in alphabetical order
+    sorted_vocabulary = sorted(vocabulary)
+    new_ids = np.zeros(len(vocabulary), dtype=np.int64)
+    new_ids[np.argsort(np.array(vocabulary, dtype=object), kind='stable')] =\
+        np.arange(len(vocabulary))
+    return sorted_vocabulary, [
+        _merge_counts([(new_ids[rows.astype(np.int64)], counts)],
+                      rows.shape[1])
+        for rows, counts in tables]
+
+
+class NGramModel(object):
+    '''
+    compact model of token turns:
+    vocabulary - sorted list of tokens, token id is its index
+    for every history length k = 0..depth:
+        histories[k] - (H, k) sorted rows of ids of histories
+        offsets[k] - (H + 1, ) turns of h-th history are
+            offsets[k][h]:offsets[k][h + 1]
+        successors[k] - ids of next tokens, sorted for every history
+        cumulative[k] - running sum of turn counts over whole order
+    '''
+
+    def __init__(self, vocabulary, histories, offsets, successors,
+                 cumulative):
+        self.vocabulary = vocabulary
+        self.depth = len(histories) - 1
+        self.histories = histories
+        self.offsets = offsets
+        self.successors = successors
+        self.cumulative = cumulative
+        self.history_keys = [_row_keys(h) if h.shape[1] else None
+                             for h in histories]
+        # history ids -> (successor ids, running counts) as lists, or ()
+        # for unknown history; filled by sample for visited histories
+        self.sampling_index = dict()
+
+    @staticmethod
+    def from_tables(vocabulary, tables):
+        return NGramModel.from_sorted_tables(
+            *sorted_tables(vocabulary, tables))
+
+    @staticmethod
+    def from_sorted_tables(vocabulary, tables):
+        # tables of sorted vocabulary ids, with sorted unique rows
+        histories, offsets, successors, cumulative = [], [], [], []
+        for k, (rows, counts) in enumerate(tables):
+            if k:
+                keys = _row_keys(rows[:, :k])
+                starts = np.concatenate(
+                    [[0], np.flatnonzero(keys[1:] != keys[:-1]) + 1])\
+                    if len(keys) else np.zeros(0, dtype=np.int64)
+            else:
+                starts = np.zeros(1 if len(rows) else 0, dtype=np.int64)
+            histories.append(np.ascontiguousarray(rows[starts, :k]))
+            offsets.append(np.append(starts, len(rows)).astype(np.int64))
+            successors.append(rows[:, k].astype(np.uint32))
+            cumulative.append(np.cumsum(counts, dtype=np.int64))
+        return NGramModel(vocabulary, histories, offsets, successors,
+                          cumulative)
+
+    def save(self, path):
+        '''
+            binary model file:
+            magic, version, size of json header (uint32 little-endian),
+            json header {"depth", "arrays": [[name, dtype, shape, offset]]},
+            arrays aligned to MODEL_ALIGNMENT bytes
+        '''
+        encoded = [token.encode('utf-8') for token in self.vocabulary]
+        arrays = [
+            ('vocabulary_offsets', np.cumsum(
+                [0] + [len(token) for token in encoded], dtype=np.int64)),
+            ('vocabulary', np.frombuffer(b''.join(encoded), dtype=np.uint8))]
+        for k in range(self.depth + 1):
+            arrays += [('histories_{}'.format(k), self.histories[k]),
+                       ('offsets_{}'.format(k), self.offsets[k]),
+                       ('successors_{}'.format(k), self.successors[k]),
+                       ('cumulative_{}'.format(k), self.cumulative[k])]
+
+        def header(offset):
+            description = []
+            for name, values in arrays:
+                offset += (-offset) % MODEL_ALIGNMENT
+                description.append([name, values.dtype.str,
+                                    list(values.shape), offset])
+                offset += values.nbytes
+            return json.dumps({'depth': self.depth,
+                               'arrays': description}).encode()
+
+        # offsets of arrays depend on header size, header size on offsets
+        size = 0
+        while len(header(MODEL_PREFIX.size + size)) != size:
+            size = len(header(MODEL_PREFIX.size + size))
+        description = header(MODEL_PREFIX.size + size)
+
+        # written to temporary file first, model may be mapped from path
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'wb') as f:
+            f.write(MODEL_PREFIX.pack(MODEL_MAGIC, MODEL_VERSION, size))
+            f.write(description)
+            for (name, values), (_, _, _, offset) in zip(
+                    arrays, json.loads(description)['arrays']):
+                f.write(b'\0' * (offset - f.tell()))
+                f.write(np.ascontiguousarray(values).tobytes())
+        os.replace(temporary_path, path)
+
+    @staticmethod
+    def load(path):
+        # memory-mapped model, nothing is read before it is needed
+        with open(path, 'rb') as f:
+            prefix = f.read(MODEL_PREFIX.size)
+            if len(prefix) < MODEL_PREFIX.size or\
+                    MODEL_PREFIX.unpack(prefix)[0] != MODEL_MAGIC:
+                raise ValueError('{} is not a model file'.format(path))
+            magic, version, size = MODEL_PREFIX.unpack(prefix)
+            if version != MODEL_VERSION:
+                raise ValueError(
+                    'unsupported model file version {}'.format(version))
+            header = json.loads(f.read(size))
+
+        arrays = dict()
+        for name, dtype, shape, offset in header['arrays']:
+            if np.prod(shape) == 0:
+                arrays[name] = np.zeros(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(path, dtype=dtype, mode='r',
+                                         offset=offset, shape=tuple(shape))
+
+        def order(name):
+            return [arrays['{}_{}'.format(name, k)]
+                    for k in range(header['depth'] + 1)]
+
+        return NGramModel(
+            _Vocabulary(arrays['vocabulary_offsets'], arrays['vocabulary']),
+            order('histories'), order('offsets'), order('successors'),
+            order('cumulative'))
+
+    def __table(self, k):
+        # (rows, counts) of turns with history of length k, rows are sorted
+        counts = np.diff(self.cumulative[k], prepend=0)
+        repeats = np.diff(self.offsets[k])
+        rows = np.column_stack([
+            np.repeat(np.asarray(self.histories[k]), repeats, axis=0),
+            np.asarray(self.successors[k])]).astype(ID_DTYPE)
+        return rows, counts
+
+    def tables(self):
+        # (vocabulary, [(rows, counts) for k = 0..depth]), for merging
+        return list(self.vocabulary), [self.__table(k)
+                                       for k in range(self.depth + 1)]
+
+    def updated(self, vocabulary, tables):
+        '''
+            new model with counts of (vocabulary, tables) added, as
+            NGramCounter.add_tables does; added turns are sorted and
+            found in model by binary search, so sorting and search work
+            grows with added counts only; arrays of model are copied once
+            by inserts of new histories and turns (and renumbered if
+            vocabulary grows), which costs about as much as saving them
+        '''
+        if len(tables) != self.depth + 1:
+            raise ValueError('tables of depth {} for model of depth {}'
+                             .format(len(tables) - 1, self.depth))
+        new_tokens = sorted(set(token for token in vocabulary
+                                if self.token_id(token) is None))
+        if new_tokens:
+            # model ids keep their order, so its rows stay sorted
+            positions = [bisect_left(self.vocabulary, token)
+                         for token in new_tokens]
+            old_ids = np.arange(len(self.vocabulary))
+            old_ids += np.searchsorted(positions, old_ids, side='right')
+            new_vocabulary = list(self.vocabulary)
+            for position, token in reversed(list(zip(positions,
+                                                     new_tokens))):
+                new_vocabulary.insert(position, token)
+        else:
+            old_ids = None
+            new_vocabulary = self.vocabulary
+        added_ids = np.array([bisect_left(new_vocabulary, token)
+                              for token in vocabulary], dtype=np.int64)
+
+        orders = []
+        for k, (added_rows, added_counts) in enumerate(tables):
+            added_rows, added_counts = _merge_counts(
+                [(added_ids[np.asarray(added_rows).astype(np.int64)],
+                  added_counts)], k + 1)
+            orders.append(self.__updated_order(k, old_ids, added_rows,
+                                               added_counts))
+        # (histories, offsets, successors, cumulative) of all orders
+        return NGramModel(new_vocabulary, *map(list, zip(*orders)))
+
+    def __updated_order(self, k, old_ids, added_rows, counts):
+        '''
+            (histories, offsets, successors, cumulative) of order k with
+            sorted unique added_rows of new ids and their counts added
+        '''
+        histories = np.asarray(self.histories[k])
+        offsets = np.asarray(self.offsets[k])
+        successors = np.asarray(self.successors[k])
+        cumulative = np.asarray(self.cumulative[k])
+        history_keys = self.history_keys[k]
+        if old_ids is not None:
+            histories = old_ids[histories].astype(ID_DTYPE)
+            successors = old_ids[successors].astype(np.uint32)
+            history_keys = _row_keys(histories) if k else None
+        if not len(counts):
+            return histories, offsets, successors, cumulative
+
+        # history of every added turn: index in model or insert position
+        if k:
+            keys = _row_keys(added_rows[:, :k])
+            h = np.searchsorted(history_keys, keys)
+            found = h < len(history_keys)
+            found[found] = history_keys[h[found]] == keys[found]
+        else:
+            keys = np.zeros(len(counts))
+            h = np.zeros(len(counts), dtype=np.int64)
+            found = np.full(len(counts), len(histories) > 0)
+
+        # turn of every added turn: index in model or insert position,
+        # binary search inside turns of its history
+        tokens = added_rows[:, k]
+        low = offsets[h]
+        high = np.where(found, offsets[np.minimum(h + 1, len(offsets) - 1)],
+                        low)
+        while True:
+            searched = low < high
+            if not searched.any():
+                break
+            middle = (low + high) // 2
+            lower = searched & (successors[np.minimum(
+                middle, len(successors) - 1)] < tokens)
+            low = np.where(lower, middle + 1, low)
+            high = np.where(searched & ~lower, middle, high)
+        turns = low
+        known = found & (turns < offsets[np.minimum(h + 1, len(offsets) - 1)])
+        known[known] = successors[turns[known]] == tokens[known]
+        new = ~known
+
+        # new histories, first turn of each of them
+        unknown = np.flatnonzero(~found)
+        first = np.ones(len(unknown), dtype=bool)
+        first[1:] = keys[unknown[1:]] != keys[unknown[:-1]]
+        history_positions = h[unknown[first]]
+        histories = np.insert(histories, history_positions,
+                              added_rows[unknown[first], :k], axis=0)
+        # index of history of every added turn in new histories
+        new_h = h + np.searchsorted(history_positions, h, side='right')
+        new_h[unknown] = history_positions[np.cumsum(first) - 1] +\
+            np.cumsum(first) - 1
+        sizes = np.insert(np.diff(offsets), history_positions, 0) +\
+            np.bincount(new_h[new], minlength=len(histories))
+        offsets = np.concatenate([[0], np.cumsum(sizes)])
+
+        # turns are inserted with running sum before them, then added
+        # counts are summed from their turns on
+        inserted = turns[new]
+        successors = np.insert(successors, inserted, tokens[new])
+        cumulative = np.insert(cumulative, inserted, np.where(
+            inserted > 0, cumulative[np.maximum(inserted - 1, 0)], 0)
+            if len(cumulative) else 0)
+        new_turns = turns + np.searchsorted(inserted, turns, side='right')
+        new_turns[new] = inserted + np.arange(len(inserted))
+        added = np.zeros(len(cumulative), dtype=np.int64)
+        added[new_turns] = counts
+        cumulative += np.cumsum(added)
+        return histories, offsets, successors, cumulative
+
+    def entries(self):
+        # number of (history, token) turns
+        return sum(len(s) for s in self.successors)
+
+    def token_id(self, token):
+        i = bisect_left(self.vocabulary, token)
+        if i < len(self.vocabulary) and self.vocabulary[i] == token:
+            return i
+        return None
+
+    def find(self, history):
+        # history ids -> index of history in its order or None
+        k = len(history)
+        if k > self.depth:
+            return None
+        if k == 0:
+            return 0 if len(self.offsets[0]) > 1 else None
+        key = _row_keys(np.array([history]))
+        keys = self.history_keys[k]
+        h = int(np.searchsorted(keys, key[0]))
+        if h < len(keys) and keys[h] == key[0]:
+            return h
+        return None
+
+    def sample(self, history, rnd=random):
+        # random next token id after history of ids, None if unknown
+        history = tuple(history)
+        turns = self.sampling_index.get(history)
+        if turns is None:
+            turns = self.sampling_index[history] = self.__turns_of(history)
+        return choose_turn(*turns, rnd) if turns else None
+
+    def __turns_of(self, history):
+        # entry of sampling_index
+        h = self.find(history)
+        if h is None:
+            return ()
+        k = len(history)
+        start, stop = self.offsets[k][h], self.offsets[k][h + 1]
+        cumulative = self.cumulative[k]
+        base = int(cumulative[start - 1]) if start else 0
+        return (self.successors[k][start:stop].tolist(),
+                [count - base for count in cumulative[start:stop].tolist()])
+
+    def sample_many(self, histories, rnds):
+        '''
+            [sample(history, rnd) for history, rnd in zip(histories, rnds)]
+            with one vectorized search for all histories of same length;
+            ranges of turns of all histories lie in one cumulative array of
+            their order, so chosen turns are found by one search too
+        '''
+        result = [None] * len(histories)
+        by_length = dict()
+        for i, history in enumerate(histories):
+            if len(history) <= self.depth:
+                by_length.setdefault(len(history), []).append(i)
+
+        for k, indices in by_length.items():
+            indices = np.array(indices)
+            if k:
+                keys = _row_keys(np.array([histories[i] for i in indices]))
+                history_keys = self.history_keys[k]
+                h = np.searchsorted(history_keys, keys)
+                found = h < len(history_keys)
+                found[found] = history_keys[h[found]] == keys[found]
+                indices, h = indices[found], h[found]
+            elif len(self.offsets[0]) > 1:
+                h = np.zeros(len(indices), dtype=np.int64)
+            else:
+                continue
+
+            cumulative = self.cumulative[k]
+            starts, stops = self.offsets[k][h], self.offsets[k][h + 1]
+            bases = np.where(starts > 0, cumulative[starts - 1], 0)
+            rnd_vars = [rnds[i].randint(1, int(total)) for i, total in
+                        zip(indices.tolist(), cumulative[stops - 1] - bases)]
+            turns = np.searchsorted(cumulative, bases + rnd_vars)
+            for i, token in zip(indices.tolist(),
+                                self.successors[k][turns].tolist()):
+                result[i] = token
+        return result
+
+    def turns(self, depth=None):
+        '''
+            generator of (history, [(token, count, history count), ...])
+            with histories and tokens in alphabetical order
+            depth - maximal length of histories, model depth by default
+        '''
+        if depth is None:
+            depth = self.depth
+        histories = []
+        for k in range(min(depth, self.depth) + 1):
+            for h, history in enumerate(np.asarray(self.histories[k])):
+                histories.append((tuple(history.tolist()), k, h))
+        histories.sort()
+
+        for history, k, h in histories:
+            start, stop = self.offsets[k][h], self.offsets[k][h + 1]
+            cumulative = self.cumulative[k]
+            base = int(cumulative[start - 1]) if start else 0
+            counts = np.diff(cumulative[start:stop], prepend=base).tolist()
+            total = int(cumulative[stop - 1]) - base
+            yield tuple(self.vocabulary[i] for i in history), [
+                (self.vocabulary[successor], count, total)
+                for successor, count in zip(
+                    self.successors[k][start:stop].tolist(), counts)]
+
+    def frequencies(self):
+        # same dict as text_generator._build_frequencies
+        return {(history, token): (count, total)
+                for history, moves in self.turns()
+                for token, count, total in moves}
+
+
+class _Vocabulary(object):
+    # sorted tokens of memory-mapped model, decoded on first access
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+        self.decoded = dict()  # token id -> token
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        token = self.decoded.get(i)
+        if token is not None:
+            return token
+        if not -len(self) <= i < len(self):
+            raise IndexError('token id out of range')
+        i %= len(self)
+        token = self.decoded[i] = bytes(
+            self.data[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+        return token
@@ -1,10 +1,18 @@
 #!/usr/bin/env python3
 import numpy as np
 import networkx
-from time import sleep
-from urllib.request import urlopen
-from urllib.parse import urlparse, urlunparse
+from scipy import sparse
+from scipy.sparse.linalg import spsolve_triangular
+from functools import partial
+from time import sleep, time
+from urllib.request import urlopen, Request
+from urllib.error import HTTPError
+from urllib.parse import urlparse
 from bs4 import BeautifulSoup
+from crawl_checkpoint import CrawlCheckpoint
+from link_extractor import absolutize_link, iter_links, read_chunks
+
+NOT_MODIFIED = 304
 
 
 def create_markov_chain_turns(links, N, damping_factor=0.1):
@@ -32,8 +40,10 @@ def create_markov_chain_turns(links, N, damping_factor=0.1):
 
 
 def page_rank(links, start_distribution, damping_factor=0.15,
-              tolerance=10 ** (-7)):
+              tolerance=10 ** (-7), return_trace=False):
     # estimate page_rank with power of prob_matrix
+    # trace - rows (iteration, residual, wall time)
+    start_time = time()
     prob_matrix = create_markov_chain_turns(
         links,
         len(start_distribution[0]),
@@ -41,96 +51,412 @@ def page_rank(links, start_distribution, damping_factor=0.15,
 
     prev_distr = start_distribution
     cur_distr = start_distribution * prob_matrix
+    trace = [(1, np.max(np.abs(prev_distr - cur_distr)), time() - start_time)]
 
-    while np.max(np.abs(prev_distr - cur_distr)) > tolerance:
+    while trace[-1][1] > tolerance:
         prev_distr = cur_distr
         cur_distr = cur_distr * prob_matrix
+        trace.append((len(trace) + 1, np.max(np.abs(prev_distr - cur_distr)),
+                      time() - start_time))
 
     distribution = cur_distr
 
-    # if return_trace:
-    #     return np.array(distribution).ravel(), np.array(trace)
-    # else:
-    return np.array(distribution).ravel()
+    if return_trace:
+        return np.array(distribution).ravel(), np.array(trace)
+    else:
+        return np.array(distribution).ravel()
 
 
-def load_links(url, sleep_time=1, attempts=5, timeout=20):
-    # load page from url
+def create_sparse_markov_chain_turns(links, N):
+    '''
+        links - directed graph of links (duplicates are counted as weights)
+        N - number of vertices
+        returns CSR matrix of link-following probabilities and boolean mask
+        of vertices without outgoing links; damping and dangling vertices
+        are applied as rank-one corrections in sparse_page_rank
+    '''
+    links = np.asarray(links, dtype=np.int64).reshape(-1, 2)
+    L = np.bincount(links[:, 0], minlength=N)  # number of links from
+
+    weights = 1.0 / L[links[:, 0]]
+    transitions = sparse.csr_matrix(
+        (weights, (links[:, 0], links[:, 1])), shape=(N, N))
+
+    return transitions, L == 0
+
+
+def _sparse_turn(transposed, dangling, distribution, damping_factor,
+                 teleport=None):
+    # one step of distribution * prob_matrix in O(E)
+    # distribution is a vector or a matrix with one distribution per column
+    N = transposed.shape[0]
+    jump_mass = damping_factor * distribution[~dangling].sum(axis=0) +\
+        distribution[dangling].sum(axis=0)
+
+    result = (1 - damping_factor) * (transposed @ distribution)
+    if teleport is None:
+        return result + jump_mass / N
+    return result + teleport * jump_mass
+
+
+def _power_solver(transposed, dangling, distribution, damping_factor,
+                  tolerance, start_time, extrapolation=None,
+                  extrapolation_period=4):
+    # power iteration, optionally accelerated by extrapolation of
+    # last iterates every extrapolation_period iterations; extrapolated
+    # vector which increases residual is rejected, and plain power
+    # iteration goes on from last iterate before it
+    history = [distribution]
+    trace = []
+    rejected = None  # (last iterate, its residual) while checked
+    while True:
+        prev_distr = history[-1]
+        cur_distr = _sparse_turn(
+            transposed, dangling, prev_distr, damping_factor)
+        residual = np.max(np.abs(prev_distr - cur_distr))
+        trace.append((len(trace) + 1, residual, time() - start_time))
+        if residual <= tolerance:
+            return cur_distr, trace
+
+        if rejected is not None:
+            if residual > rejected[1]:
+                history = [rejected[0]]
+                extrapolation = None
+                rejected = None
+                continue
+            rejected = None
+        history = history[-3:] + [cur_distr]
+        if extrapolation is not None and\
+                len(trace) % extrapolation_period == 0 and len(history) == 4:
+            rejected = (cur_distr, residual)
+            history = [extrapolation(history)]
+
+
+def _aitken_extrapolation(history):
+    # vector Aitken delta-squared of last three iterates: steps are taken
+    # as geometric with one ratio for all vertices (componentwise ratios
+    # are too noisy, their extrapolation is always rejected)
+    x2, x1, x0 = history[-3:]
+    step, prev_step = x0 - x1, x1 - x2
+    norm = prev_step @ prev_step
+    ratio = (step @ prev_step) / norm if norm else 0
+    if not 0 < ratio < 1:
+        return x0
+    result = np.abs(x0 + ratio / (1 - ratio) * step)
+    return result / result.sum()
+
+
+def _quadratic_extrapolation(history):
+    # Kamvar et al. quadratic extrapolation of last four iterates
+    x3, x2, x1, x0 = history
+    y = np.column_stack([x2 - x3, x1 - x3])
+    gamma = np.linalg.lstsq(y, -(x0 - x3), rcond=None)[0]
+    gamma = np.append(gamma, 1)
+    result = gamma.sum() * x2 + gamma[1:].sum() * x1 + gamma[2] * x0
+    result = np.abs(result)
+    return result / result.sum()
+
+
+def _gauss_seidel_solver(transposed, dangling, distribution, damping_factor,
+                         tolerance, start_time):
+    '''
+        sweeps of x = (1 - d) * T^T x + (d + (1 - d) * dangling mass) / N
+        in vertex order, new values are used as soon as they are computed:
+        (I - lower part) x_new = upper part x_old + jump
+    '''
+    N = transposed.shape[0]
+    matrix = (1 - damping_factor) * transposed
+    lower = (sparse.identity(N, format='csr') -
+             sparse.tril(matrix, format='csr')).tocsr()
+    upper = sparse.triu(matrix, k=1, format='csr')
+
+    trace = []
+    cur_distr = distribution
+    while True:
+        prev_distr = cur_distr
+        jump = (damping_factor + (1 - damping_factor) *
+                prev_distr[dangling].sum()) / N
+        cur_distr = spsolve_triangular(
+            lower, upper @ prev_distr + jump, lower=True)
+        cur_distr /= cur_distr.sum()
+        residual = np.max(np.abs(prev_distr - cur_distr))
+        trace.append((len(trace) + 1, residual, time() - start_time))
+        if residual <= tolerance:
+            return cur_distr, trace
+
+
+def _adaptive_solver(transposed, dangling, distribution, damping_factor,
+                     tolerance, start_time, full_product_share=0.5):
+    # power iteration where vertices with change below tolerance are frozen
+    # and their ranks are not recomputed; result is accepted only after
+    # full product with change below tolerance, if that check fails
+    # (frozen ranks have drifted), plain power iteration is used to the end;
+    # it saves row products, but needs more iterations than power and
+    # on graphs of page_rank_benchmark is not faster in wall time (row
+    # slices cost about as much as products), kept for comparison
+    N = transposed.shape[0]
+    cur_distr = distribution.copy()
+    active = np.arange(N)
+    adaptive = True
+    trace = []
+    while True:
+        jump_mass = damping_factor * cur_distr[~dangling].sum() +\
+            cur_distr[dangling].sum()
+        if not adaptive or len(active) == 0 or\
+                len(active) > full_product_share * N:
+            new_distr = (1 - damping_factor) * (transposed @ cur_distr) +\
+                jump_mass / N
+            new_distr /= new_distr.sum()
+            change = np.abs(new_distr - cur_distr)
+            cur_distr = new_distr
+            trace.append((len(trace) + 1, change.max(), time() - start_time))
+            if change.max() <= tolerance:
+                return cur_distr, trace
+            if len(active) == 0:
+                adaptive = False
+            active = np.flatnonzero(change > tolerance)
+        else:
+            new_distr = (1 - damping_factor) *\
+                (transposed[active] @ cur_distr) + jump_mass / N
+            change = np.abs(new_distr - cur_distr[active])
+            cur_distr[active] = new_distr
+            trace.append((len(trace) + 1, change.max(), time() - start_time))
+            active = active[change > tolerance]
+
+
+SOLVERS = {
+    'power': _power_solver,
+    'aitken': partial(_power_solver, extrapolation=_aitken_extrapolation),
+    'quadratic': partial(_power_solver,
+                         extrapolation=_quadratic_extrapolation),
+    'gauss_seidel': _gauss_seidel_solver,
+    'adaptive': _adaptive_solver
+}
+
+
+def sparse_page_rank(links, start_distribution, damping_factor=0.15,
+                     tolerance=10 ** (-7), solver='power', return_trace=False):
+    '''
+        same result as page_rank, but stores only real edges
+        solver - one of SOLVERS:
+            power - power iteration
+            aitken, quadratic - power iteration with extrapolation,
+                fewer iterations when one slow mode dominates error (like
+                site clusters of web_like graphs), else about the same
+            gauss_seidel - Gauss-Seidel sweeps
+            adaptive - converged vertices are not recomputed (fewer row
+                products, not fewer iterations)
+        trace - rows (iteration, residual, wall time)
+    '''
+    start_time = time()
+    if solver not in SOLVERS:
+        raise ValueError('unknown solver {}, use one of: {}'.format(
+            solver, ', '.join(sorted(SOLVERS))))
 
-    sleep(sleep_time)  # just to avoid ban
+    N = np.shape(start_distribution)[-1]
+    transitions, dangling = create_sparse_markov_chain_turns(links, N)
+    transposed = transitions.T.tocsr()
+
+    distribution, trace = SOLVERS[solver](
+        transposed, dangling,
+        np.asarray(start_distribution, dtype=float).ravel(),
+        damping_factor, tolerance, start_time)
+
+    if return_trace:
+        return distribution, np.array(trace)
+    else:
+        return distribution
+
+
+def personalized_page_rank(links, personalization, damping_factor=0.15,
+                           tolerance=10 ** (-7)):
+    '''
+        links - directed graph of links
+        personalization - N x K matrix, column k is teleport distribution
+            of k-th ranking (it is normalized to sum 1)
+        returns N x K matrix of ranks; all columns are iterated with one
+            sparse product per step, converged columns are not updated
+    '''
+    personalization = np.array(personalization, dtype=float)
+    if personalization.ndim == 1:
+        personalization = personalization[:, np.newaxis]
+    N = personalization.shape[0]
+    sums = personalization.sum(axis=0)
+    if np.any(sums <= 0) or np.any(personalization < 0):
+        raise ValueError('personalization columns must be non-negative '
+                         'with positive sum')
+    personalization /= sums
+
+    transitions, dangling = create_sparse_markov_chain_turns(links, N)
+    transposed = transitions.T.tocsr()
+
+    distribution = personalization.copy()
+    active = np.arange(personalization.shape[1])
+    while len(active):
+        prev_distr = distribution[:, active]
+        cur_distr = _sparse_turn(transposed, dangling, prev_distr,
+                                 damping_factor, personalization[:, active])
+        distribution[:, active] = cur_distr
+        active = active[
+            np.max(np.abs(prev_distr - cur_distr), axis=0) > tolerance]
+
+    return distribution
+
+
+def parse_links(page, url):
+    # extract global links from html page (bytes, str or file-like)
     parsed_url = urlparse(url)
+    soup = BeautifulSoup(page, 'lxml')
     links = []
+
+    for tag_a in soup('a'):
+        if 'href' in tag_a.attrs:
+            links.append(absolutize_link(tag_a['href'], parsed_url))
+
+    return links
+
+
+def load_links(url, sleep_time=1, attempts=5, timeout=20, cache=None,
+               streaming=True):
+    # load page from url
+    # cache - FetchCache, unchanged pages are revalidated or not requested
+    # streaming - scan response by chunks instead of building BeautifulSoup
+    entry = None
+    headers = dict()
+    if cache is not None:
+        entry = cache.get(url)
+        if entry is not None:
+            if cache.is_fresh(entry):
+                return entry.links
+            headers = entry.conditional_headers()
+
+    sleep(sleep_time)  # just to avoid ban
     #  try to load
     for i in range(attempts):
         try:
-            soup = BeautifulSoup(urlopen(url, timeout=timeout), 'lxml')
-            break
+            response = urlopen(Request(url, headers=headers), timeout=timeout)
+            if streaming:
+                links = list(iter_links(
+                    read_chunks(response), url,
+                    encoding=response.headers.get_content_charset()))
+            else:
+                links = parse_links(response, url)
+            if cache is not None:
+                cache.put(url, links, response.headers.get('ETag'),
+                          response.headers.get('Last-Modified'))
+            return links
+
+        except HTTPError as e:
+            if e.code == NOT_MODIFIED and entry is not None:
+                cache.revalidated(url)
+                return entry.links
+            print(e)
+            if i == attempts - 1:
+                raise e
 
         except Exception as e:
             print(e)
             if i == attempts - 1:
                 raise e
 
-    for tag_a in soup('a'):
-        if 'href' in tag_a.attrs:
-            link = list(urlparse(tag_a['href']))
 
-            # convert local links to global
-            if link[0] == '':
-                link[0] = parsed_url.scheme
+def get_site(url):
+    return urlparse(url).netloc
 
-            if link[1] == '':
-                link[1] = parsed_url.netloc
 
-            links.append(urlunparse(link))
+def is_retryable(error):
+    # missing or forbidden page stays so on resume, other failures may not
+    status = getattr(error, 'status', None)
+    return not (isinstance(status, int) and 400 <= status < 500 and
+                status not in (408, 429))
 
-    return links
 
+def add_page_links(i, links_from_url, site, urls, urls_index, links):
+    # add links of i-th page to web-graph, returns newly found urls
+    new_urls = []
 
-def get_site(url):
-    return urlparse(url).netloc
+    # filter outer links
+    links_from_url = list(filter(lambda x: get_site(x) == site,
+                                 links_from_url))
+
+    for j in range(len(links_from_url)):
+        # link to old url
+        if links_from_url[j] in urls_index:
+            links.append((i, urls_index[links_from_url[j]]))
+
+        # link to new url
+        else:
+            links.append((i, len(urls)))
+            urls_index[links_from_url[j]] = len(urls)
+            urls.append(links_from_url[j])
+            new_urls.append(links_from_url[j])
+
+    return new_urls
 
 
-def build_links(url, N, sleep_time):
+def build_links(url, N, sleep_time, checkpoint_path=None,
+                checkpoint_every=100, cache=None):
+    '''
+        checkpoint_path - append-only file with crawl state; crawl is
+            resumed from it and already loaded pages are not fetched again,
+            pages failed by network or server errors are fetched again
+        checkpoint_every - number of pages between checkpoint writes
+        cache - FetchCache shared between crawls
+    '''
     urls = []
     urls.append(url)
     urls_index = dict()
     links = []
     site = get_site(url)
-    for i in range(N):
+    start = 0
+    checkpoint = None
+    if checkpoint_path is not None:
+        checkpoint = CrawlCheckpoint(checkpoint_path, url, checkpoint_every)
+        start, links, urls, urls_index = checkpoint.load()
+
+    def crawl_page(i, retry=False):
+        links_count = len(links)
+        new_urls = []
+        failed = False
         try:
-            links_from_url = load_links(urls[i], sleep_time)
-            # filter outer links
-            links_from_url = list(filter(lambda x: get_site(x) == site,
-                                         links_from_url))
-
-            # add new links to web-graph
-            for j in range(len(links_from_url)):
-                # link to old url
-                if links_from_url[j] in urls_index:
-                    links.append((i, urls_index[links_from_url[j]]))
-
-                # link to new url
-                else:
-                    links.append((i, len(urls)))
-                    urls_index[links_from_url[j]] = len(urls)
-                    urls.append(links_from_url[j])
-
-        except:
-            pass
+            links_from_url = load_links(urls[i], sleep_time, cache=cache)
+            new_urls = add_page_links(
+                i, links_from_url, site, urls, urls_index, links)
+
+        except Exception as e:
+            print('page {} is not crawled: {}'.format(urls[i], e))
+            failed = is_retryable(e)
+
+        if checkpoint is not None:
+            checkpoint.add_page(
+                i, new_urls, links[links_count:], failed, retry)
+
+    try:
+        if checkpoint is not None:
+            for i in list(checkpoint.failed):
+                crawl_page(i, retry=True)
+
+        for i in range(start, N):
+            if i >= len(urls):
+                break  # nothing more to crawl
+            crawl_page(i)
+    finally:
+        if checkpoint is not None:
+            checkpoint.flush()
 
     return links, urls
 
 
-def get_links(url, N, sleep_time=0.1):
-    links, urls = build_links(url, N, sleep_time)
+def get_links(url, N, sleep_time=0.1, checkpoint_path=None, cache=None):
+    links, urls = build_links(url, N, sleep_time, checkpoint_path,
+                              cache=cache)
     return list(set(filter(lambda x: x[0] < N and x[1] < N, links))), urls[:N]
 
 
 def get_graph(links, urls):
     N = len(urls)
     start_distribution = np.ones((1, N)) / N
-    pr_distribution = page_rank(links, start_distribution)
+    pr_distribution = sparse_page_rank(links, start_distribution)
 
     G = networkx.DiGraph()
     G.add_nodes_from(np.arange(N))
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+'''
+benchmarks of page_rank.py hot paths on synthetic graphs and of crawlers
+on local fixture site:
+
+    python3 page_rank_benchmark.py --sizes 1000 100000 10000000 \\
+        --graphs power_law web_like --output results.json
+'''
+import argparse
+import json
+import sys
+import tracemalloc
+from time import perf_counter, time
+import numpy as np
+import page_rank
+import async_crawler
+from fixture_site import FixtureSite
+
+DENSE_LIMIT = 3000  # dense engine allocates N x N matrix
+TABLE_FORMAT = '{:<10} {:>9} {:>10} {:<13} {:>8} {:>8} {:>5} {:>10} {:>12}'
+
+
+def power_law_graph(N, average_degree=10, exponent=2.1, random_state=None):
+    '''
+        directed graph with power-law distributed in-degrees (popularity)
+        and out-degrees; returns (E, 2) int64 array of links
+    '''
+    random = np.random.default_rng(random_state)
+    out_degree = np.minimum(
+        random.zipf(exponent, N), max(N // 10, 1)).astype(np.int64)
+    out_degree = np.maximum(np.round(
+        out_degree * average_degree / out_degree.mean()), 0).astype(np.int64)
+    sources = np.repeat(np.arange(N), out_degree)
+    targets = _popular_vertices(random, N, len(sources), exponent)
+    return np.column_stack([sources, targets])
+
+
+def web_like_graph(N, average_degree=10, site_size=100, local_share=0.8,
+                   dangling_share=0.1, random_state=None):
+    '''
+        vertices are grouped to sites of site_size pages, local_share of
+        links lead to pages of the same site (mostly to its first pages,
+        as menus do), others to popular pages of whole web;
+        dangling_share of pages have no links
+    '''
+    random = np.random.default_rng(random_state)
+    out_degree = random.poisson(average_degree, N)
+    out_degree[random.random(N) < dangling_share] = 0
+    sources = np.repeat(np.arange(N), out_degree)
+    E = len(sources)
+
+    local = random.random(E) < local_share
+    site_start = sources // site_size * site_size
+    site_pages = np.minimum(site_size, N - site_start)
+    local_targets = site_start + np.minimum(
+        random.geometric(5 / site_size, E) - 1, site_pages - 1)
+    targets = np.where(local, local_targets,
+                       _popular_vertices(random, N, E, 2.1))
+    return np.column_stack([sources, targets])
+
+
+def _popular_vertices(random, N, size, exponent):
+    # vertex ids with probability ~ rank ^ (-1 / (exponent - 1)), so that
+    # in-degrees have power-law distribution with given exponent
+    power = 1 / (exponent - 1)
+    uniform = random.random(size)
+    if power == 1:
+        ranks = N ** uniform
+    else:
+        ranks = ((N ** (1 - power) - 1) * uniform + 1) ** (1 / (1 - power))
+    ranks = np.clip(ranks.astype(np.int64) - 1, 0, N - 1)
+    return random.permutation(N)[ranks]
+
+
+GRAPHS = {
+    'power_law': power_law_graph,
+    'web_like': web_like_graph
+}
+
+
+def measure(function, *args, **kwargs):
+    '''
+        returns (result, wall time, peak traced memory in bytes);
+        tracing slows down python code a lot and unevenly, so function is
+        timed without it and then called once more with tracing; result
+        (with its trace times) is one of untraced call
+    '''
+    start = perf_counter()
+    result = function(*args, **kwargs)
+    seconds = perf_counter() - start
+    tracemalloc.start()
+    try:
+        function(*args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+def _sparse_build(links, N):
+    # matrix preparation done by page_rank.sparse_page_rank
+    transitions, dangling = page_rank.create_sparse_markov_chain_turns(
+        links, N)
+    return transitions.T.tocsr(), dangling
+
+
+def benchmark_rank(graph, N, solvers=('power',), random_state=0):
+    # one record per engine: build and rank stages measured separately
+    links = GRAPHS[graph](N, random_state=random_state)
+    start_distribution = np.ones((1, N)) / N
+    records = []
+
+    def record(engine, build, rank, iterations):
+        rank_seconds = max(rank[1], 1e-9)
+        records.append({
+            'graph': graph,
+            'N': N,
+            'E': len(links),
+            'engine': engine,
+            'build_seconds': build[1],
+            'rank_seconds': rank[1],
+            'iterations': iterations,
+            'peak_bytes': max(build[2], rank[2]),
+            'edges_per_second': len(links) * iterations / rank_seconds
+        })
+
+    if N <= DENSE_LIMIT:
+        link_list = [tuple(link) for link in links.tolist()]
+        build = measure(page_rank.create_markov_chain_turns,
+                        link_list, N, 0.15)
+        rank = measure(page_rank.page_rank, link_list, start_distribution,
+                       return_trace=True)
+        # page_rank builds the matrix itself
+        rank = (rank[0], max(rank[1] - build[1], 0), rank[2])
+        record('dense', build, rank, len(rank[0][1]))
+
+    for solver in solvers:
+        build = measure(_sparse_build, links, N)
+        transposed, dangling = build[0]
+        rank = measure(
+            page_rank.SOLVERS[solver], transposed, dangling,
+            start_distribution.ravel(), 0.15, 10 ** (-7), time())
+        record('sparse/' + solver, build, rank, len(rank[0][1]))
+
+    return records
+
+
+def benchmark_crawl(pages=200, delay=0.01, concurrency=16):
+    # sequential and concurrent crawl of local site with network delay
+    records = []
+    with FixtureSite(pages, links_per_page=5, padding=2000,
+                     delay=delay) as site:
+        for engine, crawl in (
+                ('sequential', lambda: page_rank.build_links(
+                    site.url, pages, 0)),
+                ('async', lambda: async_crawler.build_links(
+                    site.url, pages, concurrency, rate=10 ** 6))):
+            (links, urls), seconds, peak = measure(crawl)
+            records.append({
+                'graph': 'crawl',
+                'N': pages,
+                'E': len(links),
+                'engine': engine,
+                'build_seconds': seconds,
+                'rank_seconds': 0,
+                'iterations': 0,
+                'peak_bytes': peak,
+                'edges_per_second': len(links) / max(seconds, 1e-9)
+            })
+    return records
+
+
+def print_records(records, file=sys.stdout):
+    print(TABLE_FORMAT.format(
+        'graph', 'N', 'E', 'engine', 'build,s', 'rank,s', 'iter',
+        'peak,MB', 'edges/s'), file=file)
+    for r in records:
+        print(TABLE_FORMAT.format(
+            r['graph'], r['N'], r['E'], r['engine'],
+            '{:.3f}'.format(r['build_seconds']),
+            '{:.3f}'.format(r['rank_seconds']), r['iterations'],
+            '{:.1f}'.format(r['peak_bytes'] / 2 ** 20),
+            '{:.3g}'.format(r['edges_per_second'])), file=file)
+
+
+def main(arg_list):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10 ** 3, 10 ** 4, 10 ** 5])
+    parser.add_argument('--graphs', nargs='+', choices=sorted(GRAPHS),
+                        default=sorted(GRAPHS))
+    parser.add_argument('--solvers', nargs='+',
+                        choices=sorted(page_rank.SOLVERS), default=['power'])
+    parser.add_argument('--crawl-pages', type=int, default=200,
+                        help='0 to skip crawler benchmark')
+    parser.add_argument('--crawl-delay', type=float, default=0.01)
+    parser.add_argument('--output', help='json file for results')
+    args = parser.parse_args(arg_list)
+
+    records = []
+    for graph in args.graphs:
+        for N in args.sizes:
+            records += benchmark_rank(graph, N, args.solvers)
+    if args.crawl_pages:
+        records += benchmark_crawl(args.crawl_pages, args.crawl_delay)
+
+    print_records(records)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(records, f, indent=2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,457 @@
+import os
+import tempfile
+import time
+import unittest
+import numpy as np
+import page_rank
+import async_crawler
+import fetch_cache
+import link_extractor
+import edge_file
+import incremental_page_rank
+import monte_carlo_page_rank
+import parallel_page_rank
+import page_rank_benchmark
+from fixture_site import FixtureSite
+from concurrent.futures import ProcessPoolExecutor
+
+LINKS = [(0, 1), (0, 2), (1, 2), (2, 0), (3, 2), (3, 2), (4, 3)]
+N = 6  # vertex 5 has no outgoing links
+
+
+class TestSparsePageRank(unittest.TestCase):
+    def test_transitions(self):
+        transitions, dangling = page_rank.create_sparse_markov_chain_turns(
+            LINKS, N)
+        self.assertEqual(transitions.nnz, 6)
+        self.assertTrue(np.allclose(transitions.sum(axis=1).A1[~dangling], 1))
+        self.assertEqual(list(np.flatnonzero(dangling)), [5])
+
+    def test_same_as_dense(self):
+        start_distribution = np.ones((1, N)) / N
+        for damping_factor in (0.15, 0.5):
+            dense = page_rank.page_rank(
+                LINKS, start_distribution, damping_factor=damping_factor)
+            sparse = page_rank.sparse_page_rank(
+                LINKS, start_distribution, damping_factor=damping_factor)
+            self.assertTrue(np.allclose(dense, sparse, atol=1e-6))
+            self.assertAlmostEqual(sparse.sum(), 1)
+
+    def test_solvers(self):
+        M = 500
+        links = random_links(M, 3000) + [(i, i + 1) for i in range(M - 1)]
+        start_distribution = np.ones((1, M)) / M
+        expected = page_rank.sparse_page_rank(links, start_distribution)
+        for solver in page_rank.SOLVERS:
+            result, trace = page_rank.sparse_page_rank(
+                links, start_distribution, solver=solver, return_trace=True)
+            self.assertTrue(np.allclose(result, expected, atol=1e-6), solver)
+            self.assertEqual(trace.shape[1], 3)
+            self.assertEqual(list(trace[:, 0]), list(range(1, len(trace) + 1)))
+            self.assertLessEqual(trace[-1, 1], 10 ** (-7))
+            self.assertTrue(np.all(np.diff(trace[:, 2]) >= 0))
+        self.assertRaises(ValueError, page_rank.sparse_page_rank,
+                          links, start_distribution, solver='newton')
+
+    def test_solver_iterations(self):
+        M = 2000
+        for graph in page_rank_benchmark.GRAPHS:
+            links = page_rank_benchmark.GRAPHS[graph](M, random_state=1)
+            results = {solver: page_rank.sparse_page_rank(
+                links, np.ones(M) / M, solver=solver, return_trace=True)
+                for solver in page_rank.SOLVERS}
+            iterations = {solver: len(trace)
+                          for solver, (_, trace) in results.items()}
+            self.assertLess(iterations['gauss_seidel'], iterations['power'])
+            for solver in ('aitken', 'quadratic'):
+                if graph == 'web_like':  # slow mode of site clusters
+                    self.assertLessEqual(iterations[solver],
+                                         0.75 * iterations['power'], solver)
+                else:  # rejected extrapolation costs one product at most
+                    self.assertLessEqual(iterations[solver],
+                                         iterations['power'] + 1, solver)
+            # adaptive saves row products, not iterations
+            for solver, (distribution, trace) in results.items():
+                self.assertLessEqual(trace[-1, 1], 10 ** (-7), solver)
+                self.assertTrue(np.allclose(
+                    distribution, results['power'][0], atol=10 ** (-6)),
+                    solver)
+
+    def test_dense_trace(self):
+        result, trace = page_rank.page_rank(
+            LINKS, np.ones((1, N)) / N, return_trace=True)
+        self.assertEqual(len(result), N)
+        self.assertLessEqual(trace[-1, 1], 10 ** (-7))
+
+    def test_no_links(self):
+        sparse = page_rank.sparse_page_rank([], np.ones((1, 3)) / 3)
+        self.assertTrue(np.allclose(sparse, 1 / 3))
+
+
+class TestPersonalizedPageRank(unittest.TestCase):
+    def test_uniform_is_page_rank(self):
+        result = page_rank.personalized_page_rank(LINKS, np.ones(N))
+        self.assertEqual(result.shape, (N, 1))
+        self.assertTrue(np.allclose(
+            result[:, 0],
+            page_rank.sparse_page_rank(LINKS, np.ones((1, N)) / N),
+            atol=1e-6))
+
+    def test_columns(self):
+        damping_factor = 0.3
+        personalization = np.random.RandomState(1).rand(N, 4)
+        personalization[:, 1] = np.eye(N)[5]
+        result = page_rank.personalized_page_rank(
+            LINKS, personalization, damping_factor)
+
+        for k in range(personalization.shape[1]):
+            # dense google matrix, dangling vertices jump by teleport
+            teleport = personalization[:, k] / personalization[:, k].sum()
+            google = np.tile(teleport, (N, 1))
+            for i in range(N):
+                targets = [l[1] for l in LINKS if l[0] == i]
+                if targets:
+                    google[i] *= damping_factor
+                    for j in targets:
+                        google[i][j] += (1 - damping_factor) / len(targets)
+            expected = teleport
+            for step in range(1000):
+                expected = expected @ google
+            self.assertTrue(np.allclose(result[:, k], expected, atol=1e-6))
+
+    def test_bad_personalization(self):
+        self.assertRaises(ValueError, page_rank.personalized_page_rank,
+                          LINKS, np.zeros((N, 2)))
+
+
+def random_links(N, E, seed=0):
+    # graph with repeated edges and vertices without links
+    rng = np.random.RandomState(seed)
+    sources = rng.randint(0, N // 2, E) * 2
+    return [tuple(link) for link in
+            np.column_stack([sources, rng.randint(0, N, E)]).tolist()]
+
+
+class TestEdgeFile(unittest.TestCase):
+    def test_write_and_rank(self):
+        N = 300
+        links = random_links(N, 2000)
+        start_distribution = np.ones((1, N)) / N
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'graph')
+            with edge_file.EdgeFileWriter(path, N, block_edges=128) as writer:
+                for i in range(0, len(links), 300):
+                    writer.add(links[i:i + 300])
+            edges = edge_file.EdgeFile(path)
+            self.assertEqual(edges.dtype, np.int32)
+            self.assertEqual(
+                sorted(map(tuple, edges.links().tolist())), sorted(set(links)))
+            self.assertTrue(np.allclose(
+                edge_file.edge_file_page_rank(path, block_edges=64),
+                page_rank.sparse_page_rank(
+                    list(set(links)), start_distribution),
+                atol=1e-6))
+
+            edge_file.write_edge_file(
+                path, links, N, dtype=np.int64, deduplicate=False)
+            self.assertEqual(edge_file.EdgeFile(path).E, len(links))
+            self.assertTrue(np.allclose(
+                edge_file.edge_file_page_rank(path),
+                page_rank.sparse_page_rank(links, start_distribution),
+                atol=1e-6))
+
+    def test_bad_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'graph')
+            with open(path, 'wb') as f:
+                f.write(b'not a graph')
+            self.assertRaises(ValueError, edge_file.EdgeFile, path)
+            self.assertRaises(
+                ValueError, edge_file.write_edge_file, path, [(0, 5)], 5)
+
+
+class TestIncrementalPageRank(unittest.TestCase):
+    def assertColdRank(self, ranking):
+        cold = page_rank.sparse_page_rank(
+            ranking.links(), np.ones((1, ranking.N)) / ranking.N)
+        self.assertTrue(np.allclose(ranking.rank(), cold, atol=1e-6))
+
+    def test_updates(self):
+        N = 2000
+        links = random_links(N, 10000)
+        ranking = incremental_page_rank.IncrementalPageRank(links, N)
+        self.assertColdRank(ranking)
+
+        ranking.add_edges([(2, 7), (4, 7), (7, 1)])
+        self.assertColdRank(ranking)
+
+        ranking.remove_edges([(2, 7), links[0], links[1]])
+        self.assertColdRank(ranking)
+
+        new_nodes = ranking.add_nodes(3)
+        ranking.add_edges([(new_nodes[0], 0), (0, new_nodes[1])])
+        self.assertColdRank(ranking)
+
+        new_ids = ranking.remove_nodes([0, 10, new_nodes[2]])
+        self.assertEqual(ranking.N, N)
+        self.assertEqual(new_ids[11], 9)
+        self.assertColdRank(ranking)
+
+    def test_local_updates(self):
+        N = 20000
+        links = random_links(N, 5 * N)
+        ranking = incremental_page_rank.IncrementalPageRank(links, N)
+        for change, edges in ((ranking.add_edges, [(2, 7), (4, 7), (7, 1)]),
+                              (ranking.remove_edges, [(2, 7), links[0]])):
+            change(edges)
+            exact = page_rank.sparse_page_rank(
+                ranking.links(), np.ones((1, N)) / N, tolerance=1e-14)
+            self.assertLessEqual(np.abs(ranking.rank() - exact).sum(),
+                                 ranking.tolerance)
+            # cold solve needs tens of full sparse products
+            self.assertLess(ranking.pushed_edges, len(links) / 10)
+
+    def test_bad_vertex(self):
+        ranking = incremental_page_rank.IncrementalPageRank(LINKS, N)
+        self.assertRaises(ValueError, ranking.add_edges, [(0, N)])
+
+
+class TestMonteCarloPageRank(unittest.TestCase):
+    def test_top_k(self):
+        M = 1000
+        links = random_links(M, 5000) + [(i, 0) for i in range(1, M, 3)]
+        expected = page_rank.sparse_page_rank(links, np.ones((1, M)) / M)
+        ranking = monte_carlo_page_rank.MonteCarloPageRank(
+            links, M, walks_per_batch=20000, random_state=0)
+        self.assertTrue(np.all(np.isinf(ranking.run().errors())))
+
+        answers = list(ranking.refine(5, max_batches=7))
+        self.assertEqual(len(answers), 7)
+        top, ranks, errors = answers[-1]
+        self.assertEqual(top[0], 0)
+        self.assertTrue(np.all(
+            expected[top] >= np.sort(expected)[-5] - 3 * errors.max()))
+        self.assertTrue(np.all(np.abs(ranks - expected[top]) < 3 * errors))
+        self.assertAlmostEqual(ranking.ranks().sum(), 1)
+
+    def test_random_state(self):
+        first, second = [monte_carlo_page_rank.MonteCarloPageRank(
+            LINKS, N, walks_per_batch=100, random_state=1).run(2)
+            for i in range(2)]
+        self.assertTrue(np.array_equal(first.ranks(), second.ranks()))
+        self.assertEqual(len(first.top_k(20)[0]), N)
+
+
+class TestParallelPageRank(unittest.TestCase):
+    def test_same_as_sparse(self):
+        M = 2000
+        links = random_links(M, 10000)
+        start_distribution = np.ones((1, M)) / M
+        expected = page_rank.sparse_page_rank(links, start_distribution)
+        for processes in (1, 3):
+            result = parallel_page_rank.parallel_page_rank(
+                links, start_distribution, processes=processes)
+            self.assertTrue(np.allclose(result, expected, atol=1e-9))
+
+    def test_more_processes_than_work(self):
+        result = parallel_page_rank.parallel_page_rank(
+            LINKS, np.ones((1, N)) / N, processes=4)
+        self.assertTrue(np.allclose(
+            result, page_rank.sparse_page_rank(LINKS, np.ones((1, N)) / N)))
+
+
+class TestPageRankBenchmark(unittest.TestCase):
+    def test_graphs(self):
+        for graph in page_rank_benchmark.GRAPHS.values():
+            links = graph(1000, random_state=0)
+            self.assertEqual(links.shape[1], 2)
+            self.assertGreater(len(links), 5000)
+            self.assertTrue(0 <= links.min() and links.max() < 1000)
+            self.assertTrue(np.array_equal(
+                links, graph(1000, random_state=0)))
+
+    def test_benchmark_rank(self):
+        records = page_rank_benchmark.benchmark_rank(
+            'web_like', 300, solvers=('power', 'gauss_seidel'))
+        self.assertEqual([r['engine'] for r in records],
+                         ['dense', 'sparse/power', 'sparse/gauss_seidel'])
+        for r in records:
+            self.assertGreater(r['iterations'], 0)
+            self.assertGreater(r['peak_bytes'], 0)
+
+
+class TestAsyncCrawler(unittest.TestCase):
+    def test_same_as_build_links(self):
+        with FixtureSite() as site:
+            expected = page_rank.build_links(site.url, 30, 0)
+            expected_requests = sorted(site.requests)
+            site.requests.clear()
+            result = async_crawler.build_links(
+                site.url, 30, concurrency=8, rate=1000, burst=8)
+        self.assertEqual(result, expected)
+        self.assertEqual(sorted(site.requests), expected_requests)
+
+    def test_token_bucket(self):
+        async def acquire_all(bucket, n):
+            for i in range(n):
+                await bucket.acquire()
+
+        bucket = async_crawler.TokenBucket(rate=100, capacity=5)
+        start = time.monotonic()
+        async_crawler.asyncio.run(acquire_all(bucket, 15))
+        self.assertGreater(time.monotonic() - start, 0.09)
+
+
+class TestCrawlCheckpoint(unittest.TestCase):
+    def test_resume(self):
+        with FixtureSite() as site, tempfile.TemporaryDirectory() as tmp:
+            expected = page_rank.build_links(site.url, 30, 0)
+            expected_requests = sorted(site.requests)
+            site.requests.clear()
+            path = os.path.join(tmp, 'crawl.jsonl')
+            page_rank.build_links(site.url, 10, 0, path, checkpoint_every=3)
+            result = page_rank.build_links(site.url, 30, 0, path)
+            self.assertEqual(result, expected)
+            self.assertEqual(sorted(site.requests), expected_requests)
+
+            # torn record is dropped and its page is loaded again
+            with open(path, 'a') as f:
+                f.write('{"page": 30, "urls"')
+            self.assertEqual(
+                page_rank.build_links(site.url, 30, 0, path), expected)
+
+    def assert_same_graph(self, result, expected):
+        # page ids depend on crawl order, so graphs are compared by urls
+        (links, urls), (expected_links, expected_urls) = result, expected
+        self.assertEqual(sorted(urls), sorted(expected_urls))
+        self.assertEqual(
+            {(urls[i], urls[j]) for i, j in links},
+            {(expected_urls[i], expected_urls[j])
+             for i, j in expected_links})
+
+    def test_failed_page_retried(self):
+        with FixtureSite() as site, tempfile.TemporaryDirectory() as tmp:
+            expected = page_rank.build_links(site.url, 100, 0)
+            path = os.path.join(tmp, 'crawl.jsonl')
+            site.failing.add('/page/1')
+            page_rank.build_links(site.url, 10, 0, path)
+            site.failing.clear()
+            site.requests.clear()
+            self.assert_same_graph(
+                page_rank.build_links(site.url, 100, 0, path), expected)
+            self.assertIn('/page/1', site.requests)
+            # missing page is not requested again
+            self.assertNotIn('/page/missing', site.requests)
+
+    def test_async_failed_page_retried(self):
+        with FixtureSite() as site, tempfile.TemporaryDirectory() as tmp:
+            expected = page_rank.build_links(site.url, 100, 0)
+            path = os.path.join(tmp, 'crawl.jsonl')
+            site.failing.add('/page/1')
+            async_crawler.build_links(
+                site.url, 10, rate=1000, checkpoint_path=path)
+            site.failing.clear()
+            site.requests.clear()
+            self.assert_same_graph(async_crawler.build_links(
+                site.url, 100, rate=1000, checkpoint_path=path), expected)
+            self.assertIn('/page/1', site.requests)
+            self.assertNotIn('/page/missing', site.requests)
+
+    def test_async_resume(self):
+        with FixtureSite() as site, tempfile.TemporaryDirectory() as tmp:
+            expected = page_rank.build_links(site.url, 30, 0)
+            expected_requests = sorted(site.requests)
+            site.requests.clear()
+            path = os.path.join(tmp, 'crawl.jsonl')
+            async_crawler.build_links(
+                site.url, 10, rate=1000, checkpoint_path=path)
+            result = async_crawler.build_links(
+                site.url, 30, rate=1000, checkpoint_path=path)
+            self.assertEqual(result, expected)
+            self.assertEqual(sorted(site.requests), expected_requests)
+
+
+class TestFetchCache(unittest.TestCase):
+    def test_normalize_url(self):
+        self.assertEqual(
+            fetch_cache.normalize_url('HTTP://Example.COM:80#top'),
+            'http://example.com/')
+        self.assertEqual(
+            fetch_cache.normalize_url('https://example.com:8443/a?b=1'),
+            'https://example.com:8443/a?b=1')
+
+    def test_revalidation(self):
+        def loaded_pages(site):
+            # requests answered with full page
+            return len(site.requests) - site.not_modified -\
+                site.requests.count('/page/missing')
+
+        with FixtureSite() as site, tempfile.TemporaryDirectory() as tmp:
+            with fetch_cache.FetchCache(os.path.join(tmp, 'cache')) as cache:
+                expected = page_rank.build_links(site.url, 20, 0, cache=cache)
+                self.assertEqual(loaded_pages(site), len(cache))
+
+                for result in (
+                        lambda: page_rank.build_links(
+                            site.url, 20, 0, cache=cache),
+                        lambda: async_crawler.build_links(
+                            site.url, 20, rate=1000, cache=cache)):
+                    site.requests.clear()
+                    site.not_modified = 0
+                    self.assertEqual(result(), expected)
+                    self.assertEqual(loaded_pages(site), 0)
+                    self.assertGreater(site.not_modified, 0)
+
+                cache.max_age = 60
+                site.requests.clear()
+                result = page_rank.build_links(site.url, 20, 0, cache=cache)
+                self.assertEqual(result, expected)
+                self.assertEqual(
+                    len(site.requests), site.requests.count('/page/missing'))
+
+    def test_lru_eviction(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = fetch_cache.FetchCache(os.path.join(tmp, 'cache'), 300)
+            for i in range(10):
+                cache.put('http://a/{}'.format(i), ['http://a/x'] * 3)
+                cache.get('http://a/0')
+            self.assertLessEqual(cache.size(), 300)
+            self.assertIsNotNone(cache.get('http://a/0'))
+            self.assertIsNotNone(cache.get('http://a/9'))
+            self.assertIsNone(cache.get('http://a/1'))
+            cache.close()
+
+
+class TestLinkExtractor(unittest.TestCase):
+    PAGE = (
+        b'<html><head><script>var s = "<a href=/script>";</script></head>'
+        b'<body><!-- <a href="/comment"> --><A HREF="/x?a=1&amp;b=2">x</A>'
+        b'<a name="anchor">no href</a><a href="//other.org/y">y</a>'
+        b'<a href="https://site.org/z#top">z</a><a href="page">rel</a>'
+        b'</body></html>')
+    URL = 'https://site.org/dir/index.html'
+
+    def test_same_as_parse_links(self):
+        expected = page_rank.parse_links(self.PAGE, self.URL)
+        self.assertEqual(
+            link_extractor.extract_links(self.PAGE, self.URL), expected)
+        chunks = [self.PAGE[i:i + 7] for i in range(0, len(self.PAGE), 7)]
+        self.assertEqual(
+            list(link_extractor.iter_links(chunks, self.URL)), expected)
+
+    def test_site_filter(self):
+        self.assertEqual(
+            link_extractor.extract_links(self.PAGE, self.URL, 'other.org'),
+            ['https://other.org/y'])
+        self.assertEqual(link_extractor.extract_links(b'', self.URL), [])
+
+    def test_process_pool_crawl(self):
+        with FixtureSite() as site, ProcessPoolExecutor(2) as executor:
+            expected = page_rank.build_links(site.url, 20, 0)
+            result = async_crawler.build_links(
+                site.url, 20, rate=1000, executor=executor)
+        self.assertEqual(result, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
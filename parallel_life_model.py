@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+import os
+import multiprocessing
+import threading
+import weakref
+from multiprocessing import shared_memory
+from threading import BrokenBarrierError
+import numpy as np
+from life_model import LifeModel, ArrayLifeModel
+
+STREAMS = ('reproduction', 'eating', 'move_decision', 'move')
+FIELD = ('cell_types', 'times_to_death', 'times_to_reproduction')
+NO_CLAIM = 255  # direction of border cell which claims nothing
+CHUNK_STEPS = 64  # turns made by workers for one command
+STOP = -1  # steps of command which stops workers
+
+
+def _share(array):
+    # copy array to new shared memory block, returns (block, view, spec)
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+    view[...] = array
+    return block, view, (block.name, array.shape, array.dtype.str)
+
+
+def _attach(spec):
+    name, shape, dtype = spec
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def _mix(x):
+    # splitmix64 finalizer of uint64 array
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def cell_hashes(seed, round_number, cells):
+    '''
+        random uint64 for every cell, function of (seed, round, cell)
+        only, so it does not depend on which worker owns the cell
+    '''
+    key = _mix(np.array([seed, round_number], dtype=np.uint64))
+    return _mix(_mix(np.asarray(cells).astype(np.uint64) ^ key[0]) ^ key[1])
+
+
+def border_rows(bounds, row_number):
+    '''
+        bounds - first rows of bands and end row; returns array
+        row -> index of row in halo arrays, -1 if row is not in halo:
+        rivals of claims of cells of other bands are at most two rows
+        away from them, so halo has two rows on each side of border
+    '''
+    slots = np.full(row_number + 2, -1, dtype=np.int64)
+    rows = np.unique(np.clip(np.add.outer(
+        np.asarray(bounds[1:-1]), np.arange(-2, 2)), 0, row_number + 1))
+    slots[rows] = np.arange(len(rows))
+    return slots
+
+
+class _Tile(ArrayLifeModel):
+    '''
+    band of rows [start_row, stop_row) of field in shared memory, owned
+    by one worker; random values come from hashes of cells, target is
+    won by claim with largest (hash, source cell), so result depends
+    only on seed; claims of own cells are compared by sorting, claims
+    of border rows are published in halo arrays (direction and hash of
+    every cell) for neighbour bands; neighbour bands are read directly
+    from shared memory, barrier before every read of cells changed by
+    other workers stands for halo exchange
+    '''
+
+    def __init__(self, arrays, start_row, stop_row, parameters, barrier):
+        for key in FIELD:
+            setattr(self, key, arrays[key])
+        self.halo_directions = arrays['halo_directions'].ravel()
+        self.halo_priorities = arrays['halo_priorities'].ravel()
+        self.width = self.cell_types.shape[1]
+        self.start_row, self.stop_row = start_row, stop_row
+        self.start, self.stop = start_row * self.width, stop_row * self.width
+        self.barrier = barrier
+        self.step = 0
+        for key, value in parameters.items():
+            setattr(self, key, value)
+        own_rows = np.arange(start_row, stop_row)
+        own_rows = own_rows[self.row_slots[own_rows] >= 0]
+        self.own_slots = (self.row_slots[own_rows][:, None] * self.width +
+                          np.arange(self.width)).ravel()
+
+    def _round(self, stream):
+        return self.step * len(STREAMS) + STREAMS.index(stream)
+
+    def _living_cells(self):
+        types = self.cell_types.ravel()[self.start:self.stop]
+        return self.start + np.flatnonzero(
+            (types == LifeModel.CellType.VICTIM) |
+            (types == LifeModel.CellType.PREDATOR))
+
+    def _random_values(self, cells, stream):
+        return (cell_hashes(self.seed, 2 * self._round(stream), cells) >>
+                np.uint64(11)) * 2.0 ** (-53)
+
+    # every phase may change cells of other bands, next reads wait for it
+    def _reproduce(self, living):
+        children = super()._reproduce(living)
+        self.barrier.wait()
+        return children
+
+    def _eat(self, living):
+        eaten = super()._eat(living)
+        self.barrier.wait()
+        return eaten
+
+    def _move_randomly(self, living, living_types):
+        moves = super()._move_randomly(living, living_types)
+        self.barrier.wait()
+        return moves
+
+    def __halo_slots(self, cells):
+        # indices of cells of halo rows in halo arrays
+        return self.row_slots[cells // self.width] * self.width +\
+            cells % self.width
+
+    def _resolve_conflicts(self, cells, targets, stream):
+        priorities = cell_hashes(self.seed, 2 * self._round(stream) + 1,
+                                 cells)
+        self.halo_directions[self.own_slots] = NO_CLAIM
+        published = self.row_slots[cells // self.width] >= 0
+        slots = self.__halo_slots(cells[published])
+        self.halo_directions[slots] = np.argmax(
+            (targets - cells)[published, None] == self.offsets, axis=1)
+        self.halo_priorities[slots] = priorities[published]
+        self.barrier.wait()
+
+        # strongest own claim of every target
+        order = np.lexsort((cells, priorities, targets))
+        last = np.ones(len(order), dtype=bool)
+        last[:-1] = targets[order[1:]] != targets[order[:-1]]
+        won = np.zeros(len(cells), dtype=bool)
+        won[order[last]] = True
+
+        # other claims of targets near border come from halo rows
+        checked = np.flatnonzero(won)
+        rows = targets[checked] // self.width
+        checked = checked[(rows <= self.start_row) |
+                          (rows >= self.stop_row - 1)]
+        rivals = targets[checked, None] + self.offsets
+        rival_rows = rivals // self.width
+        foreign = ((rival_rows < self.start_row) |
+                   (rival_rows >= self.stop_row)) &\
+            (self.row_slots[rival_rows] >= 0)
+        rival_slots = self.__halo_slots(rivals[foreign])
+        directions = np.full(rivals.shape, NO_CLAIM, dtype=np.uint8)
+        directions[foreign] = self.halo_directions[rival_slots]
+        rival_priorities = np.zeros(rivals.shape, dtype=np.uint64)
+        rival_priorities[foreign] = self.halo_priorities[rival_slots]
+        claimed = directions != NO_CLAIM
+        claimed[claimed] = rivals[claimed] + self.offsets[
+            directions[claimed]] == np.broadcast_to(
+                targets[checked, None], rivals.shape)[claimed]
+        stronger = claimed &\
+            ((rival_priorities > priorities[checked, None]) |
+             ((rival_priorities == priorities[checked, None]) &
+              (rivals > cells[checked, None])))
+        won[checked[stronger.any(axis=1)]] = False
+        return cells[won], targets[won]
+
+    def make_turn(self):
+        living = self._living_cells()
+        living_types = self.cell_types.ravel()[living]
+        self._reproduce(living)
+        self._eat(living)
+        self._move_randomly(living, living_types)
+        self._update_cells(self._living_cells())
+        types = self.cell_types.ravel()[self.start:self.stop]
+        self.barrier.wait()
+        return [int(np.count_nonzero(types == LifeModel.CellType.VICTIM)),
+                int(np.count_nonzero(types == LifeModel.CellType.PREDATOR))]
+
+    def run(self, worker, arrays):
+        # makes turns of command in control array, False for STOP
+        first_step, steps, self.seed = arrays['control'].tolist()
+        if steps == STOP:
+            return False
+        for step in range(steps):
+            self.step = first_step + step
+            arrays['counts'][step, worker] = self.make_turn()
+        return True
+
+
+def _worker(worker, bounds, specs, parameters, barrier, control):
+    '''
+        long-lived worker of band: waits for command on control barrier,
+        makes its turns and meets parent on control barrier again
+    '''
+    blocks = []
+    arrays = dict()
+    try:
+        for key, spec in specs.items():
+            block, arrays[key] = _attach(spec)
+            blocks.append(block)
+        tile = _Tile(arrays, bounds[worker], bounds[worker + 1], parameters,
+                     barrier)
+        while True:
+            control.wait()
+            if not tile.run(worker, arrays):
+                break
+            control.wait()
+    except BrokenBarrierError:
+        pass  # other worker or parent has failed
+    except BaseException:
+        barrier.abort()
+        control.abort()
+        raise
+    finally:
+        tile = None
+        arrays.clear()
+        for block in blocks:
+            try:
+                block.close()
+            except BufferError:
+                pass  # views are alive in traceback, freed on exit
+
+
+def _release(processes, control, arrays, blocks):
+    # stops workers and frees shared memory of model
+    if processes:
+        arrays['control'][1] = STOP
+        try:
+            control.wait(timeout=1)
+        except BrokenBarrierError:
+            pass
+        for process in processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+    arrays.clear()
+    for block in blocks:
+        try:
+            block.close()
+        except BufferError:
+            pass  # field arrays are still referenced, unmapped on exit
+        block.unlink()
+
+
+class ParallelLifeModel(ArrayLifeModel):
+    '''
+    ArrayLifeModel simulated by workers processes: field is split to
+    bands of rows (tiles), every worker moves cells of its band, cells
+    move and reproduce across borders of bands; random values are
+    hashes of (seed, step, phase, cell), so results are same for any
+    number of workers and reproducible for given random_state
+    (but differ from results of ArrayLifeModel)
+
+    field stays in shared memory for whole life of model, workers are
+    started by first turn and make turns of all next calls of run and
+    generate_next_turn; close() stops them (it is done when model is
+    garbage collected too)
+    '''
+
+    def __init__(self, *args, workers=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if workers is None:
+            workers = os.cpu_count()
+        self.workers = max(1, min(workers, self.row_number))
+        self.seed = int(self.random.integers(2 ** 63))
+        self.claims = None  # conflicts are resolved by tiles
+        self.bounds = np.linspace(1, self.row_number + 1,
+                                  self.workers + 1).astype(np.int64)
+        row_slots = border_rows(self.bounds, self.row_number)
+        halo_size = (row_slots.max() + 1) * self.cell_types.shape[1]
+        self.parameters = {
+            'offsets': self.offsets,
+            'reproduction_times': self.reproduction_times,
+            'move_probabilities': self.move_probabilities,
+            'time_to_death': self.time_to_death,
+            'time_to_reproduction_predators':
+                self.time_to_reproduction_predators,
+            'row_slots': row_slots
+        }
+        arrays = {key: getattr(self, key) for key in FIELD}
+        arrays.update({
+            'halo_directions': np.full(halo_size, NO_CLAIM, dtype=np.uint8),
+            'halo_priorities': np.zeros(halo_size, dtype=np.uint64),
+            'control': np.zeros(3, dtype=np.int64),
+            'counts': np.zeros((CHUNK_STEPS, self.workers, 2),
+                               dtype=np.int64)
+        })
+
+        self.processes = []
+        self.__control = None
+        self.__tile = None
+        self.__arrays = dict()
+        self.__specs = dict()
+        blocks = []
+        if self.workers == 1:
+            self.__arrays = arrays
+        else:
+            for key, array in arrays.items():
+                block, self.__arrays[key], self.__specs[key] =\
+                    _share(array)
+                blocks.append(block)
+            for key in FIELD:
+                setattr(self, key, self.__arrays[key])
+            self.__control = multiprocessing.Barrier(self.workers + 1)
+        self.__finalizer = weakref.finalize(
+            self, _release, self.processes, self.__control, self.__arrays,
+            blocks)
+
+    def close(self):
+        # stops workers and frees shared memory, model is not usable after
+        self.__finalizer()
+
+    def run(self, steps):
+        # makes steps turns, returns life counters of all of them
+        counts = self.__run_workers(steps)
+        counters = [{LifeModel.CellType.VICTIM: int(victims),
+                     LifeModel.CellType.PREDATOR: int(predators)}
+                    for victims, predators in counts.sum(axis=1)]
+        if counters:
+            self.life_counter = counters[-1]
+        self.step += steps
+        return counters
+
+    def _make_turn(self):
+        counts = self.__run_workers(1)
+        self.life_counter = {
+            LifeModel.CellType.VICTIM: int(counts[0, :, 0].sum()),
+            LifeModel.CellType.PREDATOR: int(counts[0, :, 1].sum())}
+
+    def __start_workers(self):
+        barrier = multiprocessing.Barrier(self.workers)
+        for worker in range(self.workers):
+            process = multiprocessing.Process(
+                target=_worker, daemon=True,
+                args=(worker, self.bounds, self.__specs, self.parameters,
+                      barrier, self.__control))
+            process.start()
+            self.processes.append(process)
+
+    def __run_workers(self, steps):
+        # (steps, workers, 2) life counters of bands after every turn
+        if not self.__finalizer.alive:
+            raise ValueError('life model is closed')
+        if self.workers == 1 and self.__tile is None:
+            self.__tile = _Tile(self.__arrays, self.bounds[0],
+                                self.bounds[1], self.parameters,
+                                threading.Barrier(1))
+        elif self.workers > 1 and not self.processes:
+            self.__start_workers()
+
+        counts = [np.zeros((0, self.workers, 2), dtype=np.int64)]
+        for first_step in range(0, steps, CHUNK_STEPS):
+            chunk = min(CHUNK_STEPS, steps - first_step)
+            self.__arrays['control'][...] = (self.step + first_step, chunk,
+                                             self.seed)
+            if self.workers == 1:
+                self.__tile.run(0, self.__arrays)
+            else:
+                try:
+                    self.__control.wait()  # command is written
+                    self.__control.wait()  # turns are made
+                except BrokenBarrierError:
+                    self.close()
+                    raise RuntimeError('life model worker has failed')
+            counts.append(self.__arrays['counts'][:chunk].copy())
+        return np.concatenate(counts)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+import os
+import multiprocessing
+from multiprocessing import shared_memory
+from threading import BrokenBarrierError
+import numpy as np
+from scipy import sparse
+from page_rank import create_sparse_markov_chain_turns
+
+
+def _share(array):
+    # copy array to new shared memory block, returns (block, view, spec)
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+    view[...] = array
+    return block, view, (block.name, array.shape, array.dtype.str)
+
+
+def _attach(spec):
+    name, shape, dtype = spec
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def _partition(indptr, processes):
+    # split vertices to ranges with about equal number of links + vertices
+    N = len(indptr) - 1
+    work = indptr + np.arange(N + 1)
+    bounds = np.searchsorted(
+        work, np.linspace(0, work[-1], processes + 1), side='left')
+    bounds[0], bounds[-1] = 0, N
+    return np.maximum.accumulate(bounds)
+
+
+def _worker(worker, bounds, specs, damping_factor, tolerance, barrier):
+    '''
+        computes ranks of vertices bounds[worker]:bounds[worker + 1] every
+        iteration; iteration is:
+            partial masses of current ranks -> barrier ->
+            new ranks of own vertices from all current ranks -> barrier ->
+            same convergence decision in all workers, swap of rank vectors
+    '''
+    blocks = []
+    arrays = dict()
+    try:
+        for key, spec in specs.items():
+            block, arrays[key] = _attach(spec)
+            blocks.append(block)
+
+        start, stop = bounds[worker], bounds[worker + 1]
+        cur_distr, next_distr = arrays['ranks'][0], arrays['ranks'][1]
+        N = len(cur_distr)
+        indptr = arrays['indptr'][start:stop + 1]
+        # own rows of transposed transition matrix, data is not copied
+        rows = sparse.csr_matrix(
+            (arrays['data'][indptr[0]:indptr[-1]],
+             arrays['indices'][indptr[0]:indptr[-1]],
+             indptr - indptr[0]), shape=(stop - start, N), copy=False)
+        dangling = arrays['dangling'][start:stop]
+        masses = arrays['masses']
+        changes = arrays['changes']
+
+        for iteration in range(1, np.iinfo(np.int64).max):
+            own = cur_distr[start:stop]
+            masses[worker] = own.sum(), own[dangling].sum()
+            barrier.wait()
+
+            total_mass, dangling_mass = masses.sum(axis=0)
+            jump_mass = damping_factor * total_mass +\
+                (1 - damping_factor) * dangling_mass
+            next_distr[start:stop] = (1 - damping_factor) *\
+                (rows @ cur_distr) + jump_mass / N
+            changes[worker] = np.max(np.abs(next_distr[start:stop] - own))\
+                if stop > start else 0
+            barrier.wait()
+
+            if changes.max() <= tolerance:
+                if worker == 0:
+                    arrays['result'][0] = iteration % 2
+                return
+            cur_distr, next_distr = next_distr, cur_distr
+
+    except BrokenBarrierError:
+        pass  # other worker has failed
+    except BaseException:
+        barrier.abort()
+        raise
+    finally:
+        arrays.clear()
+        for block in blocks:
+            try:
+                block.close()
+            except BufferError:
+                pass  # views are alive in traceback, freed on exit
+
+
+def parallel_page_rank(links, start_distribution, damping_factor=0.15,
+                       tolerance=10 ** (-7), processes=None):
+    '''
+        same result as page_rank.sparse_page_rank, computed by processes
+        workers; every worker owns range of vertices (shard) and computes
+        their ranks from rank vector in shared memory
+    '''
+    if processes is None:
+        processes = os.cpu_count()
+    start_distribution = np.asarray(start_distribution, dtype=float).ravel()
+    N = len(start_distribution)
+    processes = max(1, min(processes, N))
+
+    transitions, dangling = create_sparse_markov_chain_turns(links, N)
+    transposed = transitions.T.tocsr()
+    bounds = _partition(transposed.indptr, processes)
+
+    blocks = []
+    specs = dict()
+    arrays = dict()
+    try:
+        for key, array in (
+                ('indptr', transposed.indptr.astype(np.int64)),
+                ('indices', transposed.indices),
+                ('data', transposed.data),
+                ('dangling', dangling),
+                ('ranks', np.stack([start_distribution, start_distribution])),
+                ('masses', np.zeros((processes, 2))),
+                ('changes', np.zeros(processes)),
+                ('result', np.zeros(1, dtype=np.int64))):
+            block, arrays[key], specs[key] = _share(array)
+            blocks.append(block)
+
+        barrier = multiprocessing.Barrier(processes)
+        workers = [multiprocessing.Process(
+            target=_worker,
+            args=(worker, bounds, specs, damping_factor, tolerance, barrier))
+            for worker in range(processes)]
+        for process in workers:
+            process.start()
+        for process in workers:
+            process.join()
+        if any(process.exitcode != 0 for process in workers):
+            raise RuntimeError('page rank worker has failed')
+
+        return arrays['ranks'][arrays['result'][0]].copy()
+    finally:
+        arrays.clear()
+        for block in blocks:
+            block.close()
+            block.unlink()
@@ -1,12 +1,27 @@
 #!/usr/bin/env python3
 import argparse
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+import re
+import resource
+import sys
+import tempfile
 import unittest
 import random
+from contextlib import contextmanager
+from functools import lru_cache
+from time import perf_counter
 from copy import copy
 from collections import deque
+from ngram_model import NGramCounter, NGramModel, choose_turn
 
 NOT_ALPHA_DIGIT_INDEX = 2
 FREQUENCIES_PRINT_FORMAT = '  {}: {:.2f}'
+SHARD_BYTES = 2 ** 26  # parallel training shard of file
+SHARD_LINES = 10 ** 5  # parallel training shard of stdin
 
 
 def _get_token_lines(text):
@@ -33,10 +48,54 @@ def _get_token_lines(text):
     return token_lines
 
 
+def _character_ranges(symbols):
+    # sorted symbols -> regex character class body of ranges
+    ranges = []
+    for symb in symbols:
+        if ranges and ord(symb) == ord(ranges[-1][1]) + 1:
+            ranges[-1][1] = symb
+        else:
+            ranges.append([symb, symb])
+    return ''.join(re.escape(first) + ('-' + re.escape(last)
+                                       if last != first else '')
+                   for first, last in ranges)
+
+
+@lru_cache(maxsize=None)
+def _token_pattern():
+    '''
+        regex splitting line as _get_token_lines does: runs of
+        str.isalpha symbols, runs of str.isdigit symbols, any other symbol
+        alone; [^\\W\\d_] and \\d differ from isalpha / isdigit in some
+        numeric symbols (like '²'), they are found once by scan of unicode
+    '''
+    decimal = re.compile(r'\d')
+    not_alpha = []
+    extra_digits = []
+    for symb in map(chr, range(sys.maxunicode + 1)):
+        if symb.isalnum() and not symb.isalpha() and\
+                not decimal.match(symb):
+            not_alpha.append(symb)
+            if symb.isdigit():
+                extra_digits.append(symb)
+    return re.compile(r'[^\W\d_{}]+|[\d{}]+|.'.format(
+        _character_ranges(not_alpha), _character_ranges(extra_digits)),
+        re.DOTALL)
+
+
+def _iter_token_lines(lines):
+    # lazy _get_token_lines
+    findall = _token_pattern().findall
+    for line in lines:
+        yield findall(line)
+
+
 def tokenize(arg_list):
-    text = input_text()
-    token_lines = _get_token_lines(text)
-    for tokens in token_lines:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', nargs='+', help='text files, stdin if '
+                        'not given')
+    args = parser.parse_args(arg_list)
+    for tokens in _iter_token_lines(input_lines(args.input)):
         for token in tokens:
             print(token)
 
@@ -82,71 +141,320 @@ def _get_frequencies(depth, text):
     return frequencies
 
 
-def probabilities(arg_list):
+def _get_model(depth, text):
+    # same turns as _get_frequencies in compact NGramModel
+    return NGramCounter(depth).add_lines(_get_token_lines(text)).model()
+
+
+def _read_model(depth, lines, profile=None):
+    # _get_model of lazy lines, tokenized and counted as they are read
+    if profile is None:
+        profile = Profile(False)
+    token_lines = profile.iterate('tokenize', _iter_token_lines(
+        profile.iterate('read', lines)))
+    with profile.stage('count'):
+        counter = NGramCounter(depth).add_lines(token_lines)
+    with profile.stage('merge'):
+        return counter.model()
+
+
+class Profile(object):
+    '''
+    wall time of pipeline stages for --profile, reported to stderr:
+    stages may be nested (lazy reading inside tokenization inside
+    counting), time of stage excludes time of stages inside it;
+    disabled profile costs nothing
+    '''
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.seconds = dict()
+        self.stack = []
+        self.clock = perf_counter()
+        self.started = self.clock
+        self.tokens = 0
+        self.entries = None
+
+    def __switch(self):
+        now = perf_counter()
+        if self.stack:
+            name = self.stack[-1]
+            self.seconds[name] = self.seconds.get(name, 0) + now - self.clock
+        self.clock = now
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        self.__switch()
+        self.stack.append(name)
+        try:
+            yield
+        finally:
+            self.__switch()
+            self.stack.pop()
+
+    def iterate(self, name, iterable):
+        # iterable with time of getting its items counted in stage name
+        if not self.enabled:
+            return iterable
+        return self.__iterate(name, iter(iterable))
+
+    def __iterate(self, name, iterator):
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                if name == 'tokenize':
+                    self.tokens += len(item)
+            yield item
+
+    def set_model(self, model):
+        if self.enabled:
+            self.entries = (model.entries(), len(model.vocabulary))
+
+    def report(self, file=sys.stderr):
+        if not self.enabled:
+            return
+        total = perf_counter() - self.started
+        for name, seconds in self.seconds.items():
+            print('{:<10} {:>9.3f}s {:>5.1f}%'.format(
+                name, seconds, 100 * seconds / max(total, 1e-9)), file=file)
+        print('{:<10} {:>9.3f}s'.format('total', total), file=file)
+        if self.tokens:
+            print('tokens: {} ({:.3g}/s)'.format(
+                self.tokens, self.tokens / max(total, 1e-9)), file=file)
+        if self.entries is not None:
+            print('model: {} turns, {} tokens in vocabulary'.format(
+                *self.entries), file=file)
+        print('peak memory: {:.1f} MB'.format(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024),
+            file=file)
+
+
+def _file_shards(paths, shard_bytes=SHARD_BYTES):
+    # (path, start, stop) byte ranges of about shard_bytes of whole lines
+    for path in paths:
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            start = 0
+            while start < size:
+                f.seek(min(start + shard_bytes, size))
+                f.readline()
+                stop = max(f.tell(), min(start + shard_bytes, size))
+                yield path, start, stop
+                start = stop
+
+
+def _count_file_shard(depth, shard):
+    # counter tables of lines of file shard, read as input_lines reads them
+    path, start, stop = shard
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(stop - start).decode('utf-8')
+    lines = (line.rstrip('\n') for line in io.StringIO(data, newline=None))
+    return NGramCounter(depth).add_lines(
+        _iter_token_lines(lines)).merged_tables()
+
+
+def _count_lines(depth, lines):
+    return NGramCounter(depth).add_lines(
+        _iter_token_lines(lines)).merged_tables()
+
+
+def _line_shards(lines, shard_lines=SHARD_LINES):
+    shard = []
+    for line in lines:
+        shard.append(line)
+        if len(shard) == shard_lines:
+            yield shard
+            shard = []
+    if shard:
+        yield shard
+
+
+def _read_model_parallel(depth, paths=None, processes=None):
+    '''
+        _read_model of input_lines(paths) counted by pool of processes:
+        history resets at every line, so shards of lines are counted
+        separately and their tables are summed up, turn sums are sums
+        of turn counts and are summed with them; files are split to byte
+        ranges read by workers, stdin is sent to workers by lines
+    '''
+    if processes is None:
+        processes = os.cpu_count()
+    if paths:
+        count, shards = _count_file_shard, _file_shards(paths)
+    else:
+        count, shards = _count_lines, _line_shards(input_lines())
+
+    counter = NGramCounter(depth)
+    with multiprocessing.Pool(processes) as pool:
+        # at most 2 shards per worker are in memory at once
+        pending = deque()
+        for shard in shards:
+            pending.append(pool.apply_async(count, (depth, shard)))
+            if len(pending) >= 2 * processes:
+                counter.add_tables(*pending.popleft().get())
+        while pending:
+            counter.add_tables(*pending.popleft().get())
+    return counter.model()
+
+
+def _add_input_arguments(parser):
+    parser.add_argument('--input', nargs='+', help='text files, stdin if '
+                        'not given')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='training processes, 0 for all cores')
+    parser.add_argument('--profile', action='store_true',
+                        help='report time of stages to stderr')
+
+
+def _read_input_model(args, profile):
+    if args.processes == 1:
+        model = _read_model(args.depth, input_lines(args.input), profile)
+    else:
+        with profile.stage('count'):
+            model = _read_model_parallel(args.depth, args.input,
+                                         args.processes or None)
+    profile.set_model(model)
+    return model
+
+
+def train(arg_list):
     parser = argparse.ArgumentParser()
-    parser.add_argument('--depth', type=int)
+    parser.add_argument('--depth', type=int, required=True)
+    parser.add_argument('--model', required=True, help='model file to write')
+    _add_input_arguments(parser)
     args = parser.parse_args(arg_list)
-    text = input_text()
-    frequencies = _get_frequencies(args.depth, text)
-    turns = dict()
-    for key in frequencies:
-        if key[0] not in turns:
-            turns[key[0]] = []
-        turns[key[0]].append(key[1])
+    profile = Profile(args.profile)
+    model = _read_input_model(args, profile)
+    with profile.stage('save'):
+        model.save(args.model)
+    profile.report()
 
-    turns = {key: sorted(turns[key]) for key in turns}
 
-    for from_token in sorted([key for key in turns]):
-        print(' '.join(from_token))
-        for to_token in turns[from_token]:
-            cur_freq_data = frequencies[(from_token, to_token)]
-            print(FREQUENCIES_PRINT_FORMAT.format(
-                to_token,
-                cur_freq_data[0] / cur_freq_data[1]
-                ))
+def update(arg_list):
+    # adds counts of input text to model file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', required=True, help='model file to update')
+    parser.add_argument('--output', help='updated model file, --model if '
+                        'not given')
+    _add_input_arguments(parser)
+    args = parser.parse_args(arg_list)
+    profile = Profile(args.profile)
+    with profile.stage('load'):
+        model = NGramModel.load(args.model)
+    args.depth = model.depth
+    added = _read_input_model(args, profile)
+    with profile.stage('update'):
+        model = model.updated(*added.tables())
+    profile.set_model(model)
+    with profile.stage('save'):
+        model.save(args.output or args.model)
+    profile.report()
+
+
+def _load_model(parser, arg_list):
+    '''
+        model from --model file or trained on input text,
+        returns (model, args, profile)
+    '''
+    parser.add_argument('--depth', type=int)
+    parser.add_argument('--model', help='model file written by train')
+    _add_input_arguments(parser)
+    args = parser.parse_args(arg_list)
+    profile = Profile(args.profile)
+    if args.model is None:
+        if args.depth is None:
+            parser.error('--depth is required without --model')
+        return _read_input_model(args, profile), args, profile
+    with profile.stage('load'):
+        model = NGramModel.load(args.model)
+    if args.depth is None:
+        args.depth = model.depth
+    elif args.depth > model.depth:
+        parser.error('model {} has depth {}'.format(args.model, model.depth))
+    return model, args, profile
 
 
-def _get_next_with_random(history, frequencies):
+def probabilities(arg_list):
+    model, args, profile = _load_model(argparse.ArgumentParser(), arg_list)
+
+    for from_token, turns in profile.iterate('turns',
+                                             model.turns(args.depth)):
+        with profile.stage('output'):
+            print(' '.join(from_token))
+            for to_token, count, history_count in turns:
+                print(FREQUENCIES_PRINT_FORMAT.format(
+                    to_token,
+                    count / history_count
+                    ))
+    profile.report()
+
+
+def _build_sampling_index(frequencies):
+    # history -> (moves in frequencies order, cumulative move counts)
+    index = dict()
+    for key in frequencies:
+        if key[0] not in index:
+            index[key[0]] = ([], [])
+        moves, cumulative_counts = index[key[0]]
+        moves.append(key[1])
+        cumulative_counts.append(
+            frequencies[key][0] +
+            (cumulative_counts[-1] if cumulative_counts else 0))
+    return index
+
+
+def _get_next_with_random(history, frequencies, sampling_index=None):
+    if sampling_index is None:
+        sampling_index = _build_sampling_index(frequencies)
     history = tuple(history)
-    suitable_moves = [key[1] for key in frequencies if key[0] == history]
-    if len(suitable_moves) == 0:
+    if history not in sampling_index:
         return None
-    generator_bound = frequencies[(history, suitable_moves[0])][1]
-    rnd_var = random.randint(1, generator_bound)
-    result = 0
-    while True:
-        cur_move_number = frequencies[(history, suitable_moves[result])][0]
-        if rnd_var > cur_move_number:
-            rnd_var -= cur_move_number
-            result += 1
-        else:
-            break
-    return suitable_moves[result]
+    return choose_turn(*sampling_index[history])
 
 
-def _generate_random_text_from(text, depth, size):
-    frequencies = _get_frequencies(depth, text)
+def _generate_random_text_with(model, depth, size, rnd=random):
     generated_text = []
+    if model.find(()) is None:  # model without tokens
+        return generated_text
     history = deque()
     for t in range(size):
-        next_token = _get_next_with_random(history, frequencies)
+        next_token = model.sample(history, rnd)
         if next_token is None:
-            next_token = _get_next_with_random([], frequencies)
+            next_token = model.sample((), rnd)
             history = deque()
         history.append(next_token)
         if len(history) > depth:
             history.popleft()
-        generated_text.append(next_token)
+        generated_text.append(model.vocabulary[next_token])
     return generated_text
 
 
+def _generate_random_text_from(text, depth, size):
+    return _generate_random_text_with(_get_model(depth, text), depth, size)
+
+
 def generate(arg_list):
     parser = argparse.ArgumentParser()
-    parser.add_argument('--depth', type=int)
     parser.add_argument('--size', type=int)
-    args = parser.parse_args(arg_list)
-    text = input_text()
-    text_tokens = _generate_random_text_from(text, args.depth, args.size)
+    model, args, profile = _load_model(parser, arg_list)
+    with profile.stage('sample'):
+        text_tokens = _generate_random_text_with(model, args.depth, args.size)
+    with profile.stage('format'):
+        text = _format_text(text_tokens)
+    with profile.stage('output'):
+        print(text)
+    profile.report()
+
+
+def _format_text(text_tokens):
+    # sentences end before capitalized tokens
     generated_text = []
     for token in text_tokens:
         if token[0].isupper() and len(generated_text) > 0:
@@ -154,9 +462,37 @@ def generate(arg_list):
         generated_text.append(token)
     if len(generated_text):
         generated_text[-1] += '.'
+    else:
+        return ''
     first_word = generated_text[0]
     generated_text[0] = first_word[0].upper() + first_word[1:]
-    print(' '.join(generated_text))
+    return ' '.join(generated_text)
+
+
+def serve(arg_list):
+    '''
+        generation service, see generation_server: requests are read from
+        rest of stdin or from local tcp port
+    '''
+    from generation_server import GenerationServer, MAX_SIZE
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', required=True, help='model file written '
+                        'by train')
+    parser.add_argument('--port', type=int, help='tcp port on 127.0.0.1, '
+                        'stdin / stdout if not given')
+    parser.add_argument('--max-batch', type=int, default=256)
+    parser.add_argument('--max-size', type=int, default=MAX_SIZE,
+                        help='largest size of one request')
+    args = parser.parse_args(arg_list)
+    server = GenerationServer(NGramModel.load(args.model), _format_text,
+                              args.max_batch, max_size=args.max_size)
+    if args.port is None:
+        asyncio.run(server.serve_lines())
+    else:
+        try:
+            asyncio.run(server.serve_tcp(port=args.port))
+        except KeyboardInterrupt:
+            pass
 
 
 class TestTextGenerator(unittest.TestCase):
@@ -168,6 +504,59 @@ class TestTextGenerator(unittest.TestCase):
                 ['First', ' ', 'test', ' ', '2', 'line']
             ])
 
+    def test_iter_token_lines(self):
+        text = ['Hello, world!', 'First test 2line', '',
+                'x² = 10_000 ½ café  Ⅻ', 'Привет,мир!..']
+        self.assertEqual(list(_iter_token_lines(text)),
+                         _get_token_lines(text))
+
+    def test_input_lines(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, name) for name in 'ab']
+            for path, content in zip(paths, ['one\ntwo\n', 'three']):
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(content)
+            self.assertEqual(list(input_lines(paths)),
+                             ['one', 'two', 'three'])
+
+    def test_profile(self):
+        profile = Profile()
+        with profile.stage('outer'):
+            lines = list(profile.iterate('tokenize', _iter_token_lines(
+                ['First test', 'line'])))
+        self.assertEqual(lines, [['First', ' ', 'test'], ['line']])
+        self.assertEqual(profile.tokens, 4)
+        self.assertEqual(set(profile.seconds), {'outer', 'tokenize'})
+        self.assertLessEqual(sum(profile.seconds.values()),
+                             perf_counter() - profile.started)
+        report = io.StringIO()
+        profile.report(report)
+        self.assertIn('tokens: 4', report.getvalue())
+
+        disabled = Profile(False)
+        iterable = ['line']
+        self.assertIs(disabled.iterate('read', iterable), iterable)
+
+    def test_benchmark(self):
+        import text_generator_benchmark as benchmark
+        corpus = benchmark.synthetic_corpus(20, vocabulary=50,
+                                            random_state=1)
+        self.assertEqual(len(corpus), 20)
+        self.assertEqual(corpus, benchmark.synthetic_corpus(
+            20, vocabulary=50, random_state=1))
+
+        records = benchmark.benchmark(20, vocabulary=50, size=100, batch=4)
+        self.assertEqual(
+            [r['stage'] for r in records],
+            ['tokenize/reference', 'count/reference', 'sample/reference',
+             'tokenize', 'count', 'merge', 'save', 'load', 'update',
+             'sample', 'sample/batch', 'format'])
+        self.assertEqual(records[1]['entries'], records[5]['entries'])
+        self.assertEqual(benchmark.regressions(records, records), [])
+        faster = [dict(r, seconds=r['seconds'] / 4) for r in records[:2]]
+        self.assertEqual(benchmark.regressions(records, faster),
+                         records[:2])
+
     def test_build_frequencies(self):
         self.assertEqual(_build_frequencies(
             depth=2,
@@ -209,6 +598,156 @@ class TestTextGenerator(unittest.TestCase):
                 }
             ) in {'sentence', 'line'})
 
+    def test_build_sampling_index(self):
+        frequencies = _build_frequencies(
+            depth=1,
+            token_lines=[['a', ' ', 'b', ' ', 'a', ' ', 'c', ' ', 'a']])
+        index = _build_sampling_index(frequencies)
+        self.assertEqual(index[()], (['a', 'b', 'c'], [3, 4, 5]))
+        self.assertEqual(index[('a', )], (['b', 'c'], [1, 2]))
+
+        # same choices as linear scan of frequencies
+        random.seed(1)
+        expected = []
+        for i in range(50):
+            rnd_var = random.randint(1, 5)
+            expected.append('a' if rnd_var <= 3 else
+                            'b' if rnd_var == 4 else 'c')
+        random.seed(1)
+        self.assertEqual(
+            [_get_next_with_random((), frequencies, index)
+             for i in range(50)],
+            expected)
+
+    def test_model(self):
+        text = ['First test sentence, test line', 'Second test 2line.']
+        for depth in range(4):
+            model = NGramCounter(depth, chunk_tokens=2).add_lines(
+                _get_token_lines(text)).model()
+            self.assertEqual(
+                model.frequencies(),
+                _build_frequencies(depth, _get_token_lines(text)))
+        self.assertEqual(model.vocabulary,
+                         ['First', 'Second', 'line', 'sentence', 'test'])
+        self.assertIsNone(model.sample([model.token_id('line')]))
+        self.assertEqual(model.sample([model.token_id('First')]),
+                         model.token_id('test'))
+
+    def test_model_file(self):
+        text = ['First test sentence, test line', 'Second test 2line.']
+        model = _get_model(2, text)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'model')
+            model.save(path)
+            loaded = NGramModel.load(path)
+            self.assertEqual(loaded.depth, 2)
+            self.assertEqual(list(loaded.vocabulary), model.vocabulary)
+            self.assertEqual(loaded.frequencies(), model.frequencies())
+            self.assertEqual(list(loaded.turns(1)),
+                             list(_get_model(1, text).turns()))
+            self.assertEqual(loaded.sample([loaded.token_id('First')]),
+                             loaded.token_id('test'))
+
+            with open(path, 'r+b') as f:
+                f.write(b'garbage!')
+            with self.assertRaises(ValueError):
+                NGramModel.load(path)
+
+    def test_model_update(self):
+        text = ['First test sentence, test line', 'Second test 2line.']
+        new_text = ['Third test line', 'alpha First test']
+        for depth in range(3):
+            model = _get_model(depth, text)
+            counter = NGramCounter(depth).add_lines(
+                _get_token_lines(new_text))
+            self.assertEqual(
+                model.updated(*counter.merged_tables()).frequencies(),
+                _build_frequencies(depth, _get_token_lines(text + new_text)))
+        self.assertEqual(
+            model.updated(*_get_model(2, []).tables()).frequencies(),
+            model.frequencies())
+        # memory-mapped model, new turns of known tokens only
+        known_text = ['test line First', 'Second test sentence']
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'model')
+            model.save(path)
+            loaded = NGramModel.load(path)
+            self.assertEqual(
+                loaded.updated(*_get_model(2, known_text).tables())
+                .frequencies(), _build_frequencies(
+                    2, _get_token_lines(text + known_text)))
+            del loaded
+
+    def test_read_model_parallel(self):
+        text = ['First test sentence, test line', '', 'Second test 2line.',
+                'x\r\nline test', 'sentence test First']
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, name) for name in 'ab']
+            for path in paths:
+                with open(path, 'w', encoding='utf-8', newline='') as f:
+                    f.write('\n'.join(text))
+            serial = _read_model(2, input_lines(paths))
+            self.assertEqual(
+                [shard[1:] for shard in _file_shards(paths[:1], 10)],
+                [(0, 31), (31, 51), (51, 64), (64, 83)])
+            self.assertEqual(
+                _read_model_parallel(2, paths, processes=2).frequencies(),
+                serial.frequencies())
+
+        counter = NGramCounter(2)
+        for shard in _line_shards(text * 2, shard_lines=2):
+            counter.add_tables(*_count_lines(2, shard))
+        self.assertEqual(counter.model().frequencies(),
+                         _read_model(2, text * 2).frequencies())
+
+    def test_generation_server(self):
+        from generation_server import GenerationServer
+        model = _get_model(2, ['First test sentence, test line',
+                               'Second test 2line.', 'Line of test'])
+        requests = [{'id': i, 'depth': i % 3, 'size': i, 'seed': i}
+                    for i in range(20)]
+        requests.append({'id': 'bad', 'depth': 3})
+        requests.append({'id': 'large', 'size': 10 ** 9})
+        requests.append({'id': 'list seed', 'seed': [1, 2]})
+        requests.append({'id': 'bool size', 'size': True})
+        requests.append({'id': 'bool depth', 'depth': False})
+        requests.append({'id': 'stats', 'stats': True})
+
+        async def session():
+            server = GenerationServer(model, _format_text)
+            ports = []
+            serving = asyncio.ensure_future(
+                server.serve_tcp(port=0, ready=ports.append))
+            while not ports:
+                await asyncio.sleep(0.01)
+            reader, writer = await asyncio.open_connection(
+                '127.0.0.1', ports[0])
+            for request in requests[:-1]:
+                writer.write(json.dumps(request).encode() + b'\n')
+            await writer.drain()
+            answers = dict()
+            for request in requests[:-1]:
+                answer = json.loads(await reader.readline())
+                answers[answer['id']] = answer
+            writer.write(json.dumps(requests[-1]).encode() + b'\n')
+            answers['stats'] = json.loads(await reader.readline())
+            writer.close()
+            serving.cancel()
+            return answers
+
+        answers = asyncio.run(session())
+        for i in range(20):
+            self.assertEqual(answers[i]['text'], _format_text(
+                _generate_random_text_with(model, i % 3, i, random.Random(i))))
+        self.assertIn('error', answers['bad'])
+        for request_id in ('large', 'list seed', 'bool size', 'bool depth'):
+            self.assertIn('error', answers[request_id])
+        stats = answers['stats']['stats']
+        self.assertEqual((stats['requests'], stats['errors'],
+                          stats['answered']), (25, 5, 20))
+        self.assertEqual(stats['tokens'], sum(range(20)))
+        self.assertLess(stats['batches'], 20)
+
     def test_generate_random_text_from(self):
         text = [
             ['First test sentence'],
@@ -225,6 +764,34 @@ class TestTextGenerator(unittest.TestCase):
             token_lines=_get_token_lines(text))
         keys_tokens_from = [key[0] for key in frequencies]
         history = deque()
+        self.assertEqual(
+            len(random_text_tokens), SIZE if frequencies else 0)
+        for i in range(len(random_text_tokens) - 1):
+            cur_token = random_text_tokens[i]
+            cur_turn = (tuple(history), cur_token)
+            self.assertTrue(
+                cur_turn in frequencies or
+                history not in keys_tokens_from)
+            history.append(cur_token)
+            if len(history) > DEPTH:
+                history.popleft()
+
+    def test_generate_random_text_from_lines(self):
+        text = [
+            'First test sentence',
+            'Second test line'
+        ]
+        SIZE = 10
+        DEPTH = 2
+        random_text_tokens = _generate_random_text_from(
+            text,
+            depth=DEPTH,
+            size=SIZE)
+        frequencies = _build_frequencies(
+            depth=DEPTH,
+            token_lines=_get_token_lines(text))
+        keys_tokens_from = [key[0] for key in frequencies]
+        history = deque()
         self.assertEqual(len(random_text_tokens), SIZE)
         for i in range(SIZE - 1):
             cur_token = random_text_tokens[i]
@@ -236,11 +803,27 @@ class TestTextGenerator(unittest.TestCase):
             if len(history) > DEPTH:
                 history.popleft()
 
+    def test_generate_random_text_empty_model(self):
+        # text without words gives no tokens
+        self.assertEqual(
+            _generate_random_text_from(['1, 2; 3'], depth=2, size=10), [])
 
 def test(dummy_arg):
     unittest.main()
 
 
+def input_lines(paths=None):
+    # lazy lines of text files or of rest of stdin, without line ends
+    if not paths:
+        for line in sys.stdin:
+            yield line.rstrip('\n')
+        return
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                yield line.rstrip('\n')
+
+
 def input_text():
     text = []
     while True:
@@ -255,8 +838,11 @@ def main():
     arg_list = input().split()
     options = {
         'tokenize': tokenize,
+        'train': train,
+        'update': update,
         'probabilities': probabilities,
         'generate': generate,
+        'serve': serve,
         'test': test
     }
 
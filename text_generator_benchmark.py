@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+'''
+benchmarks of text_generator.py pipeline stages on synthetic corpora:
+
+    python3 text_generator_benchmark.py --lines 1000 100000 \\
+        --vocabulary 10000 --depth 2 --output results.json
+
+--baseline compares stage times with earlier --output and fails when
+some stage became slower than --tolerance times its baseline time
+'''
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import tracemalloc
+from time import perf_counter
+import numpy as np
+import text_generator
+from generation_server import generate_batch
+from ngram_model import NGramCounter, NGramModel
+
+REFERENCE_LIMIT = 10 ** 5  # reference stages are slow, skipped above it
+TABLE_FORMAT = '{:>8} {:>9} {:>7} {:<18} {:>9} {:>8} {:>10} {:>9}'
+
+
+def synthetic_corpus(lines, words_per_line=12, vocabulary=10 ** 4,
+                     exponent=1.1, random_state=None):
+    '''
+        lines of words with zipf distributed frequencies, words of
+        sentence starts are capitalized, some words are followed by
+        punctuation or numbers
+    '''
+    random = np.random.default_rng(random_state)
+    letters = np.array(list('abcdefghijklmnopqrstuvwxyz'))
+    words = [''.join(random.choice(letters, size)) for size in
+             random.integers(1, 10, vocabulary)]
+    probabilities = 1 / np.arange(1, vocabulary + 1) ** exponent
+    probabilities /= probabilities.sum()
+
+    text = []
+    for line_words in np.split(
+            random.choice(vocabulary, lines * words_per_line,
+                          p=probabilities).tolist(),
+            np.arange(words_per_line, lines * words_per_line,
+                      words_per_line)):
+        line = []
+        for i, word in enumerate(line_words.tolist()):
+            word = words[word]
+            if i == 0 or random.random() < 0.1:
+                word = word.capitalize()
+            if random.random() < 0.05:
+                word += random.choice([',', '.', ' 42', ';'])
+            line.append(word)
+        text.append(' '.join(line))
+    return text
+
+
+def measure(function, *args, **kwargs):
+    '''
+        returns (result, wall time, peak traced memory in bytes);
+        tracing slows down python code a lot, so function is timed
+        without it and then called once more with tracing
+    '''
+    start = perf_counter()
+    function(*args, **kwargs)
+    seconds = perf_counter() - start
+    tracemalloc.start()
+    try:
+        result = function(*args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+def _sample_reference(frequencies, depth, size):
+    # _generate_random_text_with for frequencies dict
+    index = text_generator._build_sampling_index(frequencies)
+    generated_text = []
+    history = []
+    for t in range(size):
+        next_token = text_generator._get_next_with_random(
+            history, frequencies, index)
+        if next_token is None:
+            history = []
+            next_token = text_generator._get_next_with_random(
+                history, frequencies, index)
+        history = (history + [next_token])[-depth:] if depth else []
+        generated_text.append(next_token)
+    return generated_text
+
+
+def benchmark(lines, vocabulary=10 ** 4, depth=2, size=10 ** 4, batch=64,
+              random_state=0, update_share=0.01):
+    '''
+        one record per stage, reference stages only for small corpora;
+        update adds counts of update_share as many new lines to model
+    '''
+    # new lines of update come from same words and frequencies
+    corpus = synthetic_corpus(lines + max(int(lines * update_share), 1),
+                              vocabulary=vocabulary,
+                              random_state=random_state)
+    corpus, new_corpus = corpus[:lines], corpus[lines:]
+    tokens = sum(len(tokens) for tokens in
+                 text_generator._iter_token_lines(corpus))
+    text_generator._token_pattern()  # one-off unicode scan
+    records = []
+
+    def record(stage, measured, items, entries=None):
+        records.append({
+            'lines': lines,
+            'tokens': tokens,
+            'vocabulary': vocabulary,
+            'depth': depth,
+            'stage': stage,
+            'seconds': measured[1],
+            'peak_bytes': measured[2],
+            'items_per_second': items / max(measured[1], 1e-9),
+            'entries': entries
+        })
+        return measured[0]
+
+    if lines <= REFERENCE_LIMIT:
+        token_lines = record('tokenize/reference', measure(
+            text_generator._get_token_lines, corpus), tokens)
+        frequencies = record('count/reference', measure(
+            text_generator._build_frequencies, depth, token_lines), tokens)
+        records[-1]['entries'] = len(frequencies)
+        random.seed(random_state)
+        record('sample/reference', measure(
+            _sample_reference, frequencies, depth, size), size)
+
+    token_lines = record('tokenize', measure(
+        lambda: list(text_generator._iter_token_lines(corpus))), tokens)
+    counter = record('count', measure(
+        lambda: NGramCounter(depth).add_lines(token_lines)), tokens)
+    model = record('merge', measure(counter.model), tokens)
+    records[-1]['entries'] = model.entries()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'model')
+        record('save', measure(model.save, path), model.entries())
+        model = record('load', measure(NGramModel.load, path),
+                       model.entries())
+        added = NGramCounter(depth).add_lines(
+            text_generator._iter_token_lines(new_corpus)).merged_tables()
+        updated = record('update', measure(model.updated, *added),
+                         int(added[1][0][1].sum()))
+        records[-1]['entries'] = updated.entries()
+        del updated  # may share memory map of model
+        random.seed(random_state)
+        text_tokens = record('sample', measure(
+            text_generator._generate_random_text_with, model, depth, size),
+            size)
+        record('sample/batch', measure(
+            generate_batch, model, [(depth, size // batch,
+                                     random.Random(job))
+                                    for job in range(batch)]), size)
+        record('format', measure(text_generator._format_text, text_tokens),
+               size)
+        del model  # memory map is closed before directory is removed
+    return records
+
+
+def regressions(records, baseline, tolerance=1.5):
+    # records slower than tolerance times same record of baseline
+    def key(r):
+        return r['lines'], r['vocabulary'], r['depth'], r['stage']
+
+    baseline = {key(r): r for r in baseline}
+    return [r for r in records if key(r) in baseline and
+            r['seconds'] > tolerance * baseline[key(r)]['seconds']]
+
+
+def print_records(records, file=sys.stdout):
+    print(TABLE_FORMAT.format(
+        'lines', 'tokens', 'depth', 'stage', 'seconds', 'peak,MB',
+        'items/s', 'entries'), file=file)
+    for r in records:
+        print(TABLE_FORMAT.format(
+            r['lines'], r['tokens'], r['depth'], r['stage'],
+            '{:.3f}'.format(r['seconds']),
+            '{:.1f}'.format(r['peak_bytes'] / 2 ** 20),
+            '{:.3g}'.format(r['items_per_second']),
+            '' if r['entries'] is None else r['entries']), file=file)
+
+
+def main(arg_list):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, nargs='+',
+                        default=[10 ** 3, 10 ** 4, 10 ** 5])
+    parser.add_argument('--vocabulary', type=int, default=10 ** 4)
+    parser.add_argument('--depth', type=int, default=2)
+    parser.add_argument('--size', type=int, default=10 ** 4,
+                        help='generated tokens')
+    parser.add_argument('--output', help='json file for results')
+    parser.add_argument('--baseline', help='json file of earlier results')
+    parser.add_argument('--tolerance', type=float, default=1.5)
+    args = parser.parse_args(arg_list)
+
+    records = []
+    for lines in args.lines:
+        records += benchmark(lines, args.vocabulary, args.depth, args.size)
+
+    print_records(records)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(records, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(records, json.load(f), args.tolerance)
+        if slower:
+            print('\nslower than baseline:', file=sys.stderr)
+            print_records(slower, file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])